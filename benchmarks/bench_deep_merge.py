@@ -0,0 +1,150 @@
+"""
+Compare utils.deep_merge with the previous implementation
+(deepcopy on every return, list union by linear scan).
+
+    python benchmarks/bench_deep_merge.py --fragments 2 10 50 --list-size 10 100 1000
+
+Every case folds ``fragments`` overlays of a service into
+one, the way merge_services does: ``--list-size`` is the
+length of the environment/volume lists of every fragment
+(half of the items are shared with the previous fragment).
+The nested case merges dicts of increasing depth.
+"""
+import argparse
+import copy
+import statistics
+import time
+
+from docker_compose_graph.utils import deep_merge, merge_into
+from docker_compose_graph.yaml_tags.overrides import OverrideArray
+
+
+def legacy_deep_merge(dict1, dict2):
+    """utils.deep_merge before the copy-free rewrite"""
+    for key in dict2:
+        if key in dict1 and isinstance(dict1[key], dict) and isinstance(dict2[key], dict):
+            legacy_deep_merge(dict1[key], dict2[key])
+        else:
+            if isinstance(dict2[key], list):
+                if key in dict1:
+                    for item in dict2[key]:
+                        if item not in dict1[key]:
+                            dict1[key].append(item)
+                else:
+                    dict1[key] = dict2[key]
+            elif isinstance(dict2[key], OverrideArray):
+                dict1[key] = dict2[key]
+            else:
+                dict1[key] = dict2[key]
+    return copy.deepcopy(dict1)
+
+
+def fragment(i: int, list_size: int) -> dict:
+    offset = i * list_size // 2
+    return {
+        "service_name": "service",
+        "service_config": {
+            "image": f"image:{i}",
+            "environment": {f"VAR_{j}": f"value_{j}" for j in range(offset, offset + list_size)},
+            "volumes": [f"./data/{j}:/data/{j}" for j in range(offset, offset + list_size)],
+            "ports": [
+                {"target": 8000 + j, "published": 10000 + j}
+                for j in range(offset, offset + min(list_size, 50))
+            ],
+            "labels": [f"label-{j}" for j in range(offset, offset + list_size)],
+        },
+    }
+
+
+def nested(depth: int, i: int) -> dict:
+    tree = {"leaf": [i, i + 1], "value": i}
+    for level in range(depth):
+        tree = {f"level-{level}": tree, f"value-{level}": i}
+    return tree
+
+
+def fold_legacy(fragments: list[dict]) -> dict:
+    merged = dict()
+    for f in fragments:
+        merged = legacy_deep_merge(merged, f)
+    return merged
+
+
+def fold_deep_merge(fragments: list[dict]) -> dict:
+    merged = dict()
+    for f in fragments:
+        merged = deep_merge(merged, f)
+    return merged
+
+
+def fold_merge_into(fragments: list[dict]) -> dict:
+    merged = dict()
+    for f in fragments:
+        merge_into(merged, f)
+    return merged
+
+
+FUNCS = {
+    "legacy": fold_legacy,
+    "deep_merge": fold_deep_merge,
+    "merge_into": fold_merge_into,
+}
+
+
+def bench(fragments: list[dict], repeat: int) -> dict[str, float]:
+
+    # legacy_deep_merge modifies its first argument;
+    # every run gets fresh inputs
+    reference = fold_legacy(copy.deepcopy(fragments))
+
+    timings = {}
+    for name, func in FUNCS.items():
+        runs = []
+        for _ in range(repeat):
+            inputs = copy.deepcopy(fragments)
+            start = time.perf_counter()
+            result = func(inputs)
+            runs.append(time.perf_counter() - start)
+        assert repr(result) == repr(reference), name
+        timings[name] = statistics.median(runs)
+
+    return timings
+
+
+def print_row(case: str, timings: dict[str, float]) -> None:
+    print(
+        f"{case:>28} "
+        + " ".join(f"{timings[name]:>11.5f}s" for name in FUNCS)
+        + f" {timings['legacy'] / timings['merge_into']:>9.1f}x"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("--fragments", type=int, nargs="+", default=[2, 10, 50])
+    parser.add_argument("--list-size", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--depth", type=int, nargs="+", default=[5, 20, 100])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'case':>28} " + " ".join(f"{name:>12}" for name in FUNCS) + f" {'speedup':>10}")
+
+    for fragments in args.fragments:
+        for list_size in args.list_size:
+            print_row(
+                f"fragments={fragments} lists={list_size}",
+                bench([fragment(i, list_size) for i in range(fragments)], args.repeat),
+            )
+
+    for depth in args.depth:
+        print_row(
+            f"nested depth={depth}",
+            bench([nested(depth, i) for i in range(10)], args.repeat),
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+"""
+Time every phase of a build on synthetic projects
+(see synthetic.py) of increasing size.
+
+    python benchmarks/bench_scaling.py --services 10 100 1000 5000 --output scaling.json
+    python benchmarks/bench_scaling.py --compare scaling.json
+
+Phases, each timed on its own (median of ``--repeat`` runs):
+
+- parse_docker_compose: loading all files of the include tree
+- iterate_trees:        extraction, merging and interpolation
+                        (without get_primary_graph)
+- get_primary_graph:    graph assembly, incl. service labels
+- dot_serialization:    graph.to_string()
+
+Sub-phases recorded by DockerComposeGraph.stats (merge_services,
+service_labels, ...) and the graph counters are stored in the
+JSON output as well. ``--compare`` prints the ratio of every
+phase against a previous JSON output.
+"""
+import argparse
+import json
+import logging
+import pathlib
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+from synthetic import generate_project
+
+from docker_compose_graph.cache import LabelCache
+from docker_compose_graph.docker_compose_graph import DockerComposeGraph, setup_logging
+from docker_compose_graph.yaml_tags.loader import LOADER_VERSION
+
+
+PHASES = (
+    "parse_docker_compose",
+    "iterate_trees",
+    "get_primary_graph",
+    "dot_serialization",
+)
+
+
+def run_once(yaml: pathlib.Path, include_workers: int) -> tuple[dict, dict]:
+
+    # Cold labels: every repetition renders all of them
+    dcg = DockerComposeGraph(include_workers=include_workers, label_cache=LabelCache())
+
+    timings = {}
+
+    start = time.perf_counter()
+    trees = dcg.parse_docker_compose(yaml=yaml)
+    timings["parse_docker_compose"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    dcg.iterate_trees(trees)
+    iterate_trees = time.perf_counter() - start
+
+    stats = dcg.stats.as_dict()
+    timings["get_primary_graph"] = stats["timings"]["graph_assembly"]
+    timings["iterate_trees"] = iterate_trees - timings["get_primary_graph"]
+
+    start = time.perf_counter()
+    dot = dcg.graph.to_string()
+    timings["dot_serialization"] = time.perf_counter() - start
+
+    counters = dict(stats["counters"])
+    counters["dot_bytes"] = len(dot.encode())
+
+    return timings, {"timings": stats["timings"], "counters": counters}
+
+
+def bench(args: argparse.Namespace, services: int, tmp: pathlib.Path) -> dict:
+
+    root = tmp / f"project-{services}"
+    yaml = generate_project(
+        root=root,
+        services=services,
+        include_depth=args.include_depth,
+        include_fanout=args.include_fanout,
+        ports=args.ports,
+        volumes=args.volumes,
+        networks=args.networks,
+        environment=args.environment,
+        depends_on_density=args.depends_on_density,
+        overlay_ratio=args.overlay_ratio,
+        seed=args.seed,
+    )
+
+    runs = [run_once(yaml, args.include_workers) for _ in range(args.repeat)]
+
+    return {
+        "services": services,
+        "files": len(list(root.rglob("*.yaml"))),
+        "timings": {
+            phase: statistics.median(timings[phase] for timings, _ in runs)
+            for phase in PHASES
+        },
+        # Of the last run
+        "stats": runs[-1][1],
+    }
+
+
+def format_header() -> str:
+    return f"{'services':>10} {'files':>6} " + " ".join(f"{phase:>22}" for phase in PHASES)
+
+
+def format_row(result: dict, baseline: dict[int, dict] = None) -> str:
+
+    previous = (baseline or {}).get(result["services"], None)
+
+    cells = []
+    for phase in PHASES:
+        seconds = result["timings"][phase]
+        cell = f"{seconds:.4f}s"
+        if previous is not None and previous["timings"].get(phase):
+            cell += f" ({seconds / previous['timings'][phase]:.2f}x)"
+        cells.append(f"{cell:>22}")
+
+    return f"{result['services']:>10} {result['files']:>6} " + " ".join(cells)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("--services", type=int, nargs="+", default=[10, 100, 1000, 5000])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--include-depth", type=int, default=1)
+    parser.add_argument("--include-fanout", type=int, default=2)
+    parser.add_argument("--ports", type=int, default=1)
+    parser.add_argument("--volumes", type=int, default=2)
+    parser.add_argument("--networks", type=int, default=3)
+    parser.add_argument("--environment", type=int, default=10)
+    parser.add_argument("--depends-on-density", type=float, default=0.1)
+    parser.add_argument("--overlay-ratio", type=float, default=0.1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--include-workers", type=int, default=1)
+    parser.add_argument("--output", type=pathlib.Path, default=None, help="Write the results as JSON")
+    parser.add_argument("--compare", type=pathlib.Path, default=None, help="Previous JSON output")
+    args = parser.parse_args()
+
+    # The package logs at DEBUG by default
+    setup_logging(logging.WARNING, force=True)
+
+    baseline = None
+    if args.compare is not None:
+        with open(args.compare) as fr:
+            baseline = {r["services"]: r for r in json.load(fr)["results"]}
+
+    print(format_header())
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for services in args.services:
+            results.append(bench(args, services, pathlib.Path(tmp)))
+            print(format_row(results[-1], baseline), flush=True)
+
+    if args.output is not None:
+        with open(args.output, "w") as fw:
+            json.dump(
+                {
+                    "meta": {
+                        "python": sys.version,
+                        "platform": platform.platform(),
+                        "loader": LOADER_VERSION,
+                        "parameters": {
+                            k: v for k, v in vars(args).items()
+                            if k not in ("output", "compare")
+                        },
+                    },
+                    "results": results,
+                },
+                fw,
+                indent=2,
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""
+Compare the YAML loaders used for Compose files
+on large, generated docker-compose.yaml files.
+
+    python benchmarks/bench_yaml_loader.py --services 100 1000 5000
+
+- full_load: pyyaml.full_load (the previous loader)
+- python:    PureComposeLoader (SafeLoader, pure Python)
+- libyaml:   ComposeLoader (CSafeLoader if available)
+"""
+import argparse
+import pathlib
+import statistics
+import tempfile
+import time
+
+import yaml
+
+from docker_compose_graph.yaml_tags.loader import (
+    LIBYAML,
+    ComposeLoader,
+    PureComposeLoader,
+    load_yaml,
+)
+
+
+def generate_compose(services: int) -> str:
+    lines = ["services:"]
+    for i in range(services):
+        lines.extend([
+            f"  service-{i}:",
+            f"    container_name: service-{i}",
+            f"    hostname: service-{i}",
+            "    domainname: ${ROOT_DOMAIN}",
+            f"    image: registry.example.com/service-{i}:latest",
+            "    restart: unless-stopped",
+            "    networks:",
+            "      - backend",
+            "      - frontend",
+            "    environment:",
+            *[f"      - VAR_{j}=value_{i}_{j}" for j in range(10)],
+            "    ports: !override",
+            f"      - ${{PORT_HOST_{i}}}:{8000 + i % 1000}",
+            "    volumes:",
+            f"      - ./configs/service-{i}.ini:/etc/service.ini:ro",
+            "      - ${NFS_ENTRY_POINT}:${NFS_ENTRY_POINT}:ro",
+            "    command: >",
+            f"      --serve --port {8000 + i % 1000} --verbose",
+        ])
+        if i:
+            lines.extend([
+                "    depends_on:",
+                f"      service-{i - 1}:",
+                "        condition: service_started",
+            ])
+    return "\n".join(lines) + "\n"
+
+
+def _full_load(fr):
+    return yaml.full_load(fr)
+
+
+def _python_load(fr):
+    return load_yaml(fr, loader=PureComposeLoader)
+
+
+def _libyaml_load(fr):
+    return load_yaml(fr, loader=ComposeLoader)
+
+
+def bench(path: pathlib.Path, func, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        with open(path, "rb") as fr:
+            start = time.perf_counter()
+            func(fr)
+            timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--services", type=int, nargs="+", default=[100, 1000, 5000])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"libyaml available: {LIBYAML}")
+    print(f"{'services':>10} {'size (KiB)':>12} {'full_load':>12} {'python':>12} {'libyaml':>12} {'speedup':>9}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for services in args.services:
+            path = pathlib.Path(tmp) / f"docker-compose.{services}.yaml"
+            path.write_text(generate_compose(services))
+
+            # all loaders must agree on the result
+            with open(path, "rb") as fr:
+                reference = _python_load(fr)
+            with open(path, "rb") as fr:
+                assert repr(_libyaml_load(fr)) == repr(reference)
+
+            t_full = bench(path, _full_load, args.repeat)
+            t_python = bench(path, _python_load, args.repeat)
+            t_libyaml = bench(path, _libyaml_load, args.repeat)
+
+            print(
+                f"{services:>10} {path.stat().st_size / 1024:>12.1f} "
+                f"{t_full:>11.3f}s {t_python:>11.3f}s {t_libyaml:>11.3f}s "
+                f"{t_full / t_libyaml:>8.1f}x"
+            )
+
+
+if __name__ == "__main__":
+    main()
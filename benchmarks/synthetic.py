@@ -0,0 +1,176 @@
+"""
+Generator for synthetic Docker Compose projects.
+
+    from synthetic import generate_project
+
+    root = generate_project(
+        pathlib.Path("/tmp/project"),
+        services=1000,
+        include_depth=2,
+        include_fanout=3,
+    )
+
+Services are spread round-robin over a tree of included
+files (``include_depth`` levels, ``include_fanout`` includes
+per file). A share of the services (``overlay_ratio``) gets
+an additional fragment in another file, so merging is
+exercised too. Everything is deterministic for a given
+``seed``.
+"""
+import pathlib
+import random
+
+import yaml
+
+
+__all__ = [
+    "generate_services",
+    "generate_project",
+]
+
+
+def _service(
+        i: int,
+        rnd: random.Random,
+        ports: int,
+        volumes: int,
+        networks: int,
+        environment: int,
+        depends_on_density: float,
+) -> dict:
+
+    config = {
+        "container_name": f"service-{i}",
+        "hostname": f"service-{i}",
+        "domainname": "${ROOT_DOMAIN:-example.com}",
+        "image": f"registry.example.com/service-{i}:${{TAG:-latest}}",
+        "restart": "unless-stopped",
+        "command": ["--serve", "--port", str(8000 + i % 1000)],
+    }
+
+    if networks:
+        config["networks"] = [f"network-{(i + n) % networks}" for n in range(min(networks, 3))]
+
+    if environment:
+        config["environment"] = [f"VAR_{j}=value_{i}_{j}" for j in range(environment)]
+
+    if ports:
+        config["ports"] = [
+            f"{10000 + (i * ports + p) % 50000}:{8000 + p}" for p in range(ports)
+        ]
+
+    if volumes:
+        config["volumes"] = [
+            f"./data/service-{i}/{v}:/data/{v}" if v % 2 else f"/srv/shared/{v}:/shared/{v}:ro"
+            for v in range(volumes)
+        ]
+
+    depends_on = {
+        f"service-{j}": {"condition": "service_started"}
+        for j in range(max(0, i - 20), i)
+        if rnd.random() < depends_on_density
+    }
+    if depends_on:
+        config["depends_on"] = depends_on
+
+    return config
+
+
+def generate_services(
+        services: int,
+        ports: int = 1,
+        volumes: int = 2,
+        networks: int = 3,
+        environment: int = 10,
+        depends_on_density: float = 0.1,
+        seed: int = 0,
+) -> dict[str, dict]:
+    """Service configs of a synthetic project"""
+
+    rnd = random.Random(seed)
+
+    return {
+        f"service-{i}": _service(
+            i=i,
+            rnd=rnd,
+            ports=ports,
+            volumes=volumes,
+            networks=networks,
+            environment=environment,
+            depends_on_density=depends_on_density,
+        )
+        for i in range(services)
+    }
+
+
+def generate_project(
+        root: pathlib.Path,
+        services: int,
+        include_depth: int = 1,
+        include_fanout: int = 2,
+        ports: int = 1,
+        volumes: int = 2,
+        networks: int = 3,
+        environment: int = 10,
+        depends_on_density: float = 0.1,
+        overlay_ratio: float = 0.1,
+        seed: int = 0,
+) -> pathlib.Path:
+    """
+    Write a synthetic project to ``root`` and
+    return the path of the root compose file.
+    """
+
+    rnd = random.Random(seed)
+
+    # Include tree, breadth first: files[0] is the root
+    files: list[pathlib.Path] = [pathlib.Path("docker-compose.yaml")]
+    includes: dict[pathlib.Path, list[pathlib.Path]] = {files[0]: []}
+    level = [files[0]]
+    for depth in range(include_depth):
+        next_level = []
+        for parent in level:
+            for _ in range(include_fanout):
+                child = pathlib.Path(f"level-{depth + 1}") / f"docker-compose.{len(files)}.yaml"
+                files.append(child)
+                includes[parent].append(child)
+                includes[child] = []
+                next_level.append(child)
+        level = next_level
+
+    trees: dict[pathlib.Path, dict] = {f: {} for f in files}
+
+    for i, (name, config) in enumerate(generate_services(
+            services=services,
+            ports=ports,
+            volumes=volumes,
+            networks=networks,
+            environment=environment,
+            depends_on_density=depends_on_density,
+            seed=seed,
+    ).items()):
+        trees[files[i % len(files)]].setdefault("services", {})[name] = config
+
+        if rnd.random() < overlay_ratio:
+            overlay = files[rnd.randrange(len(files))]
+            trees[overlay].setdefault("services", {}).setdefault(name, {
+                "restart": "always",
+                "labels": [f"overlay={overlay.stem}"],
+            })
+
+    if networks:
+        trees[files[0]]["networks"] = {f"network-{n}": {} for n in range(networks)}
+
+    for f in files:
+        tree = trees[f]
+        if includes[f]:
+            # Include paths are relative to the including file
+            prefix = "" if f.parent == pathlib.Path(".") else "../"
+            tree["include"] = [{"path": [f"{prefix}{c.as_posix()}"]} for c in includes[f]]
+
+        path = root / f
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "w") as fw:
+            yaml.dump(tree, fw, sort_keys=False, Dumper=getattr(yaml, "CSafeDumper", yaml.SafeDumper))
+
+    return root / files[0]
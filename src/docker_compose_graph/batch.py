@@ -0,0 +1,276 @@
+"""
+Batch mode: render many compose projects in one invocation.
+
+Projects are rendered on a process pool, so the interpreter
+start-up and imports are paid once per worker instead of once
+per project. A failing project never affects the others; all
+outcomes are collected into a summary.
+
+A manifest is a YAML (or JSON) list of projects::
+
+    - yaml: site-a/docker-compose.yaml
+      outfile: out/site-a.svg
+      format: svg  # or a list, e.g. [svg, png]
+      dot_env: site-a/.env  # optional
+
+Relative paths are relative to the manifest. With several
+formats, the suffix of ``outfile`` is replaced per format.
+"""
+import argparse
+import copy
+import dataclasses
+import logging
+import os
+import pathlib
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from typing import Union
+
+from docker_compose_graph.layout import FORMATS, output_paths
+from docker_compose_graph.yaml_tags.loader import load_yaml
+
+
+__all__ = [
+    "Job",
+    "JobResult",
+    "jobs_from_args",
+    "load_manifest",
+    "run_batch",
+    "format_summary",
+]
+
+
+_logger = logging.getLogger(__name__)
+
+
+@dataclasses.dataclass
+class Job:
+    yaml: pathlib.Path
+    outfile: pathlib.Path
+    formats: tuple[str, ...]
+    dot_env: Union[pathlib.Path, None] = None
+
+
+@dataclasses.dataclass
+class JobResult:
+    job: Job
+    ok: bool
+    seconds: float
+    error: Union[str, None] = None
+
+
+def load_manifest(
+        manifest: pathlib.Path,
+        default_formats: Union[list[str], None] = None,
+) -> list[Job]:
+
+    with open(manifest, "rb") as fr:
+        entries = load_yaml(fr) or []
+
+    if not isinstance(entries, list):
+        raise ValueError(f"{manifest}: expected a list of projects")
+
+    root = manifest.parent
+
+    def _path(value) -> Union[pathlib.Path, None]:
+        if value is None:
+            return None
+        return root / pathlib.Path(value)
+
+    def _formats(value) -> tuple[str, ...]:
+        if value is None:
+            return tuple(default_formats or ())
+        if isinstance(value, str):
+            return (value,)
+        return tuple(value)
+
+    def _check_formats(index: int, formats: tuple[str, ...]) -> None:
+        if not formats:
+            raise ValueError(f"{manifest}: project #{index} has no format")
+        unknown = [format_ for format_ in formats if format_ not in FORMATS]
+        if unknown:
+            raise ValueError(
+                f"{manifest}: project #{index} has unknown format(s) {', '.join(map(str, unknown))} "
+                f"(one of {', '.join(FORMATS)})"
+            )
+
+    jobs = []
+    for index, entry in enumerate(entries):
+        try:
+            jobs.append(
+                Job(
+                    yaml=_path(entry["yaml"]),
+                    outfile=_path(entry["outfile"]),
+                    formats=_formats(entry.get("format", None)),
+                    dot_env=_path(entry.get("dot_env", None)),
+                )
+            )
+        except (KeyError, TypeError) as e:
+            raise ValueError(f"{manifest}: invalid project #{index}: {entry!r}") from e
+
+        _check_formats(index, jobs[-1].formats)
+
+    _check_outputs(jobs, origin=manifest)
+
+    return jobs
+
+
+def _check_outputs(jobs: list[Job], origin: Union[pathlib.Path, str]) -> None:
+    """Projects writing to the same file would overwrite each other"""
+
+    seen: dict[pathlib.Path, Job] = {}
+    for job in jobs:
+        for path in output_paths(job.outfile, job.formats).values():
+            other = seen.setdefault(path.resolve(), job)
+            if other is not job:
+                raise ValueError(f"{origin}: {other.yaml} and {job.yaml} are both written to {path}")
+
+
+def jobs_from_args(args: argparse.Namespace) -> list[Job]:
+    """
+    One job per ``--yaml``. ``--outfile`` is the output
+    directory; outputs are named after the project
+    directory and compose file
+    (``<outfile>/<dir>.<stem>.<format>``, one per format).
+    Projects in directories of the same name get as many
+    parent directories as it takes to tell them apart
+    (``<outfile>/<parent>.<dir>.<stem>.<format>``).
+    """
+
+    paths = [yaml.resolve() for yaml in args.yamls]
+    # Parent directories, innermost first
+    parents = [path.parent.parts[:0:-1] for path in paths]
+    depths = [1] * len(paths)
+
+    def name(i: int) -> str:
+        return ".".join((*parents[i][:depths[i]][::-1], paths[i].stem))
+
+    while True:
+        groups: dict[str, list[int]] = {}
+        for i in range(len(paths)):
+            groups.setdefault(name(i), []).append(i)
+
+        collisions = [indices for indices in groups.values() if len(indices) > 1]
+        if not collisions:
+            break
+
+        for indices in collisions:
+            if all(depths[i] >= len(parents[i]) for i in indices):
+                raise ValueError(
+                    f"--yaml: {', '.join(args.yamls[i].as_posix() for i in indices)} "
+                    f"would be written to the same output"
+                )
+            for i in indices:
+                depths[i] = min(depths[i] + 1, len(parents[i]))
+
+    return [
+        Job(
+            yaml=yaml,
+            outfile=args.outfile / f"{name(i)}.{args.formats[0]}",
+            formats=tuple(args.formats),
+            dot_env=args.dot_env,
+        )
+        for i, yaml in enumerate(args.yamls)
+    ]
+
+
+def _run_job(
+        job: Job,
+        args: argparse.Namespace,
+) -> JobResult:
+    """Runs in a worker process"""
+
+    # Circular import (the CLI imports this module)
+    from docker_compose_graph.docker_compose_graph import render
+    from docker_compose_graph.cache import ParseCache, default_cache_dir
+    from docker_compose_graph.templates import TEMPLATES
+
+    args = copy.copy(args)
+    args.docker_compose_yaml = job.yaml
+    args.outfile = job.outfile
+    args.formats = list(job.formats)
+    args.dot_env = job.dot_env
+    args.stats = None
+
+    # .env files of one project must not leak into
+    # the next project rendered by the same worker
+    environ = dict(os.environ)
+
+    start = time.perf_counter()
+
+    if args.cache:
+        # Once per worker (a no-op afterwards)
+        TEMPLATES.precompile((args.cache_dir or default_cache_dir()) / "templates")
+
+    try:
+        job.outfile.parent.mkdir(parents=True, exist_ok=True)
+        render(
+            args=args,
+            cache=ParseCache(cache_dir=args.cache_dir) if args.cache else None,
+        )
+    except Exception as e:
+        _logger.debug("%s", traceback.format_exc())
+        return JobResult(
+            job=job,
+            ok=False,
+            seconds=time.perf_counter() - start,
+            error=f"{type(e).__name__}: {e}",
+        )
+    finally:
+        os.environ.clear()
+        os.environ.update(environ)
+
+    return JobResult(
+        job=job,
+        ok=True,
+        seconds=time.perf_counter() - start,
+    )
+
+
+def run_batch(
+        jobs: list[Job],
+        args: argparse.Namespace,
+        workers: Union[int, None] = None,
+) -> list[JobResult]:
+    """
+    Render all ``jobs`` on ``workers`` processes
+    (one per CPU by default). Results are returned
+    in the order of ``jobs``.
+    """
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(_run_job, job, args) for job in jobs]
+
+        results = []
+        for job, future in zip(jobs, futures):
+            try:
+                results.append(future.result())
+            except Exception as e:
+                # The worker itself died (BrokenProcessPool, ...)
+                results.append(
+                    JobResult(
+                        job=job,
+                        ok=False,
+                        seconds=0.0,
+                        error=f"{type(e).__name__}: {e}",
+                    )
+                )
+
+    return results
+
+
+def format_summary(results: list[JobResult]) -> str:
+
+    lines = []
+    for result in results:
+        status = "ok" if result.ok else "FAILED"
+        line = f"{status:<7} {result.seconds:>8.2f}s  {result.job.yaml.as_posix()} -> {result.job.outfile.as_posix()}"
+        if result.error is not None:
+            line += f"\n{'':<18}{result.error}"
+        lines.append(line)
+
+    failed = len([r for r in results if not r.ok])
+    lines.append(f"{len(results) - failed} succeeded, {failed} failed")
+
+    return "\n".join(lines)
@@ -0,0 +1,468 @@
+"""
+Persistent, content-addressed cache for parsed compose files.
+
+Entries are keyed by the SHA-256 of the file content plus
+the loader version (see :data:`LOADER_VERSION`), so a changed
+file or a changed loader never hits a stale entry. Parsed
+trees are stored as JSON, which is much faster to load than
+YAML; the types JSON lacks (non-string keys, ``!override``,
+dates, ...) are tagged explicitly. Unlike pickle, loading an
+entry never runs code, whoever wrote the cache directory.
+The cache is capped in size; the least recently used
+entries are evicted first (a hit refreshes an entry's mtime).
+
+:class:`StatCache` is an in-memory variant for long running
+processes (``--watch``), keyed by path and ``stat()`` signature
+so unchanged files are not even read again.
+
+:class:`PathCache` memoizes filesystem lookups (``resolve()``,
+``lstat()``) for the duration of one build; many services
+share the same host paths.
+
+:class:`LabelCache` keeps rendered service labels, keyed by
+the hash of the label inputs, across builds of a process.
+
+:class:`ModelCache` keeps what a build derived from every file
+and service for the next build of the same project
+(``--watch``), so only the services declared in changed files
+are merged and modelled again.
+"""
+import base64
+import datetime
+import hashlib
+import json
+import logging
+import os
+import pathlib
+import pickle
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Any, Iterable, Mapping, Union
+
+from docker_compose_graph.yaml_tags.loader import LOADER_VERSION, load_yaml
+from docker_compose_graph.yaml_tags.overrides import OverrideArray
+
+
+__all__ = [
+    "DEFAULT_CACHE_MAX_SIZE",
+    "default_cache_dir",
+    "ParseCache",
+    "StatCache",
+    "PathCache",
+    "DEFAULT_LABEL_CACHE_SIZE",
+    "LabelCache",
+    "ModelCache",
+]
+
+
+_logger = logging.getLogger(__name__)
+
+
+DEFAULT_CACHE_MAX_SIZE = 256 * 1024 * 1024  # bytes
+
+DEFAULT_LABEL_CACHE_SIZE = 8192  # labels
+
+_SUFFIX = ".json"
+
+# Entries written by earlier versions, never read
+_LEGACY_SUFFIX = ".pickle"
+
+# Returned by ParseCache.get on a miss (a tree can be None)
+_MISSING = object()
+
+
+def default_cache_dir() -> pathlib.Path:
+    """
+    ``$XDG_CACHE_HOME/docker-compose-graph``
+    (``~/.cache/docker-compose-graph`` by default)
+    """
+    xdg_cache_home = os.environ.get("XDG_CACHE_HOME", None)
+    if xdg_cache_home:
+        root = pathlib.Path(xdg_cache_home)
+    else:
+        root = pathlib.Path.home() / ".cache"
+    return root / "docker-compose-graph"
+
+
+class ParseCache:
+
+    def __init__(
+            self,
+            cache_dir: Union[pathlib.Path, None] = None,
+            max_size: int = DEFAULT_CACHE_MAX_SIZE,
+    ):
+        self.cache_dir: pathlib.Path = cache_dir or default_cache_dir()
+        self.max_size = max_size
+
+        self.hits = 0
+        self.misses = 0
+
+        self._dirty = False
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(data: bytes) -> str:
+        digest = hashlib.sha256(LOADER_VERSION.encode())
+        digest.update(b"\0")
+        digest.update(data)
+        return digest.hexdigest()
+
+    def _path(self, key: str) -> pathlib.Path:
+        return self.cache_dir / key[:2] / f"{key}{_SUFFIX}"
+
+    def get(self, key: str, default=None):
+        """Returns the cached tree or ``default``."""
+
+        path = self._path(key)
+
+        try:
+            with open(path, "rb") as fr:
+                tree = json.load(fr, object_hook=_decode_tagged)
+        except FileNotFoundError:
+            return default
+        except Exception as e:
+            _logger.warning("Dropping corrupt cache entry %s: %s", path, e)
+            path.unlink(missing_ok=True)
+            return default
+
+        try:
+            # LRU: mark as recently used
+            os.utime(path)
+        except OSError:
+            pass
+
+        return tree
+
+    def put(self, key: str, tree) -> None:
+
+        path = self._path(key)
+
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            # Write to a temporary file first so concurrent
+            # readers never see a partially written entry.
+            data = json.dumps(_encode(tree), separators=(",", ":")).encode()
+            fd, tmp = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+            with os.fdopen(fd, "wb") as fw:
+                fw.write(data)
+            os.replace(tmp, path)
+        except (OSError, TypeError) as e:
+            _logger.warning("Could not write cache entry %s: %s", path, e)
+            return
+
+        self._dirty = True
+
+    def load(self, abs_yaml: pathlib.Path):
+        """
+        Returns the parsed tree of ``abs_yaml``. YAML is only
+        parsed if the file content is not in the cache yet.
+        """
+
+        with open(abs_yaml, "rb") as fr:
+            data = fr.read()
+
+        key = self.key(data)
+
+        tree = self.get(key, _MISSING)
+        if tree is not _MISSING:
+            with self._lock:
+                self.hits += 1
+            _logger.debug("Cache hit for %s (%s)", abs_yaml, key)
+            return tree
+
+        with self._lock:
+            self.misses += 1
+
+        tree = load_yaml(data)
+        self.put(key, tree)
+
+        return tree
+
+    def prune(self) -> None:
+        """
+        Evict the least recently used entries until
+        the cache is within ``max_size``.
+        """
+
+        with self._lock:
+            if not self._dirty:
+                return
+            self._dirty = False
+
+            for path in self.cache_dir.glob(f"*/*{_LEGACY_SUFFIX}"):
+                path.unlink(missing_ok=True)
+
+            entries = []
+            total = 0
+            for path in self.cache_dir.glob(f"*/*{_SUFFIX}"):
+                try:
+                    stat = path.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+
+            if total <= self.max_size:
+                return
+
+            for _mtime, size, path in sorted(entries):
+                path.unlink(missing_ok=True)
+                total -= size
+                _logger.debug("Evicted cache entry %s", path)
+                if total <= self.max_size:
+                    break
+
+
+def _encode(value):
+    """
+    ``value`` (a parsed tree) as JSON data. Types JSON does
+    not have are wrapped in a single-key object with a
+    ``!`` tag, see :func:`_decode_tagged`.
+    """
+
+    if value is None or isinstance(value, (str, bool, int, float)):
+        return value
+    if isinstance(value, dict):
+        if all(isinstance(k, str) and not k.startswith("!") for k in value):
+            return {k: _encode(v) for k, v in value.items()}
+        return {"!map": [[_encode(k), _encode(v)] for k, v in value.items()]}
+    if isinstance(value, list):
+        return [_encode(v) for v in value]
+    if isinstance(value, tuple):
+        return {"!tuple": [_encode(v) for v in value]}
+    if isinstance(value, OverrideArray):
+        return {"!override": _encode(value.array)}
+    if isinstance(value, set):
+        return {"!set": [_encode(v) for v in value]}
+    if isinstance(value, bytes):
+        return {"!bytes": base64.b64encode(value).decode()}
+    # datetime is a date
+    if isinstance(value, datetime.datetime):
+        return {"!datetime": value.isoformat()}
+    if isinstance(value, datetime.date):
+        return {"!date": value.isoformat()}
+    raise TypeError(f"Cannot cache {type(value).__name__}: {value!r}")
+
+
+_DECODERS = {
+    "!map": lambda items: {k: v for k, v in items},
+    "!tuple": tuple,
+    "!override": OverrideArray,
+    "!set": set,
+    "!bytes": base64.b64decode,
+    "!datetime": datetime.datetime.fromisoformat,
+    "!date": datetime.date.fromisoformat,
+}
+
+
+def _decode_tagged(obj: dict):
+    """``object_hook`` reversing :func:`_encode`"""
+
+    if len(obj) == 1:
+        tag, value = next(iter(obj.items()))
+        if tag.startswith("!"):
+            try:
+                return _DECODERS[tag](value)
+            except KeyError:
+                raise ValueError(f"Unknown tag: {tag}") from None
+    return obj
+
+
+class StatCache:
+    """
+    In-memory cache of parsed trees keyed by path and
+    (mtime, size). A file is only read and parsed again
+    if its stat signature changed; misses are delegated
+    to ``fallback`` (a :class:`ParseCache`) if given.
+    Trees are kept pickled so every load returns a
+    fresh copy that callers are free to mutate.
+    """
+
+    def __init__(
+            self,
+            fallback: Union[ParseCache, None] = None,
+    ):
+        self.fallback = fallback
+
+        self.hits = 0
+        self.misses = 0
+
+        self._entries: dict[pathlib.Path, tuple[tuple[int, int], bytes]] = {}
+        self._used: set[pathlib.Path] = set()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def signature(abs_yaml: pathlib.Path) -> tuple[int, int]:
+        stat = abs_yaml.stat()
+        return stat.st_mtime_ns, stat.st_size
+
+    def load(self, abs_yaml: pathlib.Path):
+
+        signature = self.signature(abs_yaml)
+
+        with self._lock:
+            self._used.add(abs_yaml)
+            entry = self._entries.get(abs_yaml, None)
+            if entry is not None and entry[0] == signature:
+                self.hits += 1
+                return pickle.loads(entry[1])
+            self.misses += 1
+
+        if self.fallback is not None:
+            tree = self.fallback.load(abs_yaml)
+        else:
+            with open(abs_yaml, "rb") as fr:
+                tree = load_yaml(fr)
+
+        with self._lock:
+            self._entries[abs_yaml] = (
+                signature,
+                pickle.dumps(tree, protocol=pickle.HIGHEST_PROTOCOL),
+            )
+
+        return tree
+
+    def prune(self) -> None:
+        """
+        Forget files that were not loaded since the
+        last call (i.e. are not included anymore).
+        """
+
+        with self._lock:
+            for abs_yaml in set(self._entries) - self._used:
+                del self._entries[abs_yaml]
+            self._used.clear()
+
+        if self.fallback is not None:
+            self.fallback.prune()
+
+
+class PathCache:
+    """
+    Per-build memo of ``resolve()`` and symlink lookups.
+    Not invalidated: create a new one for every build.
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+
+        self._resolved: dict[pathlib.Path, pathlib.Path] = {}
+        self._symlinks: dict[pathlib.Path, bool] = {}
+
+    def is_symlink(self, path: pathlib.Path) -> bool:
+        try:
+            ret = self._symlinks[path]
+            self.hits += 1
+            return ret
+        except KeyError:
+            self.misses += 1
+        ret = self._symlinks[path] = path.is_symlink()
+        return ret
+
+    def resolve(self, path: pathlib.Path) -> pathlib.Path:
+        try:
+            ret = self._resolved[path]
+            self.hits += 1
+            return ret
+        except KeyError:
+            self.misses += 1
+        ret = self._resolved[path] = path.resolve()
+        return ret
+
+    def absolute(
+            self,
+            path: Union[str, pathlib.Path],
+            base: pathlib.Path,
+    ) -> pathlib.Path:
+        """
+        ``path`` relative to ``base``, resolved. Symlinks are
+        kept (normalized, not followed) so the graph shows
+        the path as declared.
+        """
+
+        # Normalized first (no syscall), so ../a and ./a
+        # from different directories share one entry
+        path = pathlib.Path(os.path.normpath(base / pathlib.Path(path).expanduser()))
+        if self.is_symlink(path):
+            return path
+        return self.resolve(path)
+
+
+class LabelCache:
+    """
+    LRU cache of rendered labels. Keys are content hashes of
+    everything a label is rendered from, so a key never maps
+    to a stale label and nothing has to be invalidated.
+    """
+
+    def __init__(
+            self,
+            max_size: int = DEFAULT_LABEL_CACHE_SIZE,
+    ):
+        self.max_size = max_size
+
+        self.hits = 0
+        self.misses = 0
+
+        self._labels: OrderedDict[str, str] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._labels)
+
+    def get(self, key: str) -> Union[str, None]:
+        with self._lock:
+            try:
+                label = self._labels[key]
+            except KeyError:
+                self.misses += 1
+                return None
+            self._labels.move_to_end(key)
+            self.hits += 1
+            return label
+
+    def put(self, key: str, label: str) -> None:
+        with self._lock:
+            self._labels[key] = label
+            self._labels.move_to_end(key)
+            while len(self._labels) > self.max_size:
+                self._labels.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._labels.clear()
+
+
+class ModelCache:
+    """
+    Results of the previous build of a project. A file is
+    visited again only once it is reported as changed
+    (:meth:`invalidate`); a service is merged, interpolated
+    and modelled again only if one of its fragments comes
+    from a file visited again. Everything is dropped when
+    the environment changed, since both extraction and
+    interpolation depend on it.
+    """
+
+    def __init__(self):
+        self.environ: Union[dict[str, str], None] = None
+
+        # path -> (service fragments, aspect -> service_name -> value)
+        self.files: dict[pathlib.Path, tuple[list[dict], dict[str, dict]]] = {}
+        # service_name -> (fragments, merged service, Service, content hash or None)
+        self.services: dict[str, tuple[list[dict], dict, Any, Union[str, None]]] = {}
+
+    def invalidate(self, changed: Iterable[pathlib.Path]) -> None:
+        """Forget the results of the ``changed`` files"""
+        for path in changed:
+            self.files.pop(path, None)
+
+    def check_environ(self, environ: Mapping[str, str]) -> None:
+        """Forget everything if ``environ`` changed since the last build"""
+        environ = dict(environ)
+        if environ != self.environ:
+            self.files.clear()
+            self.services.clear()
+            self.environ = environ
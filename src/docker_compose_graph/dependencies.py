@@ -0,0 +1,238 @@
+"""
+The ``depends_on`` relation of a project as an indexed graph.
+
+Answers "what does X transitively need" and "what breaks
+if Y is down" without building the pydot graph::
+
+    graph = DependencyGraph.from_model(dcg.model)
+    graph.upstream_closure(["web"])
+    graph.downstream_closure(["db"])
+    graph.levels()
+    graph.cycles()
+    graph.connected_components()
+
+Neighbours are looked up in dicts of tuples (O(1) per
+service). Services that are depended on but not declared
+are nodes too (see :attr:`DependencyGraph.missing`).
+"""
+from typing import Iterable
+
+from docker_compose_graph.model import Service
+
+
+__all__ = [
+    "DependencyGraph",
+]
+
+
+class DependencyGraph:
+
+    def __init__(
+            self,
+            edges: dict[str, Iterable[str]],
+    ):
+        """
+        ``edges``: service -> services it depends on,
+        in declaration order.
+        """
+
+        # service -> services it depends on
+        self.upstream: dict[str, tuple[str, ...]] = {}
+        # service -> services depending on it
+        self.downstream: dict[str, tuple[str, ...]] = {}
+
+        downstream: dict[str, list[str]] = {}
+
+        for service, dependencies in edges.items():
+            self.upstream[service] = tuple(dict.fromkeys(dependencies))
+            downstream.setdefault(service, [])
+            for dependency in self.upstream[service]:
+                downstream.setdefault(dependency, []).append(service)
+
+        self.missing: tuple[str, ...] = tuple(
+            service for service in downstream if service not in self.upstream
+        )
+        for service in self.missing:
+            self.upstream[service] = ()
+
+        self.downstream = {service: tuple(dependents) for service, dependents in downstream.items()}
+
+    @classmethod
+    def from_model(cls, model: dict[str, Service]) -> "DependencyGraph":
+        return cls(
+            edges={
+                name: [dependency.service for dependency in service.depends_on]
+                for name, service in model.items()
+            }
+        )
+
+    def __contains__(self, service: str) -> bool:
+        return service in self.upstream
+
+    def __iter__(self):
+        return iter(self.upstream)
+
+    def __len__(self) -> int:
+        return len(self.upstream)
+
+    def dependencies(self, service: str) -> tuple[str, ...]:
+        """Services ``service`` depends on directly"""
+        return self.upstream[service]
+
+    def dependents(self, service: str) -> tuple[str, ...]:
+        """Services depending on ``service`` directly"""
+        return self.downstream[service]
+
+    def upstream_closure(self, services: Iterable[str]) -> set[str]:
+        """``services`` and everything they transitively depend on"""
+        return self._closure(services, self.upstream)
+
+    def downstream_closure(self, services: Iterable[str]) -> set[str]:
+        """``services`` and everything transitively depending on them"""
+        return self._closure(services, self.downstream)
+
+    def _closure(
+            self,
+            services: Iterable[str],
+            adjacency: dict[str, tuple[str, ...]],
+    ) -> set[str]:
+
+        seen = set()
+        stack = []
+
+        for service in services:
+            if service not in adjacency:
+                raise KeyError(f"Unknown service: {service}")
+            if service not in seen:
+                seen.add(service)
+                stack.append(service)
+
+        while stack:
+            for neighbour in adjacency[stack.pop()]:
+                if neighbour not in seen:
+                    seen.add(neighbour)
+                    stack.append(neighbour)
+
+        return seen
+
+    def components(self) -> list[list[str]]:
+        """
+        Strongly connected components (Tarjan), dependencies
+        before dependents. Iterative, so long chains do not
+        hit the recursion limit.
+        """
+
+        index: dict[str, int] = {}
+        lowlink: dict[str, int] = {}
+        on_stack: set[str] = set()
+        stack: list[str] = []
+        ret: list[list[str]] = []
+
+        for root in self.upstream:
+            if root in index:
+                continue
+
+            index[root] = lowlink[root] = len(index)
+            stack.append(root)
+            on_stack.add(root)
+            # (service, iterator over its dependencies)
+            work = [(root, iter(self.upstream[root]))]
+
+            while work:
+                service, dependencies = work[-1]
+
+                for dependency in dependencies:
+                    if dependency not in index:
+                        index[dependency] = lowlink[dependency] = len(index)
+                        stack.append(dependency)
+                        on_stack.add(dependency)
+                        work.append((dependency, iter(self.upstream[dependency])))
+                        break
+                    if dependency in on_stack:
+                        lowlink[service] = min(lowlink[service], index[dependency])
+                else:
+                    work.pop()
+                    if work:
+                        parent = work[-1][0]
+                        lowlink[parent] = min(lowlink[parent], lowlink[service])
+
+                    if lowlink[service] == index[service]:
+                        component = []
+                        while True:
+                            member = stack.pop()
+                            on_stack.discard(member)
+                            component.append(member)
+                            if member == service:
+                                break
+                        ret.append(component[::-1])
+
+        return ret
+
+    def connected_components(self) -> list[list[str]]:
+        """
+        Services connected by ``depends_on`` in either
+        direction, each component in declaration order
+        """
+
+        order = {service: i for i, service in enumerate(self.upstream)}
+        seen: set[str] = set()
+        ret: list[list[str]] = []
+
+        for root in self.upstream:
+            if root in seen:
+                continue
+
+            seen.add(root)
+            stack = [root]
+            component = []
+
+            while stack:
+                service = stack.pop()
+                component.append(service)
+                for neighbour in (*self.upstream[service], *self.downstream[service]):
+                    if neighbour not in seen:
+                        seen.add(neighbour)
+                        stack.append(neighbour)
+
+            ret.append(sorted(component, key=order.__getitem__))
+
+        return ret
+
+    def cycles(self) -> list[list[str]]:
+        """Components with more than one service or depending on themselves"""
+        return [
+            component for component in self.components()
+            if len(component) > 1 or component[0] in self.upstream[component[0]]
+        ]
+
+    def levels(self) -> list[list[str]]:
+        """
+        Startup order: every service comes after everything it
+        depends on, services of a level can start in parallel.
+        Services of a cycle share a level.
+        """
+
+        level: dict[str, int] = {}
+        ret: list[list[str]] = []
+
+        # Components come in reverse topological order of
+        # the condensation: dependencies are done first
+        for component in self.components():
+            members = set(component)
+            n = max(
+                (
+                    level[dependency] + 1
+                    for service in component
+                    for dependency in self.upstream[service]
+                    if dependency not in members
+                ),
+                default=0,
+            )
+            for service in component:
+                level[service] = n
+            if n == len(ret):
+                ret.append([])
+            ret[n].extend(component)
+
+        order = {service: i for i, service in enumerate(self.upstream)}
+        return [sorted(services, key=order.__getitem__) for services in ret]
@@ -73,24 +73,44 @@ fails
 
 
 """
-import copy
-import os
-import shlex
+import dataclasses
 import argparse
+import html
+import json
 import logging
+import os
 import pathlib
 import sys
-from typing import Union
-import json
-import yaml as pyyaml
+from typing import Callable, Iterable, Iterator, TextIO, Union
 import pydot
 import dotenv
 from collections import OrderedDict
-from jinja2 import Environment, FileSystemLoader
 
 # from pprint import pprint as print
 
 from docker_compose_graph.yaml_tags.overrides import OverrideArray
+from docker_compose_graph.batch import format_summary, jobs_from_args, load_manifest, run_batch
+from docker_compose_graph.cache import LabelCache, ModelCache, ParseCache, PathCache, StatCache, default_cache_dir
+from docker_compose_graph.includes import DEFAULT_MAX_WORKERS, IncludeGraph
+from docker_compose_graph.dependencies import DependencyGraph
+from docker_compose_graph.dot_writer import DotWriter
+from docker_compose_graph.extract import EXTRACTORS, Extractor, TreeVisitor
+from docker_compose_graph.interpolation import Interpolator
+from docker_compose_graph.layout import ENGINES, FORMATS, GraphvizTimeout, output_paths, plan_layouts, run_graphviz
+from docker_compose_graph.model import PortBinding, Service, VolumeMount, build_services
+from docker_compose_graph.partition import (
+    PARTITIONS,
+    PartResult,
+    format_parts_summary,
+    make_parts,
+    partition_model,
+    render_parts,
+    write_index,
+)
+from docker_compose_graph.selection import CLOSURES, Selection
+from docker_compose_graph.stats import Stats
+from docker_compose_graph.templates import TEMPLATES, get_template
+from docker_compose_graph.watch import Watcher
 from docker_compose_graph.utils import *
 
 from docker_compose_graph import __version__
@@ -104,6 +124,10 @@ _logger = logging.getLogger(__name__)
 
 USE_HTML_LABELS = True
 
+# Rendered labels, shared by all builds of the process
+# (unchanged services are not rendered again, see --watch)
+LABEL_CACHE = LabelCache()
+
 
 # ---- Python API ----
 # The functions defined in this section can be imported by users in their
@@ -124,20 +148,75 @@ class DockerComposeGraph:
             expandvars: bool = True,  # False is buggy
             resolve_relative_volumes: bool = False,
             label_root_service: str = None,
+            cache: Union[ParseCache, StatCache, None] = None,
+            include_workers: int = DEFAULT_MAX_WORKERS,
+            label_cache: Union[LabelCache, None] = None,
+            extractors: Union[dict[str, Extractor], None] = None,
+            selection: Union[Selection, None] = None,
+            model_cache: Union[ModelCache, None] = None,
     ):
 
         self.expanded_vars = expandvars
+        self._interpolator: Union[Interpolator, None] = None
         self.resolve_relative_volumes = resolve_relative_volumes
         self._label_root_service = label_root_service
 
+        # label hash -> label, see _get_cached_service_label
+        self.label_cache: LabelCache = LABEL_CACHE if label_cache is None else label_cache
+
+        self.stats: Stats = Stats()
+
         self.docker_yaml: Union[pathlib.Path | None] = None
+        self.include_graph: IncludeGraph = IncludeGraph(
+            cache=cache,
+            max_workers=include_workers,
+            stats=self.stats,
+        )
+
+        # aspect -> extractor, see extract.py. The built-in
+        # aspects are needed for the graph, registered and
+        # passed extractors come on top.
+        self.extractors: dict[str, Extractor] = {
+            **EXTRACTORS,
+            **(extractors or {}),
+            "depends_on": self._extract_depends_on,
+            "ports": self._extract_ports,
+            "volumes": self._extract_volumes,
+            "networks": self._extract_networks,
+        }
+        # aspect -> service_name -> value
+        self.extracted: Union[dict[str, dict] | None] = None
+
+        # Services to draw, see selection.py
+        self.selection = selection
+
+        # Results of the previous build, see build_model
+        self.model_cache = model_cache
 
         self.services: Union[list[dict] | None] = None
+        # service_name -> Service, built from self.services
+        # (only the selected ones if there is a selection)
+        self.model: Union[dict[str, Service] | None] = None
+        # Names of all declared services, selected or not
+        self.declared_services: set[str] = set()
+        # service_name -> content hash of the merged service
+        self.service_hashes: Union[dict[str, str] | None] = None
         self.depends_on: Union[dict[str, list | dict] | None] = None
         self.network_mappings: Union[dict[str, list[str]] | None] = None
         self.port_mappings: Union[dict[str, list[str]] | None] = None
         self.volume_mappings: Union[dict[str, list[str]] | None] = None
 
+        # service_name -> node name in the primary graph, filled
+        # by _walk_primary_graph (pydot and streaming alike)
+        self.service_nodes: dict[str, str] = {}
+
+        # "full" or "compact" service labels, set per
+        # layout plan by write_outputs (see layout.py)
+        self.label_detail: str = "full"
+
+        # Filesystem lookups of the current build
+        self.path_cache: PathCache = PathCache()
+
         # Main Graph
 
         self.graph = pydot.Dot(
@@ -305,20 +384,41 @@ class DockerComposeGraph:
     def as_dot(self):
         return self.graph
 
-    def _to_abs_path(
-            self,
-            root_path,
-            rel_path
-    ) -> pathlib.Path:
-
-        _logger.debug(f"{root_path = }")
-        _logger.debug(f"{rel_path = }")
+    def project_hash(self, *extra) -> str:
+        """
+        Content hash of everything the rendered graph depends
+        on: the merged, interpolated services (in order), the
+        settings, the label templates and the version of this
+        package. ``extra`` (e.g. the output format) is hashed
+        as well. Available after :meth:`iterate_trees`.
+        """
 
-        abs_path = os.path.join(root_path, rel_path)
+        return content_hash(
+            __version__,
+            USE_HTML_LABELS,
+            TEMPLATES.source_hash(),
+            None if self.docker_yaml is None else self.docker_yaml.as_posix(),
+            self._label_root_service,
+            self.expanded_vars,
+            self.resolve_relative_volumes,
+            list(self.service_hashes.items()),
+            *extra,
+        )
 
-        _logger.debug(f"{rel_path} -> {abs_path}")
+    @property
+    def interpolator(self) -> Interpolator:
+        """
+        Interpolator for the current environment snapshot,
+        created on first use (i.e. after load_dotenv()).
+        """
+        if self._interpolator is None:
+            self._interpolator = Interpolator()
+        return self._interpolator
 
-        return pathlib.Path(abs_path)
+    def _expand(self, value: str) -> str:
+        if not self.expanded_vars:
+            return value
+        return self.interpolator.expand(value)
 
     def parse_docker_compose(
             self,
@@ -326,11 +426,35 @@ class DockerComposeGraph:
             root_path: Union[pathlib.Path, None] = None,
             ret=None,
     ) -> list[dict]:
-        """Recursive"""
+        """
+        Parse ``yaml`` and all the files it includes.
+        Every file is parsed once, in depth-first order;
+        the include DAG is available as ``self.include_graph``.
+        """
+
+        if ret is None:
+            ret = []
+
+        ret.extend(
+            tree for _abs_yaml, tree in self.iter_docker_compose(
+                yaml=yaml,
+                root_path=root_path,
+            )
+        )
 
-        _logger.debug("############################################")
+        return ret
 
-        _logger.debug(f"{yaml = }")
+    def iter_docker_compose(
+            self,
+            yaml: pathlib.Path,
+            root_path: Union[pathlib.Path, None] = None,
+    ) -> Iterator[tuple[pathlib.Path, dict]]:
+        """
+        Streaming version of :meth:`parse_docker_compose`.
+        Yields ``(path, tree)`` as soon as each file is
+        loaded; can be passed to :meth:`iterate_trees`
+        directly.
+        """
 
         if self.docker_yaml is None:
             # The main yaml we process will be
@@ -338,146 +462,290 @@ class DockerComposeGraph:
             self.docker_yaml = yaml
             self.graph.set_label(self.docker_yaml.as_posix())
 
-        if yaml.is_absolute():
-            _abs_yaml = yaml
-            root_path = _abs_yaml.parent
-        else:
-            root_path = root_path.joinpath(yaml.parent)
-            _abs_yaml = self._to_abs_path(
-                root_path=root_path,
-                rel_path=yaml.name,
+        yield from self.include_graph.iter_trees(
+            yaml=yaml,
+            root_path=root_path,
+        )
+
+        if _logger.isEnabledFor(logging.DEBUG):
+            _logger.debug(f"{self.include_graph.edges = }")
+
+    def load_dotenv(self, env: pathlib.Path):
+        dotenv.load_dotenv(env)
+
+    @staticmethod
+    def _get_service_names(
+            services: list[dict],
+    ) -> list[str]:
+
+        # dict: insertion ordered, O(1) membership
+        keys: dict = dict()
+        for service in services:
+            key = service.get("service_name", None)
+            if key is None:
+                continue
+            keys[key] = None
+
+        return list(keys)
+
+    @staticmethod
+    def _group_services(
+            services: Iterable[dict],
+            groups: Union[dict[str, list[dict]], None] = None,
+    ) -> dict[str, list[dict]]:
+        """
+        Fragments of ``services`` by service name in one
+        pass. Names are in first-seen order, fragments in
+        declaration order (i.e. override precedence).
+        """
+
+        if groups is None:
+            groups = dict()
+
+        for service in services:
+            groups.setdefault(service["service_name"], []).append(service)
+
+        return groups
+
+    @staticmethod
+    def _fold_services(
+            fragments: list[dict],
+    ) -> dict:
+        """Merge the fragments of one service, later ones win"""
+
+        # Every fragment is copied once, into the result
+        service_dict_merged: dict = dict()
+        for fragment in fragments:
+            merge_into(
+                dict1=service_dict_merged,
+                dict2=fragment,
             )
 
-        _logger.debug(f"{_abs_yaml = }")
-        # PosixPath('/home/michael/git/repos/memoria-works/OpenStudioLandscapesHub/docker-compose/sites/memoriaworks/reviewboard/docker-compose.reviewboard.yml')
-        #
-        # PosixPath('/home/michael/git/repos/memoria-works/OpenStudioLandscapesHub/docker-compose/sites/memoriaworks/docker-compose.nginx.yml')
-        # PosixPath('/home/michael/git/repos/memoria-works/OpenStudioLandscapesHub/docker-compose/sites/memoriaworks/reviewboard/docker-compose.nginx.yml')
-        _logger.debug(f"{root_path = }")
-        # PosixPath('/home/michael/git/repos/memoria-works/OpenStudioLandscapesHub/docker-compose/sites/memoriaworks')
-        #
-        # PosixPath('/home/michael/git/repos/memoria-works/OpenStudioLandscapesHub/docker-compose/sites/memoriaworks')
-        # PosixPath('/home/michael/git/repos/memoria-works/OpenStudioLandscapesHub/docker-compose/sites/memoriaworks')
+        return service_dict_merged
 
-        _abs_yaml = _abs_yaml.resolve()
+    def merge_services(
+            self,
+            services,
+    ):
+        """
+        Merge all fragments with the same ``service_name``
+        into one service each (first-seen order).
+        """
 
-        _logger.info(f"Processing {_abs_yaml.as_posix()}")
-        # /home/michael/git/repos/memoria-works/OpenStudioLandscapesHub/docker-compose/sites/memoriaworks/reviewboard/docker-compose.reviewboard.yml
-        #
-        # /home/michael/git/repos/memoria-works/OpenStudioLandscapesHub/docker-compose/sites/memoriaworks/docker-compose.nginx.yml
-        # /home/michael/git/repos/memoria-works/OpenStudioLandscapesHub/docker-compose/sites/memoriaworks/reviewboard/docker-compose.nginx.yml
+        return [
+            self._fold_services(fragments)
+            for fragments in self._group_services(services).values()
+        ]
 
-        with open(_abs_yaml, "r") as fr:
-            docker_compose_chainmap: dict = pyyaml.full_load(fr)
-            _logger.debug(f"{docker_compose_chainmap = }")
+    def iterate_trees(
+            self,
+            trees: Iterable[Union[dict, tuple[pathlib.Path, dict]]],
+    ):
+        """
+        Build the model from ``trees`` (see :meth:`build_model`)
+        and the primary graph from the model.
+        """
 
-        # the first iteration
-        # of recursive function
-        if ret is None:
-            ret = []
+        self.build_model(trees)
 
-        ret.append(docker_compose_chainmap)
+        with self.stats.phase("graph_assembly"):
+            primary_graph = self.get_primary_graph()
 
-        includes: list = docker_compose_chainmap.get("include", [])
+        nodes, edges = self.count_graph(primary_graph)
+        self.stats.incr("nodes", nodes)
+        self.stats.incr("edges", edges)
 
-        _logger.debug(f"{includes = }")
+    def build_model(
+            self,
+            trees: Iterable[Union[dict, tuple[pathlib.Path, dict]]],
+    ):
+        """
+        Extract services, depends_on, ports, volumes and
+        networks from ``trees`` and build the model
+        (``self.model``), without drawing anything.
+
+        ``trees`` can be any iterable of trees (or of
+        ``(path, tree)`` as yielded by :meth:`iter_docker_compose`).
+        It is consumed once; every tree is folded into the
+        mappings as it arrives and not referenced afterwards.
+
+        All extractors (``self.extractors``) run in the same
+        pass; their results are in ``self.extracted``
+        (aspect -> service_name -> value).
+
+        With a ``model_cache``, files that did not change since
+        the previous build are not visited again, and services
+        whose fragments all come from such files are taken over
+        as they were (see :class:`~docker_compose_graph.cache.ModelCache`).
+        """
 
-        for include in includes:
-            if isinstance(include, dict):
+        fragments: dict[str, list[dict]] = dict()
 
-                include_set = include
+        # Snapshot the environment as it is now
+        self._interpolator = None
 
-                for included_docker_compose in include_set.get("path", []):
-                    _logger.debug(f"{included_docker_compose = }")
-                    pathlib_path = pathlib.Path(included_docker_compose)
-                    _logger.debug(f"{pathlib_path = }")
+        self.path_cache = PathCache()
 
-                    _logger.debug(json.dumps(ret, default=str, indent=2))
-                    # _logger.debug(f"{json.dumps(ret, default=str, indent=2) = }")
+        cache = self.model_cache
+        if cache is not None:
+            cache.check_environ(os.environ)
 
-                    _logger.debug(f"{pathlib_path = }")
-                    _logger.debug(f"{root_path = }")
+        extracted: dict[str, dict] = {name: {} for name in self.extractors}
+        # path -> (service fragments, extracted) of this build
+        files: dict[pathlib.Path, tuple[list[dict], dict[str, dict]]] = {}
 
-                    self.parse_docker_compose(
-                        yaml=pathlib_path,
-                        root_path=root_path,
-                        ret=ret,
-                    )
+        # Includes time spent waiting for
+        # trees that are still being loaded
+        with self.stats.phase("extract"):
+            for tree in trees:
+                abs_yaml = None
+                if isinstance(tree, tuple):
+                    abs_yaml, tree = tree
 
-        return ret
+                visited = None
+                if abs_yaml is not None:
+                    # Reached again through another include chain
+                    visited = files.get(abs_yaml, None)
+                    if visited is None and cache is not None:
+                        visited = cache.files.get(abs_yaml, None)
+                        if visited is not None:
+                            self.stats.incr("files_reused")
 
-    def load_dotenv(self, env: pathlib.Path):
-        dotenv.load_dotenv(env)
+                if visited is None:
+                    if self.resolve_relative_volumes:
+                        # Relative to the file that declares them,
+                        # before the extractors see the volumes
+                        base = pathlib.Path.cwd() if abs_yaml is None else abs_yaml.parent
+                        for service_config in tree.get("services", {}).values():
+                            self._resolve_volumes(service_config, base)
 
-    @staticmethod
-    def _get_service_names(
-            services: list[dict],
-    ) -> list[str]:
+                    # One walk over the services of the
+                    # tree, whatever the number of extractors
+                    visitor = TreeVisitor(extractors=self.extractors)
+                    visited = visitor.visit(tree, abs_yaml), visitor.results
 
-        keys: list = list()
-        for service in services:
-            key = service.get("service_name", None)
-            if key is None or key in keys:
-                continue
-            keys.append(key)
+                if abs_yaml is not None:
+                    files[abs_yaml] = visited
 
-        return keys
+                services, results = visited
 
-    def merge_services(
-            self,
-            services,
-    ):
-        ret: list[dict] = []
+                # A later declaration of a service replaces an earlier one
+                for name, values in results.items():
+                    extracted[name].update(values)
 
-        service_name_keys: list = self._get_service_names(services)
+                # Grouped here, folded once all trees are in
+                self._group_services(services, fragments)
 
-        # find dicts that have the same service_name
-        # and merge them into one
-        for service_name_key in service_name_keys:
-            service_dict_merged: dict = dict()
-            for service in services:
-                if service_name_key != service["service_name"]:
-                    # print(f"{key = }")
-                    continue
-                service_dict_merged = deep_merge(
-                    dict1=service_dict_merged,
-                    dict2=service,
-                )
+                del tree
 
-            ret.append(copy.deepcopy(service_dict_merged))
+        self.extracted = extracted
 
-        return ret
+        if cache is not None:
+            # Files that are not included anymore are dropped
+            cache.files = files
 
-    def iterate_trees(self, trees):
+        if self.resolve_relative_volumes:
+            self.stats.incr("path_cache_hits", self.path_cache.hits)
+            self.stats.incr("path_cache_misses", self.path_cache.misses)
 
-        # trees_ = copy.deepcopy(trees)
+        self.depends_on = {
+            "root": [],
+            "services": self.extracted["depends_on"],
+        }
+        self.port_mappings = {
+            "root": [],
+            "services": self.extracted["ports"],
+        }
+        self.volume_mappings = {
+            "root": [],
+            "services": self.extracted["volumes"],
+        }
+        self.network_mappings = {
+            "root": [],
+            "services": self.extracted["networks"],
+        }
 
-        # for tree in trees_:
-        #     _logger.debug(tree)
-        #
-        #     for index, (service_name, service_config) in enumerate(tree.get("services", {}).items()):
-        #
-        #         if isinstance(service_config, ResetNull):
-        #             # ResetNull objects are !reset YAML tags
-        #             _logger.warning(f"Removing item: {service_name}: {type(service_config)}")
-        #             trees.remove()
-        #             trees.pop(index-1)
-        #             # trees.remove({service_name: service_config})
-        #             # del tree["services"][service_name]
-        #             # continue
+        # service_name -> (fragments, merged service, Service,
+        # content hash) of the previous build, for the services
+        # declared in unchanged files only
+        reused = {}
+        if cache is not None:
+            for name, service_fragments in fragments.items():
+                entry = cache.services.get(name, None)
+                if entry is not None \
+                        and len(entry[0]) == len(service_fragments) \
+                        and all(a is b for a, b in zip(entry[0], service_fragments)):
+                    reused[name] = entry
+            self.stats.incr("services_reused", len(reused))
+
+        with self.stats.phase("merge_services"):
+            merged = {
+                name: self._fold_services(service_fragments)
+                for name, service_fragments in fragments.items()
+                if name not in reused
+            }
+
+        self.stats.incr("services", len(fragments))
+
+        if self.expanded_vars:
+            # One pass over the merged model. Environment
+            # values are kept as declared so that secrets
+            # from .env do not end up in rendered graphs.
+            with self.stats.phase("interpolation"):
+                merged = {
+                    name: self.interpolator.interpolate(service, skip=("environment",))
+                    for name, service in merged.items()
+                }
 
-        services = self._get_services(trees)
+        with self.stats.phase("model"):
+            built = build_services(merged.values())
+
+        self.services = [reused[name][1] if name in reused else merged[name] for name in fragments]
+        # All services, self.model is narrowed by the selection
+        models = {name: reused[name][2] if name in reused else built[name] for name in fragments}
+        self.model = models
+        self.declared_services = set(models)
+
+        if self.selection:
+            # Before labels and graph assembly,
+            # which are the expensive parts
+            with self.stats.phase("selection"):
+                self.model = self.selection.apply(self.model)
+            self.stats.incr("services_selected", len(self.model))
+
+        for service in self.model.values():
+            for dependency in service.depends_on:
+                if dependency.service not in self.declared_services:
+                    # Drawn as a placeholder, see _walk_primary_graph
+                    _logger.warning(f"{service.name} depends on {dependency.service}, which is not declared")
+
+        with self.stats.phase("hashing"):
+            self.service_hashes = {}
+            for service in self.services:
+                name = service["service_name"]
+                if name not in self.model:
+                    continue
+                if name in reused and reused[name][3] is not None:
+                    self.service_hashes[name] = reused[name][3]
+                else:
+                    self.service_hashes[name] = content_hash(service)
 
-        self.services = self.merge_services(services)
-        self.depends_on = self._get_depends_on(trees)
-        self.port_mappings = self._get_ports(trees)
-        self.volume_mappings = self._get_volumes(trees)
-        self.network_mappings = self._get_networks(trees)
+        if cache is not None:
+            cache.services = {
+                name: (fragments[name], service, models[name], self.service_hashes.get(name, None))
+                for name, service in zip(fragments, self.services)
+            }
 
-        primary_graph = self.get_primary_graph()
+        if _logger.isEnabledFor(logging.DEBUG):
+            _logger.debug(f"All {self.services = }")
+            _logger.debug(f"All {self.depends_on = }")
+            _logger.debug(f"All {self.port_mappings = }")
+            _logger.debug(f"All {self.volume_mappings = }")
+            _logger.debug(f"All {self.network_mappings = }")
 
-        # for secondary_tree in trees:
-        #     print
+    def dependency_graph(self) -> DependencyGraph:
+        """The depends_on relation of the (selected) services"""
+        return DependencyGraph.from_model(self.model)
 
     def _get_services(
             self,
@@ -487,40 +755,20 @@ class DockerComposeGraph:
         services = []
 
         for tree in trees:
-            _logger.debug(tree)
-
-            for service_name, service_config in tree.get("services", {}).items():
-
-                # if isinstance(service_config, ResetNull):
-                #     # ResetNull objects are !reset YAML tags
-                #     _logger.warning(f"Skipping {service_name}: {type(service_config)}")
-                #     continue
-
-                # some environment definitions in docker compose
-                # (i.e. for ayon) will be loaded as lists instead
-                # of k=v pairs. This "tries" to convert it
-                # Todo: maybe improve logic here
-                environment = service_config.get("environment", None)
-                if environment is not None:
-                    if isinstance(environment, list):
-                        _environment = dict()
-                        for env in sorted(environment):
-                            k, v = env.replace(" ", "").split("=", maxsplit=1)
-                            _environment[k] = v
-                        service_config["environment"] = _environment
-
-                services.append(
-                    {
-                        "service_name": service_name,
-                        "service_config": service_config,
-                     }
-                )
+            services.extend(self._get_tree_services(tree))
 
-        _logger.debug(f"All {services = }")
-        print(f"All {services = }")
+        if _logger.isEnabledFor(logging.DEBUG):
+            _logger.debug(f"All {services = }")
 
         return services
 
+    @staticmethod
+    def _get_tree_services(
+            tree: dict,
+    ) -> list[dict]:
+
+        return TreeVisitor(extractors={}).visit(tree)
+
     def _get_ports(
             self,
             trees,
@@ -538,8 +786,8 @@ class DockerComposeGraph:
 
             port_mappings["services"].update(service_ports)
 
-        _logger.debug(f"All {port_mappings = }")
-        print(f"All {port_mappings = }")
+        if _logger.isEnabledFor(logging.DEBUG):
+            _logger.debug(f"All {port_mappings = }")
 
         return port_mappings
 
@@ -548,35 +796,82 @@ class DockerComposeGraph:
             tree: dict,
     ) -> dict[str, list[str]]:
 
-        port_mappings = {}
+        return {
+            service_name: self._extract_ports(service_name, service_config)
+            for service_name, service_config in tree.get("services", {}).items()
+        }
+
+    def _extract_ports(
+            self,
+            service_name: str,
+            service_config: dict,
+            path: Union[pathlib.Path, None] = None,
+    ) -> list[str]:
+
+        ports = service_config.get("ports", [])
 
-        services: dict = tree.get("services", {})
+        if isinstance(ports, OverrideArray):
+            ports: list = ports.array
 
-        for service_name, service_config in services.items():
+        port_mappings = []
 
-            # if isinstance(service_config, ResetNull):
-            #     # ResetNull objects are !reset YAML tags
-            #     _logger.warning(f"Skipping {service_name}: {type(service_config)}")
-            #     continue
+        for p in ports:
+            if isinstance(p, str):
+                p = self._expand(p)
+            # HOST:CONTAINER[/PROTOCOL], without host IP
+            port_mappings.append(str(PortBinding.parse(p)))
 
-            ports = service_config.get("ports", [])
+        return port_mappings
 
-            if isinstance(ports, OverrideArray):
-                ports: list = ports.array
+    def _resolve_volumes(
+            self,
+            service_config: dict,
+            base: pathlib.Path,
+    ) -> None:
+        """
+        Make relative bind mount sources of ``service_config``
+        absolute (relative to ``base``), in place. Named
+        volumes and absolute paths are kept as they are.
+
+        Whether a source is a relative path is decided on its
+        interpolated value, but the tree keeps the source as
+        declared (prefixed with ``base``), since the merged
+        services are interpolated later.
+        """
 
-            port_mappings[service_name] = []
+        volumes = service_config.get("volumes", None)
+        if not volumes:
+            return
 
-            for p in ports:
-                if len(p.split(":")) > 2:
-                    # Todo: fix this: ['127.0.0.1:1514:10514']
-                    p = ":".join(p.split(":")[1:])
+        if isinstance(volumes, OverrideArray):
+            volumes = volumes.array
 
-                if self.expanded_vars:
-                    port_mappings[service_name].append(os.path.expandvars(p))
-                else:
-                    port_mappings[service_name].append(p)
+        for i, v in enumerate(volumes):
+            if isinstance(v, dict):
+                volume = VolumeMount.parse({**v, "source": self._expand(v.get("source", None) or "")})
+            else:
+                volume = VolumeMount.parse(self._expand(v))
 
-        return port_mappings
+            if volume is None \
+                    or not volume.is_bind \
+                    or volume.source is None \
+                    or volume.source.startswith("/") \
+                    or "$" in volume.source:
+                continue
+
+            # As declared
+            declared = VolumeMount.parse(v)
+
+            if "$" in declared.source:
+                # Interpolated (once) with the merged service
+                source = f"{base.as_posix()}/{declared.source.removeprefix('./')}"
+            else:
+                source = self.path_cache.absolute(declared.source, base).as_posix()
+
+            if isinstance(v, dict):
+                volumes[i] = {**v, "source": source}
+            else:
+                volumes[i] = str(dataclasses.replace(declared, source=source))
 
     def _get_volumes(
             self,
@@ -594,8 +889,8 @@ class DockerComposeGraph:
             )
             volume_mappings["services"].update(service_volumes)
 
-        _logger.debug(f"All {volume_mappings = }")
-        print(f"All {volume_mappings = }")
+        if _logger.isEnabledFor(logging.DEBUG):
+            _logger.debug(f"All {volume_mappings = }")
 
         return volume_mappings
 
@@ -604,33 +899,29 @@ class DockerComposeGraph:
             tree: dict,
     ) -> dict[str, list[str]]:
 
-        volume_mappings = {}
-
-        services: dict = tree.get("services", {})
-
-        for service_name, service_config in services.items():
-
-            # if isinstance(service_config, ResetNull):
-            #     # ResetNull objects are !reset YAML tags
-            #     _logger.warning(f"Skipping {service_name}: {type(service_config)}")
-            #     continue
+        return {
+            service_name: self._extract_volumes(service_name, service_config)
+            for service_name, service_config in tree.get("services", {}).items()
+        }
 
-            volumes = service_config.get("volumes", [])
+    def _extract_volumes(
+            self,
+            service_name: str,
+            service_config: dict,
+            path: Union[pathlib.Path, None] = None,
+    ) -> list[str]:
 
-            volume_mappings[service_name] = []
+        volume_mappings = []
 
-            for v in volumes:
-                if isinstance(v, dict):
-                    src = v.get("source", None)
-                    trgt = v.get("target", None)
-                    if not all([src, trgt]):
-                        continue
-                    v = f"{src}:{trgt}"
+        for v in service_config.get("volumes", []):
+            if isinstance(v, dict):
+                src = v.get("source", None)
+                trgt = v.get("target", None)
+                if not all([src, trgt]):
+                    continue
+                v = f"{src}:{trgt}"
 
-                if self.expanded_vars:
-                    volume_mappings[service_name].append(os.path.expandvars(v))
-                else:
-                    volume_mappings[service_name].append(v)
+            volume_mappings.append(self._expand(v))
 
         return volume_mappings
 
@@ -650,36 +941,36 @@ class DockerComposeGraph:
             )
             network_mappings["services"].update(service_networks)
 
-        _logger.debug(f"All {network_mappings = }")
-        print(f"All {network_mappings = }")
+        if _logger.isEnabledFor(logging.DEBUG):
+            _logger.debug(f"All {network_mappings = }")
 
         return network_mappings
 
-    @staticmethod
+    @classmethod
     def _get_service_networks(
+            cls,
             tree: dict,
     ) -> dict[str, list[str]]:
 
-        network_mappings = {}
-
-        services: dict = tree.get("services", {})
-
-        for service_name, service_config in services.items():
-
-            # if isinstance(service_config, ResetNull):
-            #     # ResetNull objects are !reset YAML tags
-            #     _logger.warning(f"Skipping {service_name}: {type(service_config)}")
-            #     continue
+        return {
+            service_name: cls._extract_networks(service_name, service_config)
+            for service_name, service_config in tree.get("services", {}).items()
+        }
 
-            networks = []
-            if "networks" in service_config:
-                networks = service_config.get("networks", [])
-            elif "network_mode" in service_config:
-                networks = [service_config.get("network_mode", [])]
+    @staticmethod
+    def _extract_networks(
+            service_name: str,
+            service_config: dict,
+            path: Union[pathlib.Path, None] = None,
+    ) -> list[str]:
 
-            network_mappings[service_name] = networks
+        networks = []
+        if "networks" in service_config:
+            networks = service_config.get("networks", [])
+        elif "network_mode" in service_config:
+            networks = [service_config.get("network_mode", [])]
 
-        return network_mappings
+        return networks
 
     def _get_depends_on(
             self,
@@ -698,8 +989,8 @@ class DockerComposeGraph:
 
             depends_on_mappings["services"].update(service_depends_on)
 
-        _logger.debug(f"All {depends_on_mappings = }")
-        print(f"All {depends_on_mappings = }")
+        if _logger.isEnabledFor(logging.DEBUG):
+            _logger.debug(f"All {depends_on_mappings = }")
 
         return depends_on_mappings
 
@@ -710,28 +1001,29 @@ class DockerComposeGraph:
 
         depends_on_mappings = {}
 
-        services: dict = tree.get("services", {})
-
-        for service_name, service_config in services.items():
+        for service_name, service_config in tree.get("services", {}).items():
+            depends_on = self._extract_depends_on(service_name, service_config)
+            if depends_on is not None:
+                depends_on_mappings[service_name] = depends_on
 
-            # if isinstance(service_config, ResetNull):
-            #     # ResetNull objects are !reset YAML tags
-            #     _logger.warning(f"Skipping {service_name}: {type(service_config)}")
-            #     continue
-
-            depends_on = service_config.get("depends_on", [])
+        return depends_on_mappings
 
-            if len(depends_on) == 0:
-                # No need to keep what didn't exist
-                # in the first place:
-                #  {'dagster_dev': []},
-                continue
+    def _extract_depends_on(
+            self,
+            service_name: str,
+            service_config: dict,
+            path: Union[pathlib.Path, None] = None,
+    ) -> Union[dict, None]:
 
-            _depends_on_conform = self._conform_depends_on(depends_on)
+        depends_on = service_config.get("depends_on", [])
 
-            depends_on_mappings[service_name] = _depends_on_conform
+        if len(depends_on) == 0:
+            # No need to keep what didn't exist
+            # in the first place:
+            #  {'dagster_dev': []},
+            return None
 
-        return depends_on_mappings
+        return self._conform_depends_on(depends_on)
 
     def _conform_depends_on(
             self,
@@ -769,185 +1061,225 @@ class DockerComposeGraph:
         assert isinstance(item, pydot.Common)
         return item.get_name().replace('"', '')
 
-    def _get_service_label(
-            self,
-            service: dict,
-    ) -> str:
-        """
-        Generate a Service Node label
-        based on service[dict[str, str | dict]].
-        This is a bit hacky but it's mostly
-        cosmetics except for the TAGs/PLUGs.
-        We retain the original service_config
-        data this way.
-        """
+    @classmethod
+    def count_graph(
+            cls,
+            graph: pydot.Graph,
+    ) -> tuple[int, int]:
+        """Number of nodes and edges in graph and all its subgraphs"""
 
-        service_name = service.get("service_name")
-        service_config = service.get("service_config")
+        nodes = len(graph.get_node_list())
+        edges = len(graph.get_edge_list())
 
-        ports_container: list = list()
-        _ports: list = service_config.get("ports", [])
+        for subgraph in graph.get_subgraph_list():
+            _nodes, _edges = cls.count_graph(subgraph)
+            nodes += _nodes
+            edges += _edges
 
-        if isinstance(_ports, list):
-            ports_ = []
-            for p in _ports:
-                if len(p.split(":")) > 2:
-                    # Todo: very dirty
-                    p = ":".join(p.split(":")[1:])
+        return nodes, edges
 
-                ports_.append(p)
+    def graph_size(self) -> tuple[int, int]:
+        """
+        Number of nodes and edges of the primary graph,
+        counted from the model (without walking it)
+        """
 
-            _ports = ports_
-            ports_container: list = [os.path.expandvars(p) for p in _ports]
-        elif isinstance(_ports, OverrideArray):
-            # OverrideArray() in
-            # ~/repos/deadline-docker/src/Deadline/deadline_docker/assets.py
-            # Todo: find a better solution
-            ports_container: list = sorted([os.path.expandvars(p) for p in _ports.array])
+        nodes = edges = 0
+        placeholders = set()
+
+        for service in self.model.values():
+            sources = sum(volume.source is not None for volume in service.volumes)
+            # The service, its ports, volumes and networks
+            nodes += 1 + len(service.ports) + sources + len(service.networks)
+            edges += len(service.ports) + sources + len(service.networks)
+            edges += len(service.depends_on)
+            placeholders.update(
+                dependency.service for dependency in service.depends_on
+                if dependency.service not in self.model
+            )
 
-        ports = [
-            *ports_container
-        ]
+        # Placeholders of dependencies that are not in the model
+        nodes += len(placeholders)
 
-        _p = []
-        for p in ports_container:
-            port_host, port_container = p.split(":", maxsplit=1)
-            id_service_port = f"<PLUG_{service_name}__{port_host}__{port_container}> {port_container}"
-            _p.append(id_service_port)
+        return nodes, edges
 
-        depends_on: dict = OrderedDict(self._conform_depends_on(service_config.get("depends_on", [])))
-        assert isinstance(depends_on, dict)
+    def label_hash(self, service: Service) -> str:
+        """Hash of everything the label of ``service`` is rendered from"""
+        # repr: the modelled fields (not the raw config)
+        # in the order they are rendered
+        return content_hash(USE_HTML_LABELS, self.label_detail, repr(service))
 
-        _d = []
-        for d in depends_on:
-            id_service_depends_on = f"<PLUG_DEPENDS_ON_NODE-SERVICE_{d}> {d}"
-            _d.append(id_service_depends_on)
+    def _get_cached_service_label(
+            self,
+            service: Service,
+    ) -> str:
 
-        volumes: list = []
-        for v in service_config.get("volumes", []):
-            if isinstance(v, dict):
-                # Todo
-                _logger.debug("Can't handle dicts here yet: %s" % str(v))
-                continue
-            v_dict: dict = {}
-            v_split: list = v.split(":")
-            if self.expanded_vars:
-                v_dict["volume"] = os.path.expandvars(v_split[1])
-            else:
-                v_dict["volume"] = str(v_split[1])
-            if len(v_split) > 2:
-                v_dict["mode"] = v_split[2]
-            else:
-                v_dict["mode"] = "rw"
-            volumes.append(copy.deepcopy(v_dict))
+        key = self.label_hash(service)
 
-        _v = []
-        for v in volumes:
-            id_service_volume = f"<PLUG_{service_name}__{v['volume']}> {v['volume']}"
-            _v.append(id_service_volume)
+        label = self.label_cache.get(key)
+        if label is not None:
+            self.stats.incr("labels_cached")
+            return label
 
-        networks = []
-        if "networks" in service_config:
-            networks: list = [os.path.expandvars(n) for n in service_config.get("networks", [])]
-        elif "network_mode" in service_config:
-            networks: list = [service_config.get("network_mode")]
-        networks.sort()
+        label = self._get_service_label(service)
+        self.label_cache.put(key, label)
 
-        _n = []
-        for n in networks:
-            id_service_network = f"<PLUG_{n}> {n}"
-            _n.append(id_service_network)
+        return label
 
-        _command = service_config.get("command", "-")
+    def _get_service_label(
+            self,
+            service: Service,
+    ) -> str:
+        """
+        Generate a Service Node label
+        based on a :class:`Service`.
+        This is a bit hacky but it's mostly
+        cosmetics except for the TAGs/PLUGs.
+        """
 
-        healthcheck_cmd = None
-        _healthcheck = service_config.get("healthcheck", {})
-        if bool(_healthcheck):
-            _healthcheck_cmd = _healthcheck.get("test", [])
-            if bool(_healthcheck_cmd):
-                healthcheck_cmd = " ".join(shlex.quote(s) for s in _healthcheck_cmd)
+        service_name = service.name
 
-        print(service_config)
+        _logger.debug("%s", service)
 
-        if isinstance(_command, list):
-            command = " ".join(_command)
-        elif isinstance(_command, str):
-            command = _command
-        else:
-            raise TypeError(f"Unhandled command type: {_command} ({type(_command)})")
+        # Compact labels keep the plugs of the edges
+        environment = service.environment if self.label_detail == "full" else {}
 
         if USE_HTML_LABELS:
 
-            env = Environment(
-                loader=FileSystemLoader(
-                    pathlib.Path(__file__).parent / "resources",
-                )
-            )
-            template = env.get_template("service_node_label.j2")
+            # Compiled once per process
+            template = get_template("service_node_label.j2")
 
             ret = template.render(
                 service_name=service_name,
-                container_name=os.path.expandvars(service_config.get("container_name", "-")),
-                hostname=os.path.expandvars(service_config.get("hostname", "-")),
-                domainname=os.path.expandvars(service_config.get("domainname", "-")),
-                restart=service_config.get("restart", "-"),
-                image=os.path.expandvars(service_config.get("image", "(build)")),
-                command=command,
+                container_name=service.container_name or "-",
+                hostname=service.hostname or "-",
+                domainname=service.domainname or "-",
+                restart=service.restart or "-",
+                image=service.image or "(build)",
+                command=service.command,
                 # Todo:
-                healthcheck=healthcheck_cmd,
-                environment=service_config.get("environment", {}),
-                volumes=volumes,
-                depends_on=depends_on,
-                ports=ports,
-                networks=networks,
+                healthcheck=service.healthcheck,
+                environment=environment,
+                volumes=service.volumes,
+                depends_on=service.depends_on,
+                ports=service.ports,
+                networks=service.networks,
             )
 
             return f"<{ret}>"
 
         else:
 
+            _p = [f"<PLUG_{service_name}__{p.key}> {p.container}" for p in service.ports]
+            _d = [f"<PLUG_DEPENDS_ON_NODE-SERVICE_{d.service}> {d.service}" for d in service.depends_on]
+            _v = [f"<PLUG_{service_name}__{v.target}> {v.target}" for v in service.volumes]
+            _n = [f"<PLUG_{n.name}> {n.name}" for n in service.networks]
+
             fields = OrderedDict({
                 "service_name": "{service_name|{" + service_name + "}}",
-                "container_name": "{container_name|{" + os.path.expandvars(service_config.get("container_name", "-")) + "}}",
-                "hostname": "{hostname|{" + os.path.expandvars(service_config.get("hostname", "-")) + "}}",
-                "domainname": "{domainname|{" + os.path.expandvars(service_config.get("domainname", "-")) + "}}",
+                "container_name": "{container_name|{" + (service.container_name or "-") + "}}",
+                "hostname": "{hostname|{" + (service.hostname or "-") + "}}",
+                "domainname": "{domainname|{" + (service.domainname or "-") + "}}",
                 "volumes": "{{" + "|".join([v for v in sorted(_v)]) + "}|volumes}",
-                "restart": "{restart|{" + service_config.get("restart", "-") + "}}",
+                "restart": "{restart|{" + (service.restart or "-") + "}}",
                 "depends_on": "{{" + "|".join([d for d in sorted(_d)]) + "}|depends_on}",
-                "image": "{image|{" + os.path.expandvars(service_config.get("image", "-")) + "}}",
+                "image": "{image|{" + (service.image or "-") + "}}",
                 "ports": "{{" + "|".join([p for p in sorted(_p)]) + "}|exposed ports}",
                 "networks": "{{" + "|".join([n for n in sorted(_n)]) + "}|networks}",
-                "command": "{command|{" + os.path.expandvars(command) + "}}",
+                "command": "{command|{" + service.command + "}}",
                 "environment": "{environment|{" + "|".join([
-                    os.path.expandvars(e) for e in sorted(service_config.get(
-                        "environment", [],
-                    ))
+                    e for e in sorted(environment)
                 ]) + "}}",
-                # "build": os.path.expandvars(service_config.get("build", "-")),
+                # "build": service_config.get("build", "-"),
             })
 
             ret = "|".join([v for k, v in fields.items()])
 
         return ret
 
-    def get_primary_graph(self):
+    def get_service_node(self, service_name: str) -> str:
+        """The name of the node of ``service_name`` in the primary graph"""
+        try:
+            return self.service_nodes[service_name]
+        except KeyError:
+            raise KeyError(
+                f"No node for service {service_name!r} "
+                f"(not in the model or not selected)"
+            ) from None
+
+    def _placeholder_node(self, service_name: str, note: str, color: str) -> tuple:
+        """
+        Node of a dependency ``service_name`` that is not in
+        the model, with the same plug as a service node
+        """
+
+        plug = f"PLUG_NODE-SERVICE_{service_name}"
+
+        if USE_HTML_LABELS:
+            label = (
+                f'<<table border="1" cellspacing="0" cellpadding="4" color="{color}" bgcolor="#A0A0A0">'
+                f'<tr><td port="{plug}">{html.escape(service_name)}</td></tr>'
+                f'<tr><td>{note}</td></tr>'
+                f'</table>>'
+            )
+        else:
+            label = "{<" + plug + "> " + service_name + "|" + note + "}"
+
+        return (
+            "node",
+            f"NODE-SERVICE_{service_name}",
+            {
+                "label": label,
+                "shape": "plain" if USE_HTML_LABELS else "Mrecord",
+                **self.global_dot_settings,
+                "style": "filled,dashed",
+                "color": color,
+                "fontcolor": color,
+                "fillcolor": "#A0A0A0",
+            },
+            None,
+        )
+
+    def _walk_primary_graph(self) -> Iterator[tuple]:
+        """
+        The elements of the primary graph in DOT order:
+
+        - ``("open", name, attributes)``: a subgraph (DOT name)
+        - ``("close",)``: the end of the innermost subgraph
+        - ``("node", name, attributes, service_name)``:
+          ``service_name`` is set for service nodes only
+        - ``("edge", src, dst, attributes)``
+
+        Consumed by :meth:`get_primary_graph` (pydot) and
+        :meth:`write_dot` (streaming).
+        """
+
+        # Filled as the service nodes are emitted so that
+        # port, volume and network edges find their
+        # service without scanning
+        self.service_nodes = {}
+
+        def open_(cluster: pydot.Cluster) -> tuple:
+            return "open", self.get_name(cluster), cluster.get_attributes()
+
+        yield open_(self.cluster_root_services)
 
-        self.graph.add_subgraph(self.cluster_root_services)
-        self.cluster_host.add_subgraph(self.cluster_root_ports)
-        self.cluster_host.add_subgraph(self.cluster_root_volumes)
-        self.cluster_host.add_subgraph(self.cluster_root_networks)
-        self.graph.add_subgraph(self.cluster_host)
-        # self.graph.add_subgraph(self.cluster_root_images)
+        # Dependencies that are not in the model, drawn as
+        # placeholders: not declared at all (a typo, a missing
+        # include) or not selected (or in another part)
+        missing: dict[str, None] = {}
+        not_shown: dict[str, None] = {}
 
         #######################
         # Get all Services and add them as clusters
-        for service in self.services:
-            cluster_service = pydot.Cluster(
-                graph_name=f"cluster_service_{service.get('service_name')}",
-                label=service.get('service_name'),
-                rankdir="TB",
-                shape="square",
-                **{
+        for service in self.model.values():
+            yield (
+                "open",
+                f"cluster_cluster_service_{service.name}",
+                {
+                    "label": service.name,
+                    "rankdir": "TB",
+                    "shape": "square",
                     **self.global_dot_settings,
                     "style": "filled,rounded",
                     "color": "white",
@@ -956,93 +1288,98 @@ class DockerComposeGraph:
                 },
             )
 
-            node_service = pydot.Node(
-                name=f"NODE-SERVICE_{service.get('service_name')}",
-                label=self._get_service_label(service),
-                labeljust="l",
-                shape="plain" if USE_HTML_LABELS else "Mrecord",  # for HTML style labels
-                **{
+            with self.stats.phase("service_labels"):
+                label = self._get_cached_service_label(service)
+
+            node_service = f"NODE-SERVICE_{service.name}"
+
+            yield (
+                "node",
+                node_service,
+                {
+                    "label": label,
+                    "labeljust": "l",
+                    "shape": "plain" if USE_HTML_LABELS else "Mrecord",  # for HTML style labels
                     **self.global_dot_settings,
                     "style": "filled",
                     "color": "#0A0A0A",
                     "fillcolor": "#A0A0A0",
-                }
+                },
+                service.name,
             )
 
-            cluster_service.add_node(node_service)
+            self.service_nodes[service.name] = node_service
 
-            self.cluster_root_services.add_subgraph(cluster_service)
+            yield ("close",)
 
-            for depends_on in service.get("service_config", {}).get("depends_on", {}):
+            for dependency in service.depends_on:
 
-                src = self.get_name(node_service)
+                depends_on = dependency.service
+                if depends_on in self.declared_services:
+                    if depends_on not in self.model:
+                        not_shown[depends_on] = None
+                else:
+                    missing[depends_on] = None
 
-                edge = pydot.Edge(
-                    src=f'"{src}":"PLUG_DEPENDS_ON_NODE-SERVICE_{depends_on}":e',
-                    dst=f'"NODE-SERVICE_{depends_on}":"PLUG_NODE-SERVICE_{depends_on}":w',
-                    arrowhead="dot",
-                    arrowtail="inv",
-                    dir="both",
-                    color="yellow",
-                    **{
+                yield (
+                    "edge",
+                    f'"{node_service}":"PLUG_DEPENDS_ON_NODE-SERVICE_{depends_on}":e',
+                    f'"NODE-SERVICE_{depends_on}":"PLUG_NODE-SERVICE_{depends_on}":w',
+                    {
+                        "arrowhead": "dot",
+                        "arrowtail": "inv",
+                        "dir": "both",
+                        "color": "yellow",
                         **self.global_dot_settings,
                         "style": "bold",
-                    }
+                    },
                 )
 
-                self.cluster_root_services.add_edge(edge)
+        for depends_on in missing:
+            yield self._placeholder_node(depends_on, "missing", "#FF0000")
+        for depends_on in not_shown:
+            yield self._placeholder_node(depends_on, "not shown", "#0A0A0A")
+
+        yield ("close",)
 
         # all services
         #######################
 
+        # Sorted once, walked twice: host nodes
+        # first, then the edges to the services
+        services = sorted(self.model.values(), key=lambda s: s.name)
+
+        yield open_(self.cluster_host)
+
         #######################
         # Get all Ports
 
         _color = "black"
         # _fillcolor = "white"
 
-        for service_name, mappings in sorted(self.port_mappings["services"].items()):
-
-            if isinstance(mappings, OverrideArray):
-                # OverrideArray() in
-                # ~/repos/deadline-docker/src/Deadline/deadline_docker/assets.py
-                # Todo: find a better solution
-                mappings = mappings.array
-
-            for _mapping in sorted(mappings):
-                # port_host, port_container = os.path.expandvars(_mapping).split(":", maxsplit=1)
-                port_host, port_container = os.path.expandvars(_mapping).rsplit(":", 1)
-                node_host = pydot.Node(
-                    name=f"{service_name}__{port_host}__{port_container}",
-                    label=f"{port_host}",
-                    shape="circle",
-                    color=_color,
-                    fillcolor=self.fillcolor_cluster_root_ports,
-                    **{
+        yield open_(self.cluster_root_ports)
+
+        for service in services:
+            for port in sorted(service.ports, key=str):
+                # Ranges (8000-8100) are one node
+                port_host = port.host or "*"
+                if port.protocol != "tcp":
+                    port_host = f"{port_host}/{port.protocol}"
+                yield (
+                    "node",
+                    f"{service.name}__{port.key}",
+                    {
+                        "label": f"{port_host}",
+                        "shape": "circle",
+                        "color": _color,
+                        "fillcolor": self.fillcolor_cluster_root_ports,
                         **self.global_dot_settings,
                         "style": "filled",
-                    }
-                )
-
-                self.cluster_root_ports.add_node(node_host)
-
-                for sg in self.cluster_root_services.get_subgraphs():
-                    if self.get_name(sg) == f"cluster_cluster_service_{service_name}":
-                        n = sg.get_node(name=f"NODE-SERVICE_{service_name}")[0]
-                        break
-
-                dst = self.get_name(n)
-                edge = pydot.Edge(
-                    src=f'"{service_name}__{port_host}__{port_container}":e',
-                    dst=f'"{dst}":"PLUG_{service_name}__{port_host}__{port_container}":w',
-                    color=self.fillcolor_cluster_root_ports,
-                    dir="both",
-                    arrowhead="dot",
-                    arrowtail="dot",
-                    **self.global_dot_settings,
+                    },
+                    None,
                 )
 
-                self.graph.add_edge(edge)
+        yield ("close",)
 
         # all ports
         #######################
@@ -1077,66 +1414,32 @@ class DockerComposeGraph:
         _color = "black"
         # _fillcolor = "green"
 
-        for service_name, mappings in sorted(self.volume_mappings.get("services", {}).items()):
-            # volume_mappings:
-            # {'mongodb-10-2': ['/data/share/nfs/test_data/10.2/opt/Thinkbox/DeadlineDatabase10/mongo/data_LOCAL:/opt/Thinkbox/DeadlineDatabase10/mongo/data', '/data/share/nfs:/data/share/nfs:ro', '/data/share/nfs:/nfs:ro'], 'mongo-express-10-2': ['/data/share/nfs/test_data/10.2/opt/Thinkbox/DeadlineDatabase10/mongo/data_LOCAL:/opt/Thinkbox/DeadlineDatabase10/mongo/data', '/data/share/nfs:/data/share/nfs:ro', '/data/share/nfs:/nfs:ro'], 'filebrowser': ['./databases/filebrowser/filebrowser.db:/filebrowser.db', './configs/filebrowser/filebrowser.json:/.filebrowser.json', '/data/share/nfs/test_data/10.2/opt/Thinkbox/DeadlineDatabase10/mongo/data_LOCAL:/opt/Thinkbox/DeadlineDatabase10/mongo/data:ro', '/data/share/nfs:/data/share/nfs:ro', '/data/share/nfs:/nfs:ro'], 'dagster_dev': ['./configs/dagster_shared/workspace.yaml:/dagster/workspace.yaml:ro', './configs/dagster_shared/dagster.yaml:/dagster/materializations/workspace.yaml:ro', '/data/share/nfs:/data/share/nfs', '/data/share/nfs:/nfs'], 'likec4_dev': [], 'deadline-repository-installer-10-2': ['/data/share/nfs/test_data/10.2/opt/Thinkbox/DeadlineRepository10:/opt/Thinkbox/DeadlineRepository10', '/data/share/nfs:/data/share/nfs:ro', '/data/share/nfs:/nfs:ro'], 'deadline-client-installer-10-2': ['/data/share/nfs/test_data/10.2/opt/Thinkbox/Deadline10:/opt/Thinkbox/Deadline10', '/data/share/nfs/test_data/10.2/opt/Thinkbox/DeadlineRepository10:/opt/Thinkbox/DeadlineRepository10', '/data/share/nfs:/data/share/nfs:ro', '/data/share/nfs:/nfs:ro'], 'deadline-rcs-runner-10-2': ['./configs/Deadline10/deadline.ini:/var/lib/Thinkbox/Deadline10/deadline.ini:ro', '/data/share/nfs/test_data/10.2/opt/Thinkbox/Deadline10:/opt/Thinkbox/Deadline10', '/data/share/nfs/test_data/10.2/opt/Thinkbox/DeadlineRepository10:/opt/Thinkbox/DeadlineRepository10', '/data/share/nfs:/data/share/nfs:ro', '/data/share/nfs:/nfs:ro'], 'deadline-pulse-runner-10-2': ['./configs/Deadline10/deadline.ini:/var/lib/Thinkbox/Deadline10/deadline.ini:ro', '/data/share/nfs/test_data/10.2/opt/Thinkbox/Deadline10:/opt/Thinkbox/Deadline10', '/data/share/nfs/test_data/10.2/opt/Thinkbox/DeadlineRepository10:/opt/Thinkbox/DeadlineRepository10', '/data/share/nfs:/data/share/nfs:ro', '/data/share/nfs:/nfs:ro'], 'deadline-worker-runner-10-2': ['./configs/Deadline10/deadline.ini:/var/lib/Thinkbox/Deadline10/deadline.ini:ro', '/data/share/nfs/test_data/10.2/opt/Thinkbox/Deadline10:/opt/Thinkbox/Deadline10', '/data/share/nfs/test_data/10.2/opt/Thinkbox/DeadlineRepository10:/opt/Thinkbox/DeadlineRepository10', '/data/share/nfs:/data/share/nfs:ro', '/data/share/nfs:/nfs:ro'], 'deadline-webservice-runner-10-2': ['./configs/Deadline10/deadline.ini:/var/lib/Thinkbox/Deadline10/deadline.ini:ro', '/data/share/nfs/test_data/10.2/opt/Thinkbox/Deadline10:/opt/Thinkbox/Deadline10', '/data/share/nfs/test_data/10.2/opt/Thinkbox/DeadlineRepository10:/opt/Thinkbox/DeadlineRepository10', '/data/share/nfs:/data/share/nfs:ro', '/data/share/nfs:/nfs:ro'], 'kitsu-10-2': ['./postgres/postgresql.conf:/etc/postgresql/14/main/postgresql.conf:ro', '/data/share/nfs:/data/share/nfs', '/data/share/nfs:/nfs'], 'postgres': ['/etc/localtime:/etc/localtime:ro', '/data/share/nfs/databases/ayon/postgresql/data:/var/lib/postgresql/data'], 'redis': [], 'server': []}
+        yield open_(self.cluster_root_volumes)
 
-            for _mapping in sorted(mappings):
-                split = os.path.expandvars(_mapping).split(":")
-
-                volume_host = split[0]
-                volume_container = split[1]
-                volume_mode = "rw"
-                edge_style = "solid"
-
-                if len(split) > 2:
-                    volume_mode = split[2]
-                    edge_style = "dashed"
+        for service in services:
+            for volume in sorted(service.volumes, key=str):
+                if volume.source is None:
+                    # Anonymous volume or tmpfs
+                    continue
 
-                if self.resolve_relative_volumes:
-                    _volume_host = pathlib.Path(volume_host)
-                    if not _volume_host.is_absolute() \
-                            and not _volume_host.is_symlink():
-                        volume_host = _volume_host.resolve().as_posix()
-
-                node_host = pydot.Node(
-                    name=f"{volume_host}",
-                    label=f"{volume_host}",
-                    shape="box",
-                    color=_color,
-                    fillcolor=self.fillcolor_cluster_root_volumes,
-                    **{
+                yield (
+                    "node",
+                    f"{volume.source}",
+                    {
+                        "label": f"{volume.source}",
+                        "shape": "box",
+                        "color": _color,
+                        "fillcolor": self.fillcolor_cluster_root_volumes,
                         **self.global_dot_settings,
                         "style": "filled,rounded",
-                    }
+                    },
+                    None,
                 )
 
-                self.cluster_root_volumes.add_node(node_host)
+        yield ("close",)
 
-                for sg in self.cluster_root_services.get_subgraphs():
-                    if self.get_name(sg) == f"cluster_cluster_service_{service_name}":
-                        n = sg.get_node(name=f"NODE-SERVICE_{service_name}")[0]
-                        break
-
-                dst = self.get_name(n)
-                edge = pydot.Edge(
-                    src=node_host,
-                    dst=f'"{dst}":"PLUG_{service_name}__{volume_container}":w',
-                    color=self.fillcolor_cluster_root_volumes,
-                    dir="both",
-                    arrowhead="dot",
-                    arrowtail="dot",
-                    tailport="e",
-                    **{
-                        **self.global_dot_settings,
-                        "style": edge_style,
-                    }
-                )
-
-                self.graph.add_edge(edge)
-
-        # all volumes
-        #######################
+        # all volumes
+        #######################
 
         #######################
         # Get all Networks
@@ -1144,58 +1447,254 @@ class DockerComposeGraph:
         _color = "black"
         # _fillcolor = "orange"
 
-        for service_name, mappings in sorted(self.network_mappings.get("services", {}).items()):
-            # network_mappings:
-            # {'mongodb-10-2': ['mongodb', 'repository'], 'mongo-express-10-2': ['mongodb'], 'filebrowser': ['repository'], 'dagster_dev': ['repository', 'mongodb'], 'likec4_dev': [], 'deadline-repository-installer-10-2': ['mongodb', 'repository'], 'deadline-client-installer-10-2': ['mongodb', 'repository'], 'deadline-rcs-runner-10-2': ['mongodb', 'repository'], 'deadline-pulse-runner-10-2': ['mongodb', 'repository'], 'deadline-worker-runner-10-2': ['mongodb', 'repository'], 'deadline-webservice-runner-10-2': ['mongodb', 'repository'], 'kitsu-10-2': [], 'postgres': ['repository', 'mongodb'], 'redis': ['repository', 'mongodb'], 'server': ['repository', 'mongodb']}
-
-            for _mapping in sorted(mappings):
+        yield open_(self.cluster_root_networks)
 
-                node_host = pydot.Node(
-                    name=f"{_mapping}",
-                    label=f"{_mapping}",
-                    shape="box",
-                    color=_color,
-                    fillcolor=self.fillcolor_cluster_root_networks,
-                    **{
+        for service in services:
+            for network in service.networks:
+                yield (
+                    "node",
+                    f"{network.name}",
+                    {
+                        "label": f"{network.name}",
+                        "shape": "box",
+                        "color": _color,
+                        "fillcolor": self.fillcolor_cluster_root_networks,
                         **self.global_dot_settings,
                         "style": "filled,rounded",
-                    }
+                    },
+                    None,
                 )
 
-                self.cluster_root_networks.add_node(node_host)
+        yield ("close",)
 
-                for sg in self.cluster_root_services.get_subgraphs():
-                    if self.get_name(sg) == f"cluster_cluster_service_{service_name}":
-                        n = sg.get_node(name=f"NODE-SERVICE_{service_name}")[0]
-                        break
+        # networks
+        ##############################
+
+        # host
+        yield ("close",)
+
+        for service in services:
+
+            service_name = service.name
+
+            for port in sorted(service.ports, key=str):
+                dst = self.get_service_node(service_name)
+                yield (
+                    "edge",
+                    f'"{service_name}__{port.key}":e',
+                    f'"{dst}":"PLUG_{service_name}__{port.key}":w',
+                    {
+                        "color": self.fillcolor_cluster_root_ports,
+                        "dir": "both",
+                        "arrowhead": "dot",
+                        "arrowtail": "dot",
+                        **self.global_dot_settings,
+                    },
+                )
+
+        for service in services:
+
+            service_name = service.name
+
+            for volume in sorted(service.volumes, key=str):
+                if volume.source is None:
+                    continue
+
+                edge_style = "solid"
+                if volume.mode is not None:
+                    edge_style = "dashed"
+
+                dst = self.get_service_node(service_name)
+                yield (
+                    "edge",
+                    f"{volume.source}",
+                    f'"{dst}":"PLUG_{service_name}__{volume.target}":w',
+                    {
+                        "color": self.fillcolor_cluster_root_volumes,
+                        "dir": "both",
+                        "arrowhead": "dot",
+                        "arrowtail": "dot",
+                        "tailport": "e",
+                        **self.global_dot_settings,
+                        "style": edge_style,
+                    },
+                )
+
+        for service in services:
+
+            service_name = service.name
+
+            for network in service.networks:
+
+                _mapping = network.name
 
                 if _mapping == "host":
                     edge_style = "dashed"
                 else:
                     edge_style = "solid"
 
-
-                dst = self.get_name(n)
-                edge = pydot.Edge(
-                    src=f'"{_mapping}":e',
-                    dst=f'"{dst}":"PLUG_{_mapping}":w',
-                    color=self.fillcolor_cluster_root_networks,
-                    dir="both",
-                    arrowhead="dot",
-                    arrowtail="dot",
-                    **{
+                dst = self.get_service_node(service_name)
+                yield (
+                    "edge",
+                    f'"{_mapping}":e',
+                    f'"{dst}":"PLUG_{_mapping}":w',
+                    {
+                        "color": self.fillcolor_cluster_root_networks,
+                        "dir": "both",
+                        "arrowhead": "dot",
+                        "arrowtail": "dot",
                         **self.global_dot_settings,
                         "style": edge_style,
                     },
                 )
 
-                self.graph.add_edge(edge)
+    def get_primary_graph(self):
+        """Build the primary graph as pydot objects (``self.graph``)"""
+
+        roots = {
+            self.get_name(cluster): cluster
+            for cluster in (
+                self.cluster_root_services,
+                self.cluster_host,
+                self.cluster_root_ports,
+                self.cluster_root_volumes,
+                self.cluster_root_networks,
+            )
+        }
 
-        # networks
-        ##############################
+        stack: list[pydot.Graph] = [self.graph]
+
+        for element in self._walk_primary_graph():
+            kind = element[0]
+
+            if kind == "open":
+                _, name, attributes = element
+                subgraph = roots.get(name, None)
+                if subgraph is None:
+                    subgraph = pydot.Cluster(
+                        graph_name=name.removeprefix("cluster_"),
+                        **attributes,
+                    )
+                stack[-1].add_subgraph(subgraph)
+                stack.append(subgraph)
+
+            elif kind == "close":
+                stack.pop()
+
+            elif kind == "node":
+                _, name, attributes, _service_name = element
+                stack[-1].add_node(pydot.Node(name=name, **attributes))
+
+            else:
+                _, src, dst, attributes = element
+                stack[-1].add_edge(pydot.Edge(src=src, dst=dst, **attributes))
 
         return self.graph
 
+    def write_outputs(
+            self,
+            outputs: dict[str, pathlib.Path],
+            prog: str = "dot",
+            engine: str = "auto",
+            timeout: Union[float, None] = None,
+    ) -> bool:
+        """
+        Write the primary graph in all formats of ``outputs``
+        (``{format: path}``): ``dot`` is the DOT source, all
+        other formats are rendered from one Graphviz layout.
+
+        The layout plan is picked by the size of the graph and
+        ``engine`` (see :func:`~docker_compose_graph.layout.plan_layouts`).
+        A layout taking longer than ``timeout`` seconds is
+        killed and retried with the next, cheaper plan. The
+        DOT source is written with the first plan. Returns
+        whether the layout fell back to a cheaper plan.
+        """
+
+        nodes, edges = self.graph_size()
+        plans = plan_layouts(nodes, edges, engine)
+        _logger.debug("Layout plans for %d nodes, %d edges: %s", nodes, edges, [plan.name for plan in plans])
+
+        writers: list[DotWriter] = []
+        plan = plans[0]
+
+        def write(stream: TextIO) -> None:
+            self.label_detail = plan.label_detail
+            writers.append(self.write_dot(stream, graph_attributes=plan.graph_attributes))
+
+        source: Union[pathlib.Path, Callable[[TextIO], None]] = write
+
+        if "dot" in outputs:
+            with open(outputs["dot"], "w", encoding="utf-8") as f:
+                write(f)
+            self.stats.incr("dot_bytes", outputs["dot"].stat().st_size)
+            # Graphviz reads what was just written
+            source = outputs["dot"]
+
+        fallback = False
+        layouts = {format_: path for format_, path in outputs.items() if format_ != "dot"}
+        if layouts:
+            with self.stats.phase("layout"):
+                for i, plan in enumerate(plans):
+                    try:
+                        run_graphviz(
+                            outputs=layouts,
+                            source=source,
+                            prog=prog,
+                            engine=plan.engine,
+                            timeout=timeout,
+                        )
+                        break
+                    except GraphvizTimeout as e:
+                        self.stats.incr("layout_timeouts")
+                        if i + 1 == len(plans):
+                            raise
+                        _logger.warning(f"Layout {plan.name!r} timed out ({e}), retrying with {plans[i + 1].name!r}")
+                        # The DOT file has the settings of the first plan
+                        source = write
+                        fallback = True
+                self.stats.incr(f"layout_{plan.name}")
+
+        if writers:
+            self.stats.incr("nodes", writers[0].nodes)
+            self.stats.incr("edges", writers[0].edges)
+
+        return fallback
+
+    def write_dot(
+            self,
+            stream: TextIO,
+            graph_attributes: Union[dict[str, str], None] = None,
+    ) -> DotWriter:
+        """
+        Write the primary graph as DOT to ``stream`` while
+        walking the model, without building pydot objects.
+        Same text as ``self.get_primary_graph().to_string()``
+        (``graph_attributes`` override the ones of the root graph).
+        """
+
+        writer = DotWriter(stream)
+        writer.open_graph(
+            self.get_name(self.graph),
+            {**self.graph.get_attributes(), **(graph_attributes or {})},
+        )
+
+        for element in self._walk_primary_graph():
+            kind = element[0]
+
+            if kind == "open":
+                writer.open_subgraph(element[1], element[2])
+            elif kind == "close":
+                writer.close()
+            elif kind == "node":
+                writer.node(element[1], element[2])
+            else:
+                writer.edge(element[1], element[2], element[3])
+
+        writer.close()
+
+        return writer
+
 
 # ---- CLI ----
 # The functions defined in this section are wrappers around the main Python
@@ -1260,11 +1759,33 @@ def parse_args(args):
     parser.add_argument(
         "--yaml",
         "-y",
-        dest="docker_compose_yaml",
+        dest="yamls",
+        metavar="DOCKER_COMPOSE_YAML",
+        default=[],
+        action="append",
+        type=pathlib.Path,
+        required=False,
+        help="Full path to docker-compose.yaml (repeat for batch mode)",
+    )
+
+    parser.add_argument(
+        "--manifest",
+        "-m",
+        dest="manifest",
         default=None,
         type=pathlib.Path,
-        required=True,
-        help="Full path to docker-compose.yaml",
+        required=False,
+        help="YAML/JSON list of projects (yaml, outfile, format, dot_env) to render in batch mode",
+    )
+
+    parser.add_argument(
+        "--workers",
+        "-j",
+        dest="workers",
+        default=None,
+        type=int,
+        required=False,
+        help="Number of processes rendering projects in batch mode or parts with --partition (default: number of CPUs)",
     )
 
     parser.add_argument(
@@ -1283,37 +1804,632 @@ def parse_args(args):
         dest="outfile",
         default=None,
         type=pathlib.Path,
-        required=True,
-        help="Full output path",
+        required=False,
+        help="Full output path (output directory in batch mode with several --yaml)",
     )
 
     parser.add_argument(
         "--format",
         "-f",
-        dest="format",
-        choices=["dot", "svg", "png"],
+        dest="formats",
+        metavar="FORMAT",
+        nargs="+",
+        choices=FORMATS,
         default=None,
         type=str,
-        required=True,
-        help="Output format",
+        required=False,
+        help=(
+            f"Output formats ({', '.join(FORMATS)}), rendered from one layout. With several formats, "
+            f"the suffix of --outfile is replaced per format (default for manifest entries without one)"
+        ),
+    )
+
+    parser.add_argument(
+        "--engine",
+        dest="engine",
+        default="auto",
+        choices=ENGINES,
+        required=False,
+        help="Graphviz layout engine (default: auto, picked by the size of the graph)",
+    )
+
+    parser.add_argument(
+        "--render-timeout",
+        dest="render_timeout",
+        metavar="SECONDS",
+        default=None,
+        type=float,
+        required=False,
+        help="Kill Graphviz after SECONDS and retry with a cheaper layout (default: no limit)",
+    )
+
+    parser.add_argument(
+        "--partition",
+        dest="partition",
+        default=None,
+        choices=PARTITIONS,
+        required=False,
+        help=(
+            "Render one graph per network, declaring compose file or connected depends_on component "
+            "(OUTFILE.<part>.<format>) in parallel, plus an index linking them"
+        ),
+    )
+
+    parser.add_argument(
+        "--index",
+        dest="index",
+        metavar="FILE",
+        default=None,
+        type=pathlib.Path,
+        required=False,
+        help="Index of the parts with --partition, HTML if FILE ends with .html (default: OUTFILE stem.index.md)",
+    )
+
+    parser.add_argument(
+        "--service",
+        "-s",
+        dest="services",
+        metavar="PATTERN",
+        default=[],
+        action="append",
+        required=False,
+        help="Only draw services matching the glob PATTERN (repeatable)",
+    )
+
+    parser.add_argument(
+        "--exclude-service",
+        "-x",
+        dest="exclude_services",
+        metavar="PATTERN",
+        default=[],
+        action="append",
+        required=False,
+        help="Don't draw services matching the glob PATTERN (repeatable)",
+    )
+
+    parser.add_argument(
+        "--profile",
+        dest="profiles",
+        metavar="PROFILE",
+        default=[],
+        action="append",
+        required=False,
+        help="Only draw services without profiles or with PROFILE (repeatable, '*' for all)",
+    )
+
+    parser.add_argument(
+        "--with-dependencies",
+        dest="closure",
+        nargs="?",
+        const="upstream",
+        default=None,
+        choices=CLOSURES,
+        required=False,
+        help="Add the transitive depends_on closure of the selected services (default: upstream)",
     )
 
+    parser.add_argument(
+        "--no-cache",
+        dest="cache",
+        default=True,
+        action="store_false",
+        required=False,
+        help="Don't use the on-disk cache of parsed compose files",
+    )
+
+    parser.add_argument(
+        "--cache-dir",
+        dest="cache_dir",
+        default=None,
+        type=pathlib.Path,
+        required=False,
+        help="Directory of the parse cache (default: $XDG_CACHE_HOME/docker-compose-graph)",
+    )
+
+    parser.add_argument(
+        "--include-workers",
+        dest="include_workers",
+        default=DEFAULT_MAX_WORKERS,
+        type=int,
+        required=False,
+        help="Number of threads loading included files concurrently (default: min(8, CPUs + 4))",
+    )
+
+    parser.add_argument(
+        "--force",
+        dest="force",
+        default=False,
+        action="store_true",
+        required=False,
+        help="Write the output even if nothing changed since it was written (see OUTFILE.sha256)",
+    )
+
+    parser.add_argument(
+        "--stats",
+        dest="stats",
+        nargs="?",
+        const="table",
+        default=None,
+        choices=["table", "json"],
+        required=False,
+        help="Print phase timings and counters (as table or json) when done",
+    )
 
+    parser.add_argument(
+        "--watch",
+        "-w",
+        dest="watch",
+        default=False,
+        action="store_true",
+        required=False,
+        help="Rebuild the output whenever an included compose file or the .env file changes",
+    )
 
-    return parser.parse_args(args)
+    parser.add_argument(
+        "--watch-interval",
+        dest="watch_interval",
+        default=0.5,
+        type=float,
+        required=False,
+        help="Seconds between checks for changes in --watch mode (default: 0.5)",
+    )
 
+    parser.add_argument(
+        "--debounce",
+        dest="debounce",
+        default=0.3,
+        type=float,
+        required=False,
+        help="Seconds files must be unchanged before rebuilding in --watch mode (default: 0.3)",
+    )
+
+    args = parser.parse_args(args)
+
+    args.batch = bool(args.manifest) or len(args.yamls) > 1
+    args.docker_compose_yaml = None if args.batch or not args.yamls else args.yamls[0]
+
+    if args.manifest is None:
+        if not args.yamls:
+            parser.error("one of --yaml or --manifest is required")
+        if args.outfile is None or args.formats is None:
+            parser.error("--outfile and --format are required with --yaml")
+    elif args.yamls:
+        parser.error("--yaml and --manifest are mutually exclusive")
+
+    if args.batch and args.watch:
+        parser.error("--watch renders a single project")
 
-def setup_logging(loglevel):
+    if args.partition is not None and (args.batch or args.watch):
+        parser.error("--partition renders a single project, without --watch")
+
+    return args
+
+
+def setup_logging(loglevel, force=False):
     """Setup basic logging
 
     Args:
       loglevel (int): minimum loglevel for emitting messages
+      force (bool): replace an existing logging configuration
     """
     logformat = "[%(asctime)s] %(levelname)s:%(name)s:%(message)s"
     logging.basicConfig(
-        level=loglevel, stream=sys.stdout, format=logformat, datefmt="%Y-%m-%d %H:%M:%S"
+        level=loglevel or logging.WARNING,
+        stream=sys.stdout,
+        format=logformat,
+        datefmt="%Y-%m-%d %H:%M:%S",
+        force=force,
+    )
+
+
+def load_project(
+        args: argparse.Namespace,
+        cache: Union[ParseCache, StatCache, None] = None,
+        label_cache: Union[LabelCache, None] = None,
+        model_cache: Union[ModelCache, None] = None,
+) -> DockerComposeGraph:
+    """Build the model of the project described by ``args``"""
+
+    dcg = DockerComposeGraph(
+        expandvars=args.expandvars,
+        resolve_relative_volumes=args.resolve_relative_volumes,
+        cache=cache,
+        include_workers=args.include_workers,
+        label_cache=label_cache,
+        model_cache=model_cache,
+        selection=Selection(
+            services=tuple(args.services),
+            exclude=tuple(args.exclude_services),
+            profiles=tuple(args.profiles),
+            closure=args.closure,
+        ),
+    )
+
+    if args.dot_env:
+        dcg.load_dotenv(
+            env=args.dot_env,
+        )
+
+    # Trees are extracted while the
+    # includes are still being loaded
+    trees = dcg.iter_docker_compose(
+        yaml=args.docker_compose_yaml,
     )
 
+    # The graph is streamed to the outputs while
+    # walking the model, see write_outputs()
+    dcg.build_model(trees)
+
+    return dcg
+
+
+def write_changed(
+        dcg: DockerComposeGraph,
+        args: argparse.Namespace,
+        outputs: dict[str, pathlib.Path],
+        *extra,
+) -> dict[str, pathlib.Path]:
+    """
+    Write the ``outputs`` (``{format: path}``) of ``dcg``
+    that changed since they were written (all of them with
+    ``--force``, see :func:`hash_sidecar`). ``extra`` is
+    hashed as well. Returns the outputs written.
+    """
+
+    # format -> project hash
+    digests = {format_: dcg.project_hash(format_, args.engine, *extra) for format_ in outputs}
+
+    pending = {}
+    for format_, outfile in outputs.items():
+        sidecar = hash_sidecar(outfile)
+        if not args.force and outfile.exists() and _read_hash(sidecar) == digests[format_]:
+            # Nothing changed since the output was written
+            dcg.stats.incr("writes_skipped")
+            _logger.info("Unchanged, skipped writing: %s" % outfile)
+        else:
+            # A failed write must not leave a matching hash behind
+            sidecar.unlink(missing_ok=True)
+            pending[format_] = outfile
+
+    if pending:
+        with dcg.stats.phase("write"):
+            fallback = dcg.write_outputs(
+                pending,
+                engine=args.engine,
+                timeout=args.render_timeout,
+            )
+
+        for format_, outfile in pending.items():
+            _logger.info("Output written to: %s" % outfile)
+            if fallback and format_ != "dot":
+                # Without a hash the next run retries the first plan
+                continue
+            hash_sidecar(outfile).write_text(f"{digests[format_]}\n")
+
+    return pending
+
+
+def render(
+        args: argparse.Namespace,
+        cache: Union[ParseCache, StatCache, None] = None,
+        label_cache: Union[LabelCache, None] = None,
+        model_cache: Union[ModelCache, None] = None,
+) -> DockerComposeGraph:
+    """Build the graph described by ``args`` and write it to ``args.outfile``"""
+
+    dcg = load_project(
+        args=args,
+        cache=cache,
+        label_cache=label_cache,
+        model_cache=model_cache,
+    )
+
+    write_changed(dcg, args, output_paths(args.outfile, args.formats))
+
+    if args.stats == "json":
+        print(dcg.stats.to_json())
+    elif args.stats == "table":
+        print(dcg.stats.format_table())
+
+    return dcg
+
+
+def render_partitioned(
+        args: argparse.Namespace,
+        cache: Union[ParseCache, StatCache, None] = None,
+) -> list[PartResult]:
+    """
+    Build the model of the project described by ``args``
+    once, split it by ``args.partition`` and render every
+    part next to ``args.outfile`` on ``args.workers``
+    processes. The index of the parts is written to
+    ``args.index`` (default: ``<outfile stem>.index.md``).
+    """
+
+    dcg = load_project(
+        args=args,
+        cache=cache,
+    )
+
+    sources = None
+    if args.partition == "file":
+        root = args.docker_compose_yaml.resolve().parent
+        sources = {
+            name: pathlib.Path(os.path.relpath(path, root)).as_posix()
+            for name, path in dcg.extracted["source"].items()
+        }
+
+    with dcg.stats.phase("partition"):
+        parts = make_parts(
+            partition_model(dcg.model, by=args.partition, sources=sources),
+            service_hashes=dcg.service_hashes,
+            model=dcg.model,
+            declared=dcg.declared_services,
+            outfile=args.outfile,
+            formats=args.formats,
+            label=args.docker_compose_yaml.as_posix(),
+        )
+    dcg.stats.incr("parts", len(parts))
+
+    args.outfile.parent.mkdir(parents=True, exist_ok=True)
+
+    with dcg.stats.phase("render_parts"):
+        results = render_parts(
+            parts=parts,
+            args=args,
+            workers=args.workers,
+        )
+
+    index = args.index or args.outfile.with_name(f"{args.outfile.stem}.index.md")
+    index.parent.mkdir(parents=True, exist_ok=True)
+    write_index(
+        index,
+        results,
+        title=f"{args.docker_compose_yaml.as_posix()}: {len(parts)} parts by {args.partition}",
+    )
+    _logger.info("Index written to: %s" % index)
+
+    if args.stats == "json":
+        print(dcg.stats.to_json())
+    elif args.stats == "table":
+        print(dcg.stats.format_table())
+
+    return results
+
+
+def hash_sidecar(outfile: pathlib.Path) -> pathlib.Path:
+    """The file next to ``outfile`` recording its project hash"""
+    return outfile.with_name(f"{outfile.name}.sha256")
+
+
+def _read_hash(sidecar: pathlib.Path) -> Union[str, None]:
+    try:
+        return sidecar.read_text().strip()
+    except OSError:
+        return None
+
+
+def watch(
+        args: argparse.Namespace,
+        cache: Union[ParseCache, None] = None,
+) -> None:
+    """
+    Render once, then re-render whenever one of the resolved
+    compose files or the .env file changes. Only changed files
+    are parsed and visited again, only the services declared
+    in them are merged, interpolated and modelled again (all
+    of them if the .env file changed) and only labels of
+    changed services are rendered again. The graph is written
+    in full.
+    """
+
+    stat_cache = StatCache(fallback=cache)
+    model_cache = ModelCache()
+
+    # Every build loads the .env file again: variables
+    # removed from it must not keep their old values
+    environ = dict(os.environ)
+
+    def build(changed: set[pathlib.Path]) -> list[pathlib.Path]:
+
+        os.environ.clear()
+        os.environ.update(environ)
+
+        model_cache.invalidate(changed)
+
+        # Labels are cached by content (LABEL_CACHE): changed
+        # values from .env change the keys of affected labels
+        dcg = render(
+            args=args,
+            cache=stat_cache,
+            model_cache=model_cache,
+        )
+
+        files = list(dcg.include_graph.order)
+        if args.dot_env:
+            files.append(args.dot_env.resolve())
+
+        return files
+
+    watcher = Watcher(
+        build=build,
+        interval=args.watch_interval,
+        debounce=args.debounce,
+        # Until the first build succeeds
+        files=[args.docker_compose_yaml.resolve(), *([args.dot_env.resolve()] if args.dot_env else [])],
+    )
+
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        pass
+
+
+def parse_deps_args(args):
+    """Parse command line parameters of the ``deps`` subcommand
+
+    Args:
+      args (List[str]): command line parameters as list of strings
+          (without ``deps``).
+
+    Returns:
+      :obj:`argparse.Namespace`: command line parameters namespace
+    """
+    parser = argparse.ArgumentParser(
+        prog="docker-compose-graph deps",
+        description="""Query the depends_on relation of a Docker Compose file without rendering""",
+    )
+    parser.add_argument(
+        "-v",
+        "--verbose",
+        dest="loglevel",
+        help="set loglevel to INFO",
+        action="store_const",
+        const=logging.INFO,
+    )
+
+    parser.add_argument(
+        "--no-expand-vars",
+        "-nx",
+        dest="expandvars",
+        default=True,
+        action="store_false",
+        required=False,
+        help="Don't expand environment variables",
+    )
+
+    parser.add_argument(
+        "--yaml",
+        "-y",
+        dest="docker_compose_yaml",
+        metavar="DOCKER_COMPOSE_YAML",
+        type=pathlib.Path,
+        required=True,
+        help="Full path to docker-compose.yaml",
+    )
+
+    parser.add_argument(
+        "--dot-env",
+        "-d",
+        dest="dot_env",
+        default=None,
+        type=pathlib.Path,
+        required=False,
+        help="Full path to .env file",
+    )
+
+    parser.add_argument(
+        "--upstream",
+        dest="upstream",
+        metavar="SERVICE",
+        default=[],
+        action="append",
+        required=False,
+        help="Print what SERVICE transitively depends on (repeatable)",
+    )
+
+    parser.add_argument(
+        "--downstream",
+        dest="downstream",
+        metavar="SERVICE",
+        default=[],
+        action="append",
+        required=False,
+        help="Print what transitively depends on SERVICE (repeatable)",
+    )
+
+    parser.add_argument(
+        "--levels",
+        dest="levels",
+        default=False,
+        action="store_true",
+        required=False,
+        help="Print the startup order (services of a level can start in parallel)",
+    )
+
+    parser.add_argument(
+        "--cycles",
+        dest="cycles",
+        default=False,
+        action="store_true",
+        required=False,
+        help="Print depends_on cycles and exit with 1 if there are any",
+    )
+
+    parser.add_argument(
+        "--json",
+        dest="json",
+        default=False,
+        action="store_true",
+        required=False,
+        help="Print the results as json",
+    )
+
+    args = parser.parse_args(args)
+
+    if not (args.upstream or args.downstream or args.levels or args.cycles):
+        # Overview
+        args.levels = args.cycles = True
+
+    return args
+
+
+def deps(args: argparse.Namespace) -> int:
+    """Print the queries of ``args`` (see :func:`parse_deps_args`), return the exit code"""
+
+    dcg = DockerComposeGraph(
+        expandvars=args.expandvars,
+    )
+
+    if args.dot_env:
+        dcg.load_dotenv(env=args.dot_env)
+
+    dcg.build_model(dcg.iter_docker_compose(yaml=args.docker_compose_yaml))
+
+    graph = dcg.dependency_graph()
+
+    for service in [*args.upstream, *args.downstream]:
+        if service not in graph:
+            raise SystemExit(f"Unknown service: {service}")
+
+    def ordered(services: set[str]) -> list[str]:
+        return [service for service in graph if service in services]
+
+    results = {}
+    if args.upstream:
+        results["upstream"] = ordered(graph.upstream_closure(args.upstream) - set(args.upstream))
+    if args.downstream:
+        results["downstream"] = ordered(graph.downstream_closure(args.downstream) - set(args.downstream))
+    if args.levels:
+        results["levels"] = graph.levels()
+    if args.cycles:
+        results["cycles"] = graph.cycles()
+    if graph.missing:
+        results["missing"] = list(graph.missing)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for key in ("upstream", "downstream"):
+            if key in results:
+                print(f"{key}:")
+                for service in results[key]:
+                    print(f"  {service}")
+        if "levels" in results:
+            print("levels:")
+            for i, services in enumerate(results["levels"]):
+                print(f"  {i}: {' '.join(services)}")
+        if "cycles" in results:
+            print(f"cycles: {len(results['cycles'])}")
+            for cycle in results["cycles"]:
+                print(f"  {' -> '.join([*cycle, cycle[0]])}")
+        if "missing" in results:
+            print("missing:")
+            for service in results["missing"]:
+                print(f"  {service}")
+
+    return 1 if results.get("cycles") else 0
+
 
 def main(args):
     """Wrapper allowing :func:`fib` to be called with string arguments in a CLI fashion
@@ -1325,32 +2441,70 @@ def main(args):
       args (List[str]): command line parameters as list of strings
           (for example  ``["--verbose", "42"]``).
     """
+    if args and args[0] == "deps":
+        # Subcommand: queries only, nothing is rendered
+        args = parse_deps_args(args[1:])
+        setup_logging(args.loglevel, force=True)
+        if deps(args):
+            sys.exit(1)
+        return
+
     args = parse_args(args)
-    setup_logging(args.loglevel)
-    # _logger.debug("Starting crazy calculations...")
-    dcg = DockerComposeGraph(
-        expandvars=args.expandvars,
-        resolve_relative_volumes=args.resolve_relative_volumes,
+    # force: importing this module already configured
+    # logging (DEBUG), the CLI level has to win, otherwise
+    # debug-only work is never skipped.
+    setup_logging(
+        args.loglevel or (logging.INFO if args.watch else None),
+        force=True,
     )
+    # _logger.debug("Starting crazy calculations...")
 
-    trees = dcg.parse_docker_compose(
-        yaml=args.docker_compose_yaml,
-    )
+    cache = ParseCache(cache_dir=args.cache_dir) if args.cache else None
 
-    if args.dot_env:
-        dcg.load_dotenv(
-            env=args.dot_env,
+    if args.cache:
+        # Next to the parse cache; compiled once per
+        # version of the templates
+        TEMPLATES.precompile((args.cache_dir or default_cache_dir()) / "templates")
+
+    if args.batch:
+        if args.manifest is not None:
+            jobs = load_manifest(args.manifest, default_formats=args.formats)
+        else:
+            jobs = jobs_from_args(args)
+
+        results = run_batch(
+            jobs=jobs,
+            args=args,
+            workers=args.workers,
         )
 
-    dcg.iterate_trees(trees)
+        print(format_summary(results))
 
-    dcg.graph.write(
-        path=args.outfile,
-        format=args.format,
-    )
+        if not all(result.ok for result in results):
+            sys.exit(1)
+
+    elif args.watch:
+        watch(
+            args=args,
+            cache=cache,
+        )
+    elif args.partition is not None:
+        results = render_partitioned(
+            args=args,
+            cache=cache,
+        )
+
+        print(format_parts_summary(results))
+
+        if not all(result.ok for result in results):
+            sys.exit(1)
+    else:
+        render(
+            args=args,
+            cache=cache,
+        )
 
     # print(f"The {args.n}-th Fibonacci number is {fib(args.n)}")
-    _logger.info("Output written to: %s" % args.outfile)
 
 
 def run():
@@ -0,0 +1,121 @@
+"""
+Streaming DOT writer.
+
+Writes DOT text to a stream as the elements of a graph
+arrive, instead of assembling ``pydot`` objects and
+serializing them at the end. Identifiers and attributes are
+quoted by pydot's rules, so the text is the same as
+``pydot.Dot.to_string()`` for the same elements in the same
+order::
+
+    with open("graph.dot", "w") as f:
+        writer = DotWriter(f)
+        writer.open_graph("main_graph", {"rankdir": "LR"})
+        writer.node("a", {"shape": "box"})
+        writer.edge("a", "b", {})
+        writer.close()
+"""
+from typing import Any, TextIO
+
+from pydot import quote_attr_if_necessary, quote_id_if_necessary
+
+
+__all__ = [
+    "DotWriter",
+]
+
+
+class DotWriter:
+
+    def __init__(
+            self,
+            stream: TextIO,
+    ):
+        self.stream = stream
+
+        # Written so far
+        self.nodes = 0
+        self.edges = 0
+
+        self._depth = 0
+
+    @staticmethod
+    def _attribute(key: str, value: Any) -> str:
+        if value == "":
+            value = '""'
+        if value is None:
+            return key
+        return f"{key}={quote_attr_if_necessary(value)}"
+
+    def _attributes(self, attributes: dict[str, Any]) -> str:
+        if not attributes:
+            return ""
+        return f" [{', '.join(self._attribute(k, v) for k, v in attributes.items())}]"
+
+    @staticmethod
+    def _endpoint(ref: str) -> str:
+        """Node reference with optional port(s), e.g. ``"node":"port":w``"""
+
+        if ref.startswith('"') and ref.endswith('"'):
+            return ref
+
+        index = ref.rfind(":")
+
+        if index > 0 and ref[0] == '"' and ref[index - 1] == '"':
+            # Quoted by the caller
+            return ref
+
+        if index > 0:
+            return f"{quote_id_if_necessary(ref[:index])}:{quote_id_if_necessary(ref[index + 1:])}"
+
+        return quote_id_if_necessary(ref)
+
+    def _open(self, keyword: str, name: str, attributes: dict[str, Any]) -> None:
+        self.stream.write(f"{keyword} {quote_id_if_necessary(name)} {{\n")
+        self.stream.write("".join(f"{self._attribute(k, v)};\n" for k, v in attributes.items()))
+        self._depth += 1
+
+    def open_graph(
+            self,
+            name: str,
+            attributes: dict[str, Any],
+            graph_type: str = "digraph",
+    ) -> None:
+        self._open(graph_type, name, attributes)
+
+    def open_subgraph(
+            self,
+            name: str,
+            attributes: dict[str, Any],
+    ) -> None:
+        """``name`` as in DOT (clusters start with ``cluster_``)"""
+        self._open("subgraph", name, attributes)
+
+    def close(self) -> None:
+        """Close the innermost (sub)graph"""
+        if not self._depth:
+            raise ValueError("No open graph")
+        self._depth -= 1
+        self.stream.write("}\n")
+
+    def node(
+            self,
+            name: str,
+            attributes: dict[str, Any],
+    ) -> None:
+
+        node = quote_id_if_necessary(name, unquoted_keywords=("graph", "node", "edge"))
+        if node in ("graph", "node", "edge") and not attributes:
+            return
+
+        self.stream.write(f"{node}{self._attributes(attributes)};\n")
+        self.nodes += 1
+
+    def edge(
+            self,
+            src: str,
+            dst: str,
+            attributes: dict[str, Any],
+    ) -> None:
+        self.stream.write(f"{self._endpoint(src)} -> {self._endpoint(dst)}{self._attributes(attributes)};\n")
+        self.edges += 1
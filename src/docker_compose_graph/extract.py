@@ -0,0 +1,185 @@
+"""
+Single-pass extraction of service aspects from compose trees.
+
+:class:`TreeVisitor` walks the services of every tree exactly
+once. For each service it collects the service fragment (for
+merging) and runs all extractors on it, so the number of tree
+walks does not grow with the number of extracted aspects.
+
+An extractor is a callable::
+
+    extractor(service_name, service_config, path) -> value
+
+``path`` is the compose file that declared the service (or
+``None`` if unknown). A return value of ``None`` records
+nothing. Results are collected per aspect and service; a
+later declaration of a service replaces an earlier one.
+
+Additional extractors can be registered for all builds::
+
+    @register_extractor("deploy")
+    def _deploy(service_name, service_config, path):
+        return service_config.get("deploy", None)
+
+or passed to a single :class:`DockerComposeGraph` (``extractors=``).
+"""
+import logging
+import pathlib
+from typing import Any, Callable, Union
+
+
+__all__ = [
+    "Extractor",
+    "EXTRACTORS",
+    "register_extractor",
+    "TreeVisitor",
+]
+
+
+_logger = logging.getLogger(__name__)
+
+
+Extractor = Callable[[str, dict, Union[pathlib.Path, None]], Any]
+
+# Name -> extractor, run on every build
+EXTRACTORS: dict[str, Extractor] = {}
+
+
+def register_extractor(name: str) -> Callable[[Extractor], Extractor]:
+    """
+    Register an extractor for all builds under ``name``.
+    Can be used as a function decorator.
+    """
+    def decorator(extractor: Extractor) -> Extractor:
+        EXTRACTORS[name] = extractor
+        return extractor
+    return decorator
+
+
+class TreeVisitor:
+    """
+    Collects service fragments and the results of
+    ``extractors`` (aspect -> service_name -> value)
+    in one pass per tree.
+    """
+
+    def __init__(
+            self,
+            extractors: dict[str, Extractor],
+    ):
+        self.extractors = extractors
+
+        self.results: dict[str, dict[str, Any]] = {name: {} for name in extractors}
+
+    @staticmethod
+    def _conform_environment(service_config: dict) -> None:
+
+        # some environment definitions in docker compose
+        # (i.e. for ayon) will be loaded as lists instead
+        # of k=v pairs. This "tries" to convert it
+        # Todo: maybe improve logic here
+        environment = service_config.get("environment", None)
+        if environment is not None:
+            if isinstance(environment, list):
+                _environment = dict()
+                for env in sorted(environment):
+                    k, v = env.replace(" ", "").split("=", maxsplit=1)
+                    _environment[k] = v
+                service_config["environment"] = _environment
+
+    def visit(
+            self,
+            tree: dict,
+            path: Union[pathlib.Path, None] = None,
+    ) -> list[dict]:
+        """
+        Run all extractors on the services of ``tree``
+        and return its service fragments
+        (``{"service_name": ..., "service_config": ...}``).
+        """
+
+        if _logger.isEnabledFor(logging.DEBUG):
+            _logger.debug("%s", tree)
+
+        services = []
+
+        for service_name, service_config in tree.get("services", {}).items():
+
+            # if isinstance(service_config, ResetNull):
+            #     # ResetNull objects are !reset YAML tags
+            #     _logger.warning(f"Skipping {service_name}: {type(service_config)}")
+            #     continue
+
+            self._conform_environment(service_config)
+
+            services.append(
+                {
+                    "service_name": service_name,
+                    "service_config": service_config,
+                }
+            )
+
+            for name, extractor in self.extractors.items():
+                value = extractor(service_name, service_config, path)
+                if value is not None:
+                    self.results[name][service_name] = value
+
+        return services
+
+
+@register_extractor("source")
+def _source(service_name: str, service_config: dict, path: Union[pathlib.Path, None]):
+    """The compose file declaring the service (the last one if several do)"""
+    return path
+
+
+@register_extractor("healthcheck")
+def _healthcheck(service_name: str, service_config: dict, path: Union[pathlib.Path, None]):
+    return service_config.get("healthcheck", None)
+
+
+@register_extractor("env_file")
+def _env_file(service_name: str, service_config: dict, path: Union[pathlib.Path, None]):
+    """
+    Paths of the ``env_file`` entries (short or long
+    syntax), relative to the declaring compose file
+    """
+
+    env_file = service_config.get("env_file", None)
+    if env_file is None:
+        return None
+
+    if not isinstance(env_file, list):
+        env_file = [env_file]
+
+    ret = []
+    for entry in env_file:
+        if isinstance(entry, dict):
+            entry = entry.get("path", None)
+            if entry is None:
+                continue
+        entry = pathlib.Path(entry)
+        if path is not None and not entry.is_absolute():
+            entry = path.parent / entry
+        ret.append(entry)
+
+    return ret
+
+
+@register_extractor("labels")
+def _labels(service_name: str, service_config: dict, path: Union[pathlib.Path, None]):
+    """``labels`` as a dict (list entries are ``key=value``)"""
+
+    labels = service_config.get("labels", None)
+    if labels is None:
+        return None
+
+    if isinstance(labels, dict):
+        return dict(labels)
+
+    ret = {}
+    for label in labels:
+        key, _, value = str(label).partition("=")
+        ret[key] = value
+
+    return ret
@@ -0,0 +1,302 @@
+"""
+Resolution of Docker Compose ``include`` chains.
+
+Every compose file is identified by its resolved absolute
+path and parsed exactly once, no matter how many ``include``
+chains reach it. A file reached again is still applied again
+at that point (with its includes), so its values win over
+the files in between as if it was parsed again. The include
+relations are kept as a DAG (file -> included files); an
+include cycle is reported as an :class:`IncludeCycleError`
+instead of recursing forever.
+
+- https://docs.docker.com/reference/compose-file/include/
+"""
+import logging
+import os
+import pathlib
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Iterator, Union
+
+from docker_compose_graph.cache import ParseCache, StatCache
+from docker_compose_graph.stats import Stats
+from docker_compose_graph.yaml_tags.loader import load_yaml
+
+
+__all__ = [
+    "DEFAULT_MAX_WORKERS",
+    "IncludeCycleError",
+    "IncludeGraph",
+]
+
+
+_logger = logging.getLogger(__name__)
+
+
+# Reading includes is I/O bound (network file
+# systems in particular), hence more threads
+# than cores.
+DEFAULT_MAX_WORKERS = min(8, (os.cpu_count() or 1) + 4)
+
+
+class IncludeCycleError(Exception):
+    """
+    Raised if a compose file (directly or
+    indirectly) includes itself.
+    """
+
+    def __init__(self, cycle: list[pathlib.Path]):
+        self.cycle = cycle
+        super().__init__(
+            "Include cycle detected: %s" % " -> ".join(p.as_posix() for p in cycle)
+        )
+
+
+class IncludeGraph:
+    """
+    The include DAG of a compose project.
+
+    ``edges`` maps every parsed file to the files
+    it includes (in declaration order), ``order``
+    lists the files in the order they were parsed
+    (depth-first, pre-order). The trees returned by
+    :meth:`resolve` are in the same order, plus the
+    files reached again where they are reached.
+    """
+
+    def __init__(
+            self,
+            cache: Union[ParseCache, StatCache, None] = None,
+            max_workers: int = DEFAULT_MAX_WORKERS,
+            stats: Union[Stats, None] = None,
+    ):
+        self.cache = cache
+        self.max_workers = max_workers
+        self.stats = stats or Stats()
+
+        self._executor: Union[ThreadPoolExecutor, None] = None
+        self._pending: dict[pathlib.Path, Future] = {}
+        # Included file -> (tree, includes), to apply a
+        # file reached again without parsing it again
+        self._parsed: dict[pathlib.Path, tuple[dict, list[tuple[pathlib.Path, pathlib.Path]]]] = {}
+
+        self.root: Union[pathlib.Path, None] = None
+        self.edges: dict[pathlib.Path, list[pathlib.Path]] = {}
+        self.order: list[pathlib.Path] = []
+
+    @property
+    def files(self) -> list[pathlib.Path]:
+        return list(self.order)
+
+    @staticmethod
+    def _to_abs_path(
+            yaml: pathlib.Path,
+            root_path: Union[pathlib.Path, None],
+    ) -> tuple[pathlib.Path, pathlib.Path]:
+        """
+        Returns the resolved absolute path of ``yaml`` and the
+        root path its own includes are relative to.
+        """
+
+        if yaml.is_absolute():
+            abs_yaml = yaml
+            root_path = abs_yaml.parent
+        else:
+            if root_path is None:
+                root_path = pathlib.Path.cwd()
+            root_path = root_path.joinpath(yaml.parent)
+            abs_yaml = pathlib.Path(os.path.join(root_path, yaml.name))
+
+        return abs_yaml.resolve(), root_path
+
+    @staticmethod
+    def get_includes(tree: dict) -> list[pathlib.Path]:
+        """
+        All paths listed in the ``include`` section of a
+        compose tree, in declaration order.
+        Supports the short (``- file.yaml``) and the
+        long (``- path: [...]``) syntax.
+        """
+
+        includes: list[pathlib.Path] = []
+
+        for include in (tree or {}).get("include", None) or []:
+            if isinstance(include, str):
+                includes.append(pathlib.Path(include))
+            elif isinstance(include, dict):
+                paths = include.get("path", [])
+                if isinstance(paths, str):
+                    paths = [paths]
+                includes.extend(pathlib.Path(p) for p in paths)
+
+        return includes
+
+    def load(self, abs_yaml: pathlib.Path) -> dict:
+        _logger.info("Processing %s", abs_yaml.as_posix())
+
+        self.stats.incr("files_parsed")
+
+        # Summed over all loader threads
+        with self.stats.phase("yaml_load"):
+            if self.cache is not None:
+                return self.cache.load(abs_yaml)
+
+            with open(abs_yaml, "rb") as fr:
+                return load_yaml(fr)
+
+    def resolve(
+            self,
+            yaml: pathlib.Path,
+            root_path: Union[pathlib.Path, None] = None,
+            ret: Union[list[dict], None] = None,
+    ) -> list[dict]:
+        """
+        Parse ``yaml`` and everything it includes.
+        Returns the list of trees in parse order.
+        """
+
+        if ret is None:
+            ret = []
+
+        ret.extend(
+            tree for _abs_yaml, tree in self.iter_trees(
+                yaml=yaml,
+                root_path=root_path,
+            )
+        )
+
+        return ret
+
+    def iter_trees(
+            self,
+            yaml: pathlib.Path,
+            root_path: Union[pathlib.Path, None] = None,
+    ) -> Iterator[tuple[pathlib.Path, dict]]:
+        """
+        Parse ``yaml`` and everything it includes, yielding
+        ``(path, tree)`` in parse order as soon as each
+        file is loaded. A file reached again through another
+        include chain is yielded again there; the trees of
+        included files are retained until the iteration ends
+        for that (the root file is never reached again).
+
+        The includes of a file are read and parsed
+        concurrently on a pool of ``max_workers``
+        threads, but consumed strictly in declaration
+        order, so the result does not depend on
+        ``max_workers``.
+        """
+
+        abs_yaml, root_path = self._to_abs_path(
+            yaml=yaml,
+            root_path=root_path,
+        )
+
+        if self.cache is not None:
+            cache_hits, cache_misses = self.cache.hits, self.cache.misses
+
+        if self.max_workers > 1:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.max_workers,
+                thread_name_prefix="include",
+            )
+
+        try:
+            yield from self._visit(
+                abs_yaml=abs_yaml,
+                root_path=root_path,
+                stack=[],
+            )
+        finally:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True, cancel_futures=True)
+                self._executor = None
+            self._pending.clear()
+            self._parsed.clear()
+
+        if self.root is None:
+            self.root = abs_yaml
+
+        if self.cache is not None:
+            self.cache.prune()
+            self.stats.incr("cache_hits", self.cache.hits - cache_hits)
+            self.stats.incr("cache_misses", self.cache.misses - cache_misses)
+
+    def _prefetch(
+            self,
+            abs_yamls: list[pathlib.Path],
+    ) -> None:
+        """
+        Start loading files that have not been
+        parsed yet in the background.
+        """
+
+        if self._executor is None:
+            return
+
+        for abs_yaml in abs_yamls:
+            if abs_yaml in self.edges or abs_yaml in self._pending:
+                continue
+            self._pending[abs_yaml] = self._executor.submit(self.load, abs_yaml)
+
+    def _load_pending(
+            self,
+            abs_yaml: pathlib.Path,
+    ) -> dict:
+
+        future = self._pending.pop(abs_yaml, None)
+
+        if future is None:
+            return self.load(abs_yaml)
+
+        return future.result()
+
+    def _visit(
+            self,
+            abs_yaml: pathlib.Path,
+            root_path: pathlib.Path,
+            stack: list[pathlib.Path],
+    ) -> Iterator[tuple[pathlib.Path, dict]]:
+
+        if abs_yaml in stack:
+            raise IncludeCycleError(
+                cycle=[*stack[stack.index(abs_yaml):], abs_yaml],
+            )
+
+        if abs_yaml in self.edges:
+            # Already parsed through another include chain,
+            # applied again here: later files win
+            _logger.debug("Applying %s again (already parsed)", abs_yaml.as_posix())
+            tree, includes = self._parsed[abs_yaml]
+
+        else:
+            tree = self._load_pending(abs_yaml)
+
+            self.order.append(abs_yaml)
+
+            includes = [
+                self._to_abs_path(
+                    yaml=include,
+                    root_path=root_path,
+                )
+                for include in self.get_includes(tree)
+            ]
+
+            self.edges[abs_yaml] = [include for include, _ in includes]
+
+            self._prefetch([include for include, _ in includes])
+
+            if stack:
+                self._parsed[abs_yaml] = tree, includes
+
+        yield abs_yaml, tree
+        del tree
+
+        stack.append(abs_yaml)
+        for include, include_root_path in includes:
+            yield from self._visit(
+                abs_yaml=include,
+                root_path=include_root_path,
+                stack=stack,
+            )
+        stack.pop()
@@ -0,0 +1,271 @@
+"""
+Docker Compose variable interpolation.
+
+Implements the Compose interpolation rules:
+
+- ``$VAR`` / ``${VAR}``: value of ``VAR``, blank if unset
+- ``${VAR:-default}`` / ``${VAR-default}``: ``default`` if
+  ``VAR`` is unset or empty / unset
+- ``${VAR:?err}`` / ``${VAR?err}``: error if ``VAR`` is
+  unset or empty / unset
+- ``${VAR:+alt}`` / ``${VAR+alt}``: ``alt`` if ``VAR`` is
+  set and not empty / set
+- ``$$``: a literal ``$``
+
+Defaults and alternatives may contain interpolations
+themselves (``${A:-${B}}``).
+
+Template strings are compiled once (module wide, the most
+recently used ones are kept) and the result of every
+expansion is cached per :class:`Interpolator`, i.e. per
+environment snapshot.
+
+- https://docs.docker.com/reference/compose-file/interpolation/
+"""
+import functools
+import logging
+import os
+import re
+from typing import Mapping, Union
+
+from docker_compose_graph.yaml_tags.overrides import OverrideArray
+
+
+__all__ = [
+    "InterpolationError",
+    "Interpolator",
+    "compile_template",
+]
+
+
+_logger = logging.getLogger(__name__)
+
+
+_NAME = re.compile(r"[_a-zA-Z][_a-zA-Z0-9]*")
+
+# Longest first
+_OPERATORS = (":-", ":?", ":+", "-", "?", "+")
+
+
+class InterpolationError(ValueError):
+    pass
+
+
+class _Variable:
+    __slots__ = ("name", "operator", "argument")
+
+    def __init__(
+            self,
+            name: str,
+            operator: Union[str, None] = None,
+            argument: tuple = (),
+    ):
+        self.name = name
+        self.operator = operator
+        self.argument = argument
+
+    def __repr__(self):
+        return "%s(name=%r, operator=%r, argument=%r)" % (
+            self.__class__.__name__, self.name, self.operator, self.argument)
+
+
+def _closing_brace(template: str, start: int) -> int:
+    """Index of the ``}`` matching the ``${`` before ``start``"""
+
+    depth = 1
+    i = start
+    while i < len(template):
+        if template.startswith("$$", i):
+            i += 2
+            continue
+        if template.startswith("${", i):
+            depth += 1
+            i += 2
+            continue
+        if template[i] == "}":
+            depth -= 1
+            if depth == 0:
+                return i
+        i += 1
+
+    raise InterpolationError(f"Invalid interpolation format (missing '}}'): {template!r}")
+
+
+@functools.lru_cache(maxsize=4096)
+def compile_template(template: str) -> tuple:
+    """
+    Compile ``template`` into a tuple of literal strings
+    and variables. Templates without ``$`` compile to
+    ``(template,)``.
+    """
+
+    if "$" not in template:
+        return (template,)
+
+    parts: list = []
+    literal: list[str] = []
+    i = 0
+
+    while i < len(template):
+        c = template[i]
+
+        if c != "$" or i + 1 == len(template):
+            literal.append(c)
+            i += 1
+            continue
+
+        nxt = template[i + 1]
+
+        if nxt == "$":
+            literal.append("$")
+            i += 2
+            continue
+
+        if nxt == "{":
+            end = _closing_brace(template, i + 2)
+            expression = template[i + 2:end]
+
+            match = _NAME.match(expression)
+            if match is None:
+                raise InterpolationError(f"Invalid interpolation format: {template!r}")
+
+            name = match.group(0)
+            rest = expression[match.end():]
+            operator = None
+            argument: tuple = ()
+
+            if rest:
+                operator = next((op for op in _OPERATORS if rest.startswith(op)), None)
+                if operator is None:
+                    raise InterpolationError(f"Invalid interpolation format: {template!r}")
+                argument = compile_template(rest[len(operator):])
+
+            variable = _Variable(name, operator, argument)
+            i = end + 1
+
+        else:
+            match = _NAME.match(template, i + 1)
+            if match is None:
+                # A lone $ is kept as is
+                literal.append(c)
+                i += 1
+                continue
+
+            variable = _Variable(match.group(0))
+            i = match.end()
+
+        if literal:
+            parts.append("".join(literal))
+            literal = []
+        parts.append(variable)
+
+    if literal:
+        parts.append("".join(literal))
+
+    return tuple(parts)
+
+
+class Interpolator:
+    """
+    Expands templates against a snapshot of ``environ``
+    (``os.environ`` at creation time by default).
+    """
+
+    def __init__(
+            self,
+            environ: Union[Mapping[str, str], None] = None,
+    ):
+        self.environ: dict[str, str] = dict(os.environ if environ is None else environ)
+
+        self._cache: dict[str, str] = {}
+        self._warned: set[str] = set()
+
+    def expand(self, template: str) -> str:
+        """Expand a single string (cached)"""
+
+        try:
+            return self._cache[template]
+        except KeyError:
+            pass
+
+        ret = self._render(compile_template(template), template)
+        self._cache[template] = ret
+
+        return ret
+
+    def _render(self, parts: tuple, template: str) -> str:
+
+        if len(parts) == 1 and isinstance(parts[0], str):
+            return parts[0]
+
+        out = []
+        for part in parts:
+            if isinstance(part, str):
+                out.append(part)
+            else:
+                out.append(self._resolve(part, template))
+
+        return "".join(out)
+
+    def _resolve(self, variable: _Variable, template: str) -> str:
+
+        value = self.environ.get(variable.name, None)
+        operator = variable.operator
+
+        if operator is None:
+            if value is None:
+                if variable.name not in self._warned:
+                    self._warned.add(variable.name)
+                    _logger.warning(
+                        "The %s variable is not set. Defaulting to a blank string.",
+                        variable.name,
+                    )
+                return ""
+            return value
+
+        # ":" makes empty count as unset
+        unset = value is None or (operator.startswith(":") and value == "")
+
+        if operator in (":-", "-"):
+            return self._render(variable.argument, template) if unset else value
+
+        if operator in (":?", "?"):
+            if unset:
+                message = self._render(variable.argument, template)
+                raise InterpolationError(
+                    f"Required variable {variable.name} is missing a value: {message}"
+                    f" (in {template!r})"
+                )
+            return value
+
+        # ":+", "+"
+        return "" if unset else self._render(variable.argument, template)
+
+    def interpolate(
+            self,
+            value,
+            skip: tuple[str, ...] = (),
+    ):
+        """
+        Return a copy of ``value`` (dicts, lists,
+        :class:`OverrideArray`) with all strings expanded.
+        Mapping keys are kept as is, values of keys in
+        ``skip`` are not expanded.
+        """
+
+        if isinstance(value, str):
+            return self.expand(value)
+
+        if isinstance(value, dict):
+            return {
+                k: v if k in skip else self.interpolate(v, skip)
+                for k, v in value.items()
+            }
+
+        if isinstance(value, list):
+            return [self.interpolate(v, skip) for v in value]
+
+        if isinstance(value, OverrideArray):
+            return OverrideArray(array=self.interpolate(value.array, skip))
+
+        return value
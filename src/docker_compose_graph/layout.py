@@ -0,0 +1,260 @@
+"""
+Run Graphviz: one layout, any number of outputs.
+
+Layout is the expensive step for big graphs. Graphviz renders
+every ``-T``/``-o`` pair of one invocation from the same layout,
+so all requested formats cost a single layout::
+
+    dot -Tsvg -o graph.svg -Tpng -o graph.png graph.dot
+
+``dot`` itself needs no Graphviz: the DOT source is written by
+:class:`~docker_compose_graph.dot_writer.DotWriter`.
+
+The cost of a layout grows much faster than the graph: ``dot``
+is fine for a few hundred services and takes hours for a few
+thousand. :func:`plan_layouts` picks the engine and settings
+from the size of the graph, cheapest last. A run exceeding its
+``timeout`` is killed, so the caller can fall back to the next
+plan instead of hanging::
+
+    for plan in plan_layouts(nodes, edges):
+        try:
+            run_graphviz(outputs, source, engine=plan.engine, timeout=60)
+            break
+        except GraphvizTimeout:
+            continue
+"""
+import dataclasses
+import io
+import pathlib
+import subprocess
+import tempfile
+import time
+from typing import Callable, TextIO, Union
+
+
+__all__ = [
+    "FORMATS",
+    "ENGINES",
+    "LABEL_DETAILS",
+    "GraphvizError",
+    "GraphvizTimeout",
+    "LayoutPlan",
+    "PLANS",
+    "FAST_LAYOUT_SIZE",
+    "SFDP_LAYOUT_SIZE",
+    "plan_layouts",
+    "output_paths",
+    "run_graphviz",
+]
+
+
+# Output formats of the CLI ("dot" is the DOT source)
+FORMATS = ("dot", "svg", "png")
+
+# Layout engines of the CLI ("auto": by size, see plan_layouts)
+ENGINES = ("auto", "dot", "sfdp", "neato")
+
+# "compact" service labels leave out the environment
+LABEL_DETAILS = ("full", "compact")
+
+# nodes + edges up to which the full dot layout is tried first
+FAST_LAYOUT_SIZE = 2_000
+# nodes + edges up to which dot (with limits) is tried first
+SFDP_LAYOUT_SIZE = 10_000
+
+
+class GraphvizError(RuntimeError):
+    pass
+
+
+class GraphvizTimeout(GraphvizError):
+    pass
+
+
+@dataclasses.dataclass(slots=True, frozen=True)
+class LayoutPlan:
+    """Engine and settings of one layout"""
+
+    name: str
+    engine: str
+    # Override the attributes of the root graph
+    graph_attributes: dict[str, str] = dataclasses.field(default_factory=dict)
+    label_detail: str = "full"
+
+    def __post_init__(self):
+        if self.label_detail not in LABEL_DETAILS:
+            raise ValueError(f"Unknown label detail: {self.label_detail} (one of {', '.join(LABEL_DETAILS)})")
+
+
+# Most to least expensive
+PLANS: dict[str, LayoutPlan] = {
+    plan.name: plan for plan in (
+        # As the graph is configured
+        LayoutPlan(
+            name="dot",
+            engine="dot",
+        ),
+        # Bounded network simplex and crossing minimization,
+        # ranks closer together, smaller labels
+        LayoutPlan(
+            name="dot-fast",
+            engine="dot",
+            graph_attributes={
+                "ranksep": "2",
+                "nslimit": "1",
+                "nslimit1": "1",
+                "mclimit": "0.1",
+                "remincross": "false",
+            },
+            label_detail="compact",
+        ),
+        # Force directed, multiscale: near linear in the size
+        # of the graph, but ignores clusters and ranks
+        LayoutPlan(
+            name="sfdp",
+            engine="sfdp",
+            graph_attributes={
+                "overlap": "prism",
+                "splines": "false",
+                "outputorder": "edgesfirst",
+            },
+            label_detail="compact",
+        ),
+        # Force directed, for small graphs only
+        LayoutPlan(
+            name="neato",
+            engine="neato",
+            graph_attributes={
+                "overlap": "prism",
+                "splines": "false",
+            },
+        ),
+    )
+}
+
+
+def plan_layouts(
+        nodes: int,
+        edges: int,
+        engine: str = "auto",
+) -> list[LayoutPlan]:
+    """
+    The plans to try in order: the first one is the best the
+    graph (``nodes`` and ``edges``) affords with ``engine``
+    (``auto``: picked by size), the others are cheaper
+    fallbacks in case it times out.
+    """
+
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown engine: {engine} (one of {', '.join(ENGINES)})")
+
+    if engine == "neato":
+        return [PLANS["neato"], PLANS["sfdp"]]
+
+    if engine == "sfdp":
+        return [PLANS["sfdp"]]
+
+    ladder = [PLANS["dot"], PLANS["dot-fast"], PLANS["sfdp"]]
+
+    if engine == "dot":
+        return ladder
+
+    size = nodes + edges
+    if size <= FAST_LAYOUT_SIZE:
+        return ladder
+    if size <= SFDP_LAYOUT_SIZE:
+        return ladder[1:]
+    return ladder[2:]
+
+
+def output_paths(
+        outfile: pathlib.Path,
+        formats: Union[list[str], tuple[str, ...]],
+) -> dict[str, pathlib.Path]:
+    """
+    ``{format: path}``. A single format is written to
+    ``outfile`` as is; for several formats the suffix of
+    ``outfile`` is replaced by the format
+    (``graph.svg`` -> ``graph.svg``, ``graph.png``, ...).
+    """
+
+    if len(formats) == 1:
+        return {formats[0]: outfile}
+
+    return {format_: outfile.with_suffix(f".{format_}") for format_ in formats}
+
+
+def run_graphviz(
+        outputs: dict[str, pathlib.Path],
+        source: Union[pathlib.Path, Callable[[TextIO], None]],
+        prog: str = "dot",
+        engine: Union[str, None] = None,
+        timeout: Union[float, None] = None,
+) -> None:
+    """
+    Lay out the graph once and write it in all formats of
+    ``outputs`` (``{format: path}``). ``source`` is a DOT file
+    or a callable writing DOT to the stream it is given, which
+    is piped to Graphviz while it is written.
+
+    ``engine`` overrides the layout engine of ``prog``
+    (``-K``). Graphviz is killed and :class:`GraphvizTimeout`
+    raised if it takes longer than ``timeout`` seconds
+    (including writing the source).
+    """
+
+    deadline = None if timeout is None else time.monotonic() + timeout
+
+    cmd = [prog]
+    if engine is not None:
+        cmd.append(f"-K{engine}")
+    for format_, path in outputs.items():
+        cmd += [f"-T{format_}", f"-o{path}"]
+
+    piped = not isinstance(source, pathlib.Path)
+    if not piped:
+        cmd.append(str(source))
+
+    # A file, not a pipe: Graphviz must never block
+    # on stderr while the source is still written
+    with tempfile.TemporaryFile() as stderr:
+
+        try:
+            process = subprocess.Popen(
+                cmd,
+                stdin=subprocess.PIPE if piped else None,
+                stdout=subprocess.DEVNULL,
+                stderr=stderr,
+            )
+        except FileNotFoundError as e:
+            raise GraphvizError(f'"{prog}" not found in path (is Graphviz installed?)') from e
+
+        if piped:
+            stdin = io.TextIOWrapper(process.stdin, encoding="utf-8")
+            try:
+                source(stdin)
+                stdin.close()
+            except BrokenPipeError:
+                # Graphviz gave up early, the reason is on stderr
+                pass
+            except BaseException:
+                process.kill()
+                process.wait()
+                raise
+
+        try:
+            returncode = process.wait(
+                timeout=None if deadline is None else max(0.0, deadline - time.monotonic()),
+            )
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+            raise GraphvizTimeout(f'"{prog}" killed after {timeout:g} seconds') from None
+
+        if returncode:
+            stderr.seek(0)
+            raise GraphvizError(
+                f'"{prog}" exited with {process.returncode}: '
+                f'{stderr.read().decode(errors="replace").strip()}'
+            )
@@ -0,0 +1,397 @@
+"""
+Typed model of merged Compose services.
+
+Built once per build from the merged (and interpolated)
+service configs; label rendering and graph assembly read
+the parsed records instead of splitting the raw strings
+again at every stage.
+
+    services = build_services(dcg.services)
+    services["web"].ports[0].host
+
+Records use ``__slots__``, so a service costs a handful
+of pointers instead of a dict per record.
+"""
+import dataclasses
+import functools
+import shlex
+from typing import Any, Iterable, Union
+
+from docker_compose_graph.yaml_tags.overrides import OverrideArray
+
+
+__all__ = [
+    "PortBinding",
+    "compress_ports",
+    "VolumeMount",
+    "is_host_path",
+    "NetworkAttachment",
+    "Dependency",
+    "Service",
+    "build_services",
+]
+
+
+@dataclasses.dataclass(slots=True, frozen=True)
+class PortBinding:
+    """
+    ``[HOST_IP:][HOST:]CONTAINER[/PROTOCOL]``. ``host`` and
+    ``container`` are single ports or ranges (``8000-8100``);
+    ``host`` is ``None`` if Docker picks a random host port.
+    """
+
+    host: Union[str, None]
+    container: str
+    host_ip: Union[str, None] = None
+    protocol: str = "tcp"
+
+    @classmethod
+    def parse(cls, spec: Union[str, int, dict]) -> "PortBinding":
+        """Short or long syntax (memoized for short syntax)"""
+
+        if isinstance(spec, dict):
+            return _parse_port_dict(spec)
+
+        return _parse_port(str(spec))
+
+    @property
+    def key(self) -> str:
+        """Unique per service; used for node names and plugs"""
+        key = f"{self.host or ''}__{self.container}"
+        if self.protocol != "tcp":
+            key = f"{key}__{self.protocol}"
+        return key
+
+    @property
+    def host_range(self) -> Union[tuple[int, int], None]:
+        return _port_range(self.host)
+
+    @property
+    def container_range(self) -> Union[tuple[int, int], None]:
+        return _port_range(self.container)
+
+    def __str__(self) -> str:
+        ret = self.container if self.host is None else f"{self.host}:{self.container}"
+        if self.protocol != "tcp":
+            ret = f"{ret}/{self.protocol}"
+        return ret
+
+
+def _port_range(port: Union[str, None]) -> Union[tuple[int, int], None]:
+    """``(start, end)`` or ``None`` if not numeric"""
+
+    if port is None:
+        return None
+
+    start, _, end = port.partition("-")
+    if not start.isdigit() or (end and not end.isdigit()):
+        return None
+
+    return int(start), int(end or start)
+
+
+@functools.lru_cache(maxsize=4096)
+def _parse_port(spec: str) -> PortBinding:
+    """
+    - https://docs.docker.com/reference/compose-file/services/#ports
+    """
+
+    protocol = "tcp"
+    if "/" in spec:
+        spec, protocol = spec.rsplit("/", 1)
+
+    host_ip = None
+
+    if spec.startswith("["):
+        # [::1]:6001:6001
+        host_ip, _, spec = spec[1:].partition("]")
+        spec = spec.removeprefix(":")
+
+    parts = spec.split(":")
+
+    if len(parts) > 3:
+        # ::1:6000:6000 (IPv6 without brackets)
+        host_ip = ":".join(parts[:-2])
+        parts = parts[-2:]
+    elif len(parts) == 3:
+        host_ip, parts = parts[0], parts[1:]
+
+    if len(parts) == 1:
+        host, container = None, parts[0]
+    else:
+        host, container = parts
+
+    return PortBinding(
+        host=host or None,
+        container=container,
+        host_ip=host_ip or None,
+        protocol=protocol,
+    )
+
+
+def _parse_port_dict(spec: dict) -> PortBinding:
+
+    published = spec.get("published", None)
+
+    return PortBinding(
+        host=None if published is None else str(published),
+        container=str(spec.get("target")),
+        host_ip=spec.get("host_ip", None),
+        protocol=spec.get("protocol", None) or "tcp",
+    )
+
+
+def compress_ports(ports: Iterable[PortBinding]) -> tuple[PortBinding, ...]:
+    """
+    Fold consecutive bindings with contiguous host and
+    container ports (``5000:5000``, ``5001:5001``, ...)
+    into one range binding (``5000-5001:5000-5001``).
+    Only 1:1 mappings (host and container ranges of the
+    same width) are folded; ``8000-9000:80`` is not.
+    """
+
+    ret: list[PortBinding] = []
+
+    for port in ports:
+        if ret:
+            previous = ret[-1]
+            ranges = (
+                previous.host_range,
+                previous.container_range,
+                port.host_range,
+                port.container_range,
+            )
+            if (
+                    None not in ranges
+                    and previous.host_ip == port.host_ip
+                    and previous.protocol == port.protocol
+                    and ranges[0][1] + 1 == ranges[2][0]
+                    and ranges[1][1] + 1 == ranges[3][0]
+                    and ranges[0][1] - ranges[0][0] == ranges[1][1] - ranges[1][0]
+                    and ranges[2][1] - ranges[2][0] == ranges[3][1] - ranges[3][0]
+            ):
+                ret[-1] = PortBinding(
+                    host=f"{ranges[0][0]}-{ranges[2][1]}",
+                    container=f"{ranges[1][0]}-{ranges[3][1]}",
+                    host_ip=port.host_ip,
+                    protocol=port.protocol,
+                )
+                continue
+        ret.append(port)
+
+    return tuple(ret)
+
+
+@dataclasses.dataclass(slots=True, frozen=True)
+class VolumeMount:
+    """
+    ``[SOURCE:]TARGET[:MODE]`` or the long syntax. ``type`` is
+    ``bind`` for host paths and ``volume`` for named (or, without
+    ``source``, anonymous) volumes. ``mode`` is ``None`` if not
+    given, otherwise e.g. ``ro`` or ``ro,z``.
+    """
+
+    source: Union[str, None]
+    target: str
+    mode: Union[str, None] = None
+    type: str = "bind"
+
+    @classmethod
+    def parse(cls, spec: Union[str, dict]) -> Union["VolumeMount", None]:
+        """
+        Short or long syntax (memoized for short syntax).
+        ``None`` for long syntax volumes without target.
+        """
+
+        if isinstance(spec, dict):
+            return _parse_volume_dict(spec)
+
+        return _parse_volume(spec)
+
+    @property
+    def is_bind(self) -> bool:
+        return self.type == "bind"
+
+    def __str__(self) -> str:
+        ret = self.target if self.source is None else f"{self.source}:{self.target}"
+        if self.mode is not None:
+            ret = f"{ret}:{self.mode}"
+        return ret
+
+
+def is_host_path(source: str) -> bool:
+    """
+    Short syntax sources are host paths if they look like
+    one; anything else is the name of a volume. Sources
+    with unexpanded variables are taken for paths.
+    """
+    return source.startswith(("/", ".", "~")) or "$" in source
+
+
+@functools.lru_cache(maxsize=4096)
+def _parse_volume(spec: str) -> VolumeMount:
+    """
+    - https://docs.docker.com/reference/compose-file/services/#volumes
+    """
+
+    split = spec.split(":")
+
+    if len(split) == 1:
+        # Anonymous volume
+        return VolumeMount(source=None, target=split[0], type="volume")
+
+    source, target = split[0], split[1]
+
+    return VolumeMount(
+        source=source,
+        target=target,
+        mode=":".join(split[2:]) or None,
+        type="bind" if is_host_path(source) else "volume",
+    )
+
+
+def _parse_volume_dict(spec: dict) -> Union[VolumeMount, None]:
+
+    target = spec.get("target", None)
+    if not target:
+        return None
+
+    mode = []
+    if spec.get("read_only", False):
+        mode.append("ro")
+    selinux = (spec.get("bind", None) or {}).get("selinux", None)
+    if selinux:
+        mode.append(selinux)
+
+    return VolumeMount(
+        source=spec.get("source", None) or None,
+        target=target,
+        mode=",".join(mode) or None,
+        type=spec.get("type", "volume"),
+    )
+
+
+@dataclasses.dataclass(slots=True, frozen=True)
+class NetworkAttachment:
+    """A network or, for ``network_mode``, the mode (``host``, ...)"""
+
+    name: str
+    network_mode: bool = False
+
+
+@dataclasses.dataclass(slots=True, frozen=True)
+class Dependency:
+    """``depends_on`` entry; ``condition`` is ``None`` for the short syntax"""
+
+    service: str
+    condition: Union[str, None] = None
+
+
+@dataclasses.dataclass(slots=True)
+class Service:
+
+    name: str
+    container_name: Union[str, None] = None
+    hostname: Union[str, None] = None
+    domainname: Union[str, None] = None
+    restart: Union[str, None] = None
+    image: Union[str, None] = None
+    command: str = "-"
+    healthcheck: Union[str, None] = None
+    environment: dict[str, Any] = dataclasses.field(default_factory=dict)
+    ports: tuple[PortBinding, ...] = ()
+    volumes: tuple[VolumeMount, ...] = ()
+    networks: tuple[NetworkAttachment, ...] = ()
+    depends_on: tuple[Dependency, ...] = ()
+    profiles: tuple[str, ...] = ()
+    # The merged service config as is, for
+    # everything that is not modelled (yet)
+    config: dict = dataclasses.field(default_factory=dict, repr=False, compare=False)
+
+    @classmethod
+    def from_config(cls, name: str, config: dict) -> "Service":
+
+        _command = config.get("command", "-")
+        if isinstance(_command, list):
+            command = " ".join(_command)
+        elif isinstance(_command, str):
+            command = _command
+        else:
+            raise TypeError(f"Unhandled command type: {_command} ({type(_command)})")
+
+        healthcheck = None
+        _healthcheck = config.get("healthcheck", {})
+        if bool(_healthcheck):
+            _healthcheck_cmd = _healthcheck.get("test", [])
+            if bool(_healthcheck_cmd):
+                healthcheck = " ".join(shlex.quote(s) for s in _healthcheck_cmd)
+
+        _ports = config.get("ports", [])
+        if isinstance(_ports, OverrideArray):
+            # Todo: find a better solution
+            _ports = sorted(_ports.array, key=str)
+
+        _volumes = config.get("volumes", [])
+        if isinstance(_volumes, OverrideArray):
+            _volumes = _volumes.array
+
+        volumes = (VolumeMount.parse(v) for v in _volumes)
+
+        if "networks" in config:
+            networks = [NetworkAttachment(name=n) for n in config.get("networks", [])]
+        elif "network_mode" in config:
+            networks = [NetworkAttachment(name=config.get("network_mode"), network_mode=True)]
+        else:
+            networks = []
+
+        return cls(
+            name=name,
+            container_name=config.get("container_name", None),
+            hostname=config.get("hostname", None),
+            domainname=config.get("domainname", None),
+            restart=config.get("restart", None),
+            image=config.get("image", None),
+            command=command,
+            healthcheck=healthcheck,
+            environment=config.get("environment", {}),
+            ports=compress_ports(PortBinding.parse(p) for p in _ports),
+            volumes=tuple(v for v in volumes if v is not None),
+            networks=tuple(sorted(networks, key=lambda n: n.name)),
+            depends_on=tuple(_dependencies(config.get("depends_on", []))),
+            profiles=tuple(config.get("profiles", [])),
+            config=config,
+        )
+
+
+def _dependencies(depends_on: Union[list, dict]) -> Iterable[Dependency]:
+    """
+    depends_on comes as a list of names or as a dict
+    of name -> {condition: ...} (long syntax)
+    """
+
+    if isinstance(depends_on, list):
+        for service in depends_on:
+            yield Dependency(service=service)
+        return
+
+    for service, options in depends_on.items():
+        condition = None
+        if isinstance(options, dict):
+            condition = options.get("condition", None)
+        yield Dependency(service=service, condition=condition)
+
+
+def build_services(services: Iterable[dict]) -> dict[str, Service]:
+    """
+    ``{service_name: Service}`` from merged services
+    (``{"service_name": ..., "service_config": ...}``)
+    in their order.
+    """
+
+    return {
+        service["service_name"]: Service.from_config(
+            name=service["service_name"],
+            config=service["service_config"],
+        )
+        for service in services
+    }
@@ -0,0 +1,362 @@
+"""
+Partitioned rendering: one graph per part of a project.
+
+One graph of thousands of services is unreadable, and its
+layout takes much longer than that of many small graphs
+(Graphviz layout is superlinear). A partition splits the model
+into parts; every part is rendered on its own, in parallel on a
+process pool, and an index (Markdown or HTML) links them::
+
+    parts = make_parts(
+        partition_model(dcg.model, by="network"),
+        service_hashes=dcg.service_hashes,
+        model=dcg.model,
+        outfile=pathlib.Path("out/graph.svg"),
+        formats=("svg",),
+    )
+    results = render_parts(parts, args)
+    write_index(pathlib.Path("out/graph.index.md"), results, title="graph")
+
+Partitions:
+
+- ``network``: the services attached to each network (services
+  without networks are on ``default``, as in compose). A service
+  attached to several networks is in several parts.
+- ``file``: the services by the compose file declaring them
+  (the last one if several do, see the ``source`` extractor)
+- ``component``: the services connected by ``depends_on``
+  (``component-<first service>``); services without any
+  ``depends_on`` share one part (``standalone``)
+
+A part draws its own services only; the services of other
+parts they depend on are drawn as "not shown" stubs.
+"""
+import argparse
+import dataclasses
+import html
+import logging
+import os
+import pathlib
+import re
+import time
+import traceback
+import urllib.parse
+from concurrent.futures import ProcessPoolExecutor
+from typing import Union
+
+from docker_compose_graph.dependencies import DependencyGraph
+from docker_compose_graph.layout import output_paths
+from docker_compose_graph.model import Service
+
+
+__all__ = [
+    "PARTITIONS",
+    "STANDALONE",
+    "Part",
+    "PartResult",
+    "partition_model",
+    "make_parts",
+    "render_parts",
+    "write_index",
+    "format_parts_summary",
+]
+
+
+_logger = logging.getLogger(__name__)
+
+
+PARTITIONS = ("network", "file", "component")
+
+# Part of the services without depends_on (partition by
+# component). Other parts are prefixed, see partition_model.
+STANDALONE = "standalone"
+
+
+@dataclasses.dataclass
+class Part:
+    name: str
+    outputs: dict[str, pathlib.Path]
+    # The services of the part only
+    model: dict[str, Service] = dataclasses.field(repr=False)
+    service_hashes: dict[str, str] = dataclasses.field(repr=False)
+    # Label of the graph
+    label: str = ""
+    # Declared services the services of the part depend on
+    declared: set[str] = dataclasses.field(default_factory=set, repr=False)
+
+
+@dataclasses.dataclass
+class PartResult:
+    name: str
+    services: int
+    outputs: dict[str, pathlib.Path]
+    ok: bool
+    seconds: float
+    # Formats skipped because nothing changed
+    skipped: tuple[str, ...] = ()
+    error: Union[str, None] = None
+
+
+def partition_model(
+        model: dict[str, Service],
+        by: str,
+        sources: Union[dict[str, str], None] = None,
+) -> dict[str, list[str]]:
+    """
+    Part name -> service names of ``model``, both in
+    declaration order. ``sources`` (service -> compose
+    file) is required to partition ``by="file"``.
+    """
+
+    if by not in PARTITIONS:
+        raise ValueError(f"Unknown partition: {by} (one of {', '.join(PARTITIONS)})")
+
+    parts: dict[str, list[str]] = {}
+
+    if by == "network":
+        for name, service in model.items():
+            for network in service.networks or (None,):
+                parts.setdefault("default" if network is None else network.name, []).append(name)
+
+    elif by == "file":
+        if sources is None:
+            raise ValueError("Partition by file needs the sources of the services")
+        for name in model:
+            parts.setdefault(sources.get(name, "-"), []).append(name)
+
+    else:
+        standalone = []
+        for component in DependencyGraph.from_model(model).connected_components():
+            # Dependencies that are not in the model are no services
+            component = [name for name in component if name in model]
+            if len(component) == 1 and not model[component[0]].depends_on:
+                standalone.append(component[0])
+            elif component:
+                # Prefixed: a service may be named like STANDALONE
+                parts[f"component-{component[0]}"] = component
+        if standalone:
+            order = {name: i for i, name in enumerate(model)}
+            parts[STANDALONE] = sorted(standalone, key=order.__getitem__)
+
+    return parts
+
+
+def _slug(name: str) -> str:
+    """``name`` as part of a file name"""
+    return re.sub(r"[^A-Za-z0-9._-]+", "_", name).strip("._-") or "_"
+
+
+def make_parts(
+        parts: dict[str, list[str]],
+        service_hashes: dict[str, str],
+        model: dict[str, Service],
+        outfile: pathlib.Path,
+        formats: Union[list[str], tuple[str, ...]],
+        label: str = "",
+        declared: Union[set[str], None] = None,
+) -> list[Part]:
+    """
+    One :class:`Part` per entry of ``parts`` (see
+    :func:`partition_model`), written next to ``outfile``
+    (``graph.svg`` -> ``graph.<part>.svg``). ``declared``
+    are the names of all services of the project (those
+    of ``model`` by default); dependencies on anything
+    else are drawn as missing.
+    """
+
+    if declared is None:
+        declared = set(model)
+
+    ret = []
+    slugs: set[str] = set()
+
+    for name, services in parts.items():
+
+        slug = _slug(name)
+        if slug in slugs:
+            # a/b and a_b
+            slug = next(f"{slug}-{i}" for i in range(2, len(slugs) + 2) if f"{slug}-{i}" not in slugs)
+        slugs.add(slug)
+
+        ret.append(
+            Part(
+                name=name,
+                outputs=output_paths(outfile.with_name(f"{outfile.stem}.{slug}{outfile.suffix}"), formats),
+                model={service: model[service] for service in services},
+                service_hashes={service: service_hashes[service] for service in services},
+                label=f"{label} ({name})" if label else name,
+                declared={
+                    dependency.service
+                    for service in services
+                    for dependency in model[service].depends_on
+                    if dependency.service in declared
+                },
+            )
+        )
+
+    return ret
+
+
+def _render_part(
+        part: Part,
+        args: argparse.Namespace,
+) -> PartResult:
+    """Runs in a worker process"""
+
+    # Circular import (the CLI imports this module)
+    from docker_compose_graph.docker_compose_graph import DockerComposeGraph, write_changed
+    from docker_compose_graph.cache import default_cache_dir
+    from docker_compose_graph.templates import TEMPLATES
+
+    start = time.perf_counter()
+
+    if args.cache:
+        # Once per worker (a no-op afterwards)
+        TEMPLATES.precompile((args.cache_dir or default_cache_dir()) / "templates")
+
+    try:
+        dcg = DockerComposeGraph(
+            expandvars=args.expandvars,
+            resolve_relative_volumes=args.resolve_relative_volumes,
+        )
+        # The model of the part, built by the parent process
+        dcg.docker_yaml = args.docker_compose_yaml
+        dcg.graph.set_label(part.label)
+        dcg.model = part.model
+        dcg.declared_services = part.declared | set(part.model)
+        dcg.service_hashes = part.service_hashes
+
+        written = write_changed(dcg, args, part.outputs, "part", part.name)
+    except Exception as e:
+        _logger.debug("%s", traceback.format_exc())
+        return PartResult(
+            name=part.name,
+            services=len(part.model),
+            outputs=part.outputs,
+            ok=False,
+            seconds=time.perf_counter() - start,
+            error=f"{type(e).__name__}: {e}",
+        )
+
+    return PartResult(
+        name=part.name,
+        services=len(part.model),
+        outputs=part.outputs,
+        ok=True,
+        seconds=time.perf_counter() - start,
+        skipped=tuple(format_ for format_ in part.outputs if format_ not in written),
+    )
+
+
+def render_parts(
+        parts: list[Part],
+        args: argparse.Namespace,
+        workers: Union[int, None] = None,
+) -> list[PartResult]:
+    """
+    Render all ``parts`` on ``workers`` processes (one per
+    CPU by default), biggest parts first so that the pool
+    is not left waiting for a big one at the end. Results
+    are returned in the order of ``parts``.
+    """
+
+    order = sorted(range(len(parts)), key=lambda i: len(parts[i].model), reverse=True)
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {i: executor.submit(_render_part, parts[i], args) for i in order}
+
+        results = []
+        for i, part in enumerate(parts):
+            try:
+                results.append(futures[i].result())
+            except Exception as e:
+                # The worker itself died (BrokenProcessPool, ...)
+                results.append(
+                    PartResult(
+                        name=part.name,
+                        services=len(part.model),
+                        outputs=part.outputs,
+                        ok=False,
+                        seconds=0.0,
+                        error=f"{type(e).__name__}: {e}",
+                    )
+                )
+
+    return results
+
+
+def write_index(
+        path: pathlib.Path,
+        results: list[PartResult],
+        title: str,
+) -> None:
+    """
+    Index of the outputs of all parts: HTML if ``path``
+    ends with ``.html`` (or ``.htm``), Markdown otherwise.
+    Links are relative to ``path``.
+    """
+
+    def href(output: pathlib.Path) -> str:
+        return urllib.parse.quote(pathlib.Path(os.path.relpath(output, path.parent)).as_posix())
+
+    as_html = path.suffix.lower() in (".html", ".htm")
+
+    lines = []
+
+    if as_html:
+        lines += [
+            "<!DOCTYPE html>",
+            '<html><head><meta charset="utf-8">',
+            f"<title>{html.escape(title)}</title>",
+            "</head><body>",
+            f"<h1>{html.escape(title)}</h1>",
+            "<table>",
+            "<tr><th>Part</th><th>Services</th><th>Outputs</th></tr>",
+        ]
+        for result in results:
+            if result.ok:
+                outputs = " ".join(
+                    f'<a href="{href(output)}">{html.escape(format_)}</a>'
+                    for format_, output in result.outputs.items()
+                )
+            else:
+                outputs = f"FAILED: {html.escape(result.error or '')}"
+            lines.append(
+                f"<tr><td>{html.escape(result.name)}</td><td>{result.services}</td><td>{outputs}</td></tr>"
+            )
+        lines += ["</table>", "</body></html>"]
+
+    else:
+        lines += [
+            f"# {title}",
+            "",
+            "| Part | Services | Outputs |",
+            "|---|---:|---|",
+        ]
+        for result in results:
+            if result.ok:
+                outputs = " ".join(f"[{format_}]({href(output)})" for format_, output in result.outputs.items())
+            else:
+                outputs = f"FAILED: {result.error}".replace("|", "\\|")
+            name = result.name.replace("|", "\\|")
+            lines.append(f"| {name} | {result.services} | {outputs} |")
+
+    path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+
+
+def format_parts_summary(results: list[PartResult]) -> str:
+
+    lines = []
+    for result in results:
+        status = "ok" if result.ok else "FAILED"
+        if result.ok and result.skipped and len(result.skipped) == len(result.outputs):
+            status = "skipped"
+        line = f"{status:<7} {result.seconds:>8.2f}s  {result.services:>5} services  {result.name}"
+        if result.error is not None:
+            line += f"\n{'':<18}{result.error}"
+        lines.append(line)
+
+    failed = len([r for r in results if not r.ok])
+    lines.append(f"{len(results) - failed} parts succeeded, {failed} failed")
+
+    return "\n".join(lines)
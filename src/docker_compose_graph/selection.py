@@ -0,0 +1,102 @@
+"""
+Select the services to draw.
+
+On big stacks usually only one subsystem is of interest.
+A :class:`Selection` prunes the merged model before labels
+are rendered and the graph is assembled, so the cost of a
+build follows the number of selected services rather than
+the size of the stack::
+
+    selection = Selection(services=("deadline-*",), closure="upstream")
+    dcg = DockerComposeGraph(selection=selection)
+
+Selection is applied in this order:
+
+1. ``profiles``: services without ``profiles`` are always
+   enabled, others only if one of their profiles is active
+   (``*`` enables all). No profiles selects all services.
+2. ``services``: glob patterns; no patterns select all
+   services enabled by 1.
+3. ``closure``: adds the services the selected ones depend on
+   (``upstream``), the ones depending on them (``downstream``)
+   or both, transitively. Like ``docker compose up``, this
+   pulls in dependencies regardless of their profiles.
+4. ``exclude``: glob patterns removed from the result.
+
+Dependencies on services that are not selected are still drawn,
+as "not shown" stubs.
+"""
+import dataclasses
+import fnmatch
+import logging
+from typing import Iterable, Union
+
+from docker_compose_graph.dependencies import DependencyGraph
+from docker_compose_graph.model import Service
+
+
+__all__ = [
+    "CLOSURES",
+    "Selection",
+]
+
+
+_logger = logging.getLogger(__name__)
+
+
+CLOSURES = ("upstream", "downstream", "both")
+
+
+@dataclasses.dataclass(slots=True, frozen=True)
+class Selection:
+
+    services: tuple[str, ...] = ()
+    exclude: tuple[str, ...] = ()
+    profiles: tuple[str, ...] = ()
+    closure: Union[str, None] = None
+
+    def __post_init__(self):
+        if self.closure is not None and self.closure not in CLOSURES:
+            raise ValueError(f"Unknown closure: {self.closure} (one of {', '.join(CLOSURES)})")
+
+    def __bool__(self) -> bool:
+        return bool(self.services or self.exclude or self.profiles)
+
+    def apply(self, model: dict[str, Service]) -> dict[str, Service]:
+        """The selected services of ``model`` in their order"""
+
+        if not self:
+            return model
+
+        enabled = [name for name, service in model.items() if self._enabled(service)]
+
+        if self.services:
+            selected = set(_match(enabled, self.services))
+            if not selected:
+                _logger.warning(f"No service matches {', '.join(self.services)}")
+        else:
+            selected = set(enabled)
+
+        if self.closure is not None:
+            graph = DependencyGraph.from_model(model)
+            start = set(selected)
+            if self.closure in ("upstream", "both"):
+                selected |= graph.upstream_closure(start)
+            if self.closure in ("downstream", "both"):
+                selected |= graph.downstream_closure(start)
+
+        if self.exclude:
+            selected -= set(_match(selected, self.exclude))
+
+        return {name: service for name, service in model.items() if name in selected}
+
+    def _enabled(self, service: Service) -> bool:
+        if not self.profiles or not service.profiles or "*" in self.profiles:
+            return True
+        return not set(service.profiles).isdisjoint(self.profiles)
+
+
+def _match(names: Iterable[str], patterns: tuple[str, ...]) -> Iterable[str]:
+    for name in names:
+        if any(fnmatch.fnmatchcase(name, pattern) for pattern in patterns):
+            yield name
@@ -0,0 +1,79 @@
+"""
+Lightweight phase timers and counters.
+
+    stats = Stats()
+
+    with stats.phase("graph_assembly"):
+        ...
+
+    stats.incr("services", 12)
+
+    print(stats.format_table())
+
+Timers accumulate, so a phase can be entered many
+times (e.g. once per service or once per file, from
+several threads) and reports the total.
+"""
+import contextlib
+import json
+import threading
+import time
+from typing import Iterator
+
+
+__all__ = [
+    "Stats",
+]
+
+
+class Stats:
+
+    def __init__(self):
+        self.timings: dict[str, float] = {}
+        self.counters: dict[str, int] = {}
+
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def add_time(self, name: str, seconds: float) -> None:
+        with self._lock:
+            self.timings[name] = self.timings.get(name, 0.0) + seconds
+
+    def incr(self, name: str, n: int = 1) -> None:
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            return {
+                "timings": dict(self.timings),
+                "counters": dict(self.counters),
+            }
+
+    def to_json(self) -> str:
+        return json.dumps(self.as_dict(), indent=2)
+
+    def format_table(self) -> str:
+        stats = self.as_dict()
+
+        width = max([len(k) for k in [*stats["timings"], *stats["counters"], "counter"]])
+
+        lines = [f"{'phase':<{width}}  {'seconds':>10}"]
+        lines.append("-" * len(lines[0]))
+        for name, seconds in stats["timings"].items():
+            lines.append(f"{name:<{width}}  {seconds:>10.3f}")
+
+        lines.append("")
+        lines.append(f"{'counter':<{width}}  {'value':>10}")
+        lines.append("-" * len(lines[-1]))
+        for name, value in stats["counters"].items():
+            lines.append(f"{name:<{width}}  {value:>10}")
+
+        return "\n".join(lines)
@@ -0,0 +1,197 @@
+"""
+Compile-once registry of the Jinja templates in ``resources/``.
+
+Templates are compiled on first use and kept for the lifetime
+of the process; :meth:`TemplateRegistry.get` is a dict lookup
+after that (no loader, no filesystem access)::
+
+    template = get_template("service_node_label.j2")
+
+Compiling the templates is the expensive part of loading them.
+:meth:`TemplateRegistry.precompile` stores them as Python
+modules (Jinja's ``compile_templates``) in a directory keyed by
+the hash of the template sources, so later processes import the
+compiled code instead of parsing the templates again and an
+edited template never loads stale code::
+
+    TEMPLATES.precompile(default_cache_dir() / "templates")
+"""
+import hashlib
+import logging
+import os
+import pathlib
+import re
+import shutil
+import tempfile
+import threading
+import time
+from typing import Union
+
+import jinja2
+from jinja2 import ChoiceLoader, Environment, FileSystemLoader, ModuleLoader, Template, TemplateError
+
+
+__all__ = [
+    "RESOURCES",
+    "TemplateRegistry",
+    "TEMPLATES",
+    "get_template",
+]
+
+
+_logger = logging.getLogger(__name__)
+
+
+RESOURCES = pathlib.Path(__file__).parent / "resources"
+
+# Directories of compiled templates are named by source hash
+_HASH_DIR = re.compile(r"[0-9a-f]{64}")
+
+# Compiled templates unused for this long are removed. Other
+# installs (venvs, checkouts) share the directory, each
+# with its own version of the templates.
+_MAX_UNUSED = 7 * 24 * 60 * 60  # seconds
+
+
+class TemplateRegistry:
+
+    def __init__(
+            self,
+            search_path: pathlib.Path = RESOURCES,
+            pattern: str = "*.j2",
+    ):
+        self.search_path = search_path
+        self.pattern = pattern
+
+        # Directory of the precompiled templates, if any
+        self.compiled_dir: Union[pathlib.Path, None] = None
+
+        self._environment: Union[Environment, None] = None
+        self._templates: dict[str, Template] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def environment(self) -> Environment:
+        if self._environment is None:
+            self._environment = self._make_environment()
+        return self._environment
+
+    def _make_environment(self) -> Environment:
+
+        loader = FileSystemLoader(self.search_path)
+        if self.compiled_dir is not None:
+            loader = ChoiceLoader([ModuleLoader(self.compiled_dir), loader])
+
+        return Environment(
+            loader=loader,
+            # Compiled templates are kept in self._templates
+            auto_reload=False,
+        )
+
+    def get(self, name: str) -> Template:
+        """The compiled template ``name``"""
+
+        try:
+            return self._templates[name]
+        except KeyError:
+            pass
+
+        with self._lock:
+            if name not in self._templates:
+                self._templates[name] = self.environment.get_template(name)
+            return self._templates[name]
+
+    def source_hash(self) -> str:
+        """
+        SHA-256 over the names and sources of all templates
+        and the Jinja version compiling them
+        """
+
+        digest = hashlib.sha256(jinja2.__version__.encode())
+        digest.update(b"\0")
+        for path in sorted(self.search_path.glob(self.pattern)):
+            digest.update(path.name.encode())
+            digest.update(b"\0")
+            digest.update(path.read_bytes())
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    def precompile(self, directory: pathlib.Path) -> Union[pathlib.Path, None]:
+        """
+        Load templates compiled to Python modules from
+        ``directory``, compiling them first if the templates
+        changed (or were never compiled). Returns the directory
+        of the compiled modules (``None`` if compiling failed;
+        templates are then compiled in memory as usual).
+        Modules of versions of the templates that were not
+        used for a week are removed.
+        """
+
+        target = directory / self.source_hash()
+
+        if target == self.compiled_dir:
+            return target
+
+        if target.is_dir():
+            try:
+                # LRU: mark as recently used
+                os.utime(target)
+            except OSError:
+                pass
+        else:
+            try:
+                directory.mkdir(parents=True, exist_ok=True)
+                tmp = pathlib.Path(tempfile.mkdtemp(prefix=".tmp-", dir=directory))
+                try:
+                    self.environment.compile_templates(
+                        target=tmp,
+                        zip=None,
+                        filter_func=lambda name: pathlib.PurePath(name).match(self.pattern),
+                        ignore_errors=False,
+                    )
+                    # Atomic: loaders never see half of the modules
+                    tmp.rename(target)
+                except OSError:
+                    if not target.is_dir():
+                        raise
+                    # Compiled concurrently by another process
+                finally:
+                    shutil.rmtree(tmp, ignore_errors=True)
+            except (OSError, TemplateError) as e:
+                _logger.warning(f"Could not precompile templates to {directory}: {e}")
+                return None
+            _logger.debug("Compiled templates to %s", target)
+
+            self._prune(directory, keep=target)
+
+        with self._lock:
+            self.compiled_dir = target
+            self._environment = None
+            self._templates.clear()
+
+        return target
+
+    @staticmethod
+    def _prune(directory: pathlib.Path, keep: pathlib.Path) -> None:
+        """Remove the modules of versions of the templates not used for a while"""
+
+        expired = time.time() - _MAX_UNUSED
+
+        for path in directory.iterdir():
+            if path == keep or not _HASH_DIR.fullmatch(path.name):
+                continue
+            try:
+                if not path.is_dir() or path.stat().st_mtime > expired:
+                    continue
+            except OSError:
+                continue
+            shutil.rmtree(path, ignore_errors=True)
+            _logger.debug("Removed unused templates %s", path)
+
+
+# Shared by all builds of the process
+TEMPLATES = TemplateRegistry()
+
+
+def get_template(name: str) -> Template:
+    return TEMPLATES.get(name)
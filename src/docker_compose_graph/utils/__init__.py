@@ -1,38 +1,93 @@
 __all__ = [
     "deep_merge",
+    "merge_into",
     "deep_sorted",
+    "canonical_dumps",
+    "content_hash",
 ]
 
-import copy
+import hashlib
+import json
 
 from docker_compose_graph.yaml_tags.overrides import *
 
 
-def deep_merge(dict1, dict2):
-    """https://sqlpey.com/python/solved-top-5-methods-to-deep-merge-dictionaries-in-python/"""
-    for key in dict2:
-        if key in dict1 and isinstance(dict1[key], dict) and isinstance(dict2[key], dict):
-            deep_merge(dict1[key], dict2[key])
+def _copy(value):
+    """
+    Structural copy of the containers YAML produces
+    (dicts, lists, :class:`OverrideArray`). Scalars
+    are immutable and shared.
+    """
+    if isinstance(value, dict):
+        return {k: _copy(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_copy(v) for v in value]
+    if isinstance(value, OverrideArray):
+        return OverrideArray(array=_copy(value.array))
+    return value
+
+
+def _extend_unique(target: list, items: list) -> None:
+    """
+    Append the ``items`` that are not in ``target`` yet,
+    keeping the order. Membership is checked with a hash
+    index; unhashable items (dicts, lists) fall back to
+    a linear scan over the unhashable items only.
+    """
+
+    index = set()
+    unhashable = []
+    for existing in target:
+        try:
+            index.add(existing)
+        except TypeError:
+            unhashable.append(existing)
+
+    for item in items:
+        try:
+            if item in index:
+                continue
+            index.add(item)
+        except TypeError:
+            if item in unhashable:
+                continue
+            unhashable.append(item)
+        target.append(_copy(item))
+
+
+def merge_into(dict1: dict, dict2: dict) -> dict:
+    """
+    Merge ``dict2`` into ``dict1`` in place and return ``dict1``.
+
+    - dicts are merged recursively
+    - lists are extended by the items not in the list yet
+    - :class:`OverrideArray` and everything else replaces
+
+    Values taken from ``dict2`` are copied, so ``dict2`` is never
+    referenced (let alone modified) by ``dict1`` afterwards.
+    """
+    for key, value in dict2.items():
+        existing = dict1.get(key, None)
+        if isinstance(existing, dict) and isinstance(value, dict):
+            merge_into(existing, value)
+        elif isinstance(existing, list) and isinstance(value, list):
+            # Existing list shall
+            # be extended
+            _extend_unique(existing, value)
         else:
-            if isinstance(dict2[key], list):
-                if key in dict1:
-                    # Existing list shall
-                    # be extended
-                    for item in dict2[key]:
-                        # Avoid duplicates and keep order
-                        if item not in dict1[key]:
-                            dict1[key].append(item)
-                else:
-                    dict1[key] = dict2[key]
-            elif isinstance(dict2[key], OverrideArray):
-                # Override shall always REPLACE
-                dict1[key] = dict2[key]
-            # elif isinstance(dict2[key], ResetNull):
-            #     # Override shall always REPLACE
-            #     dict1[key] = dict2[key]
-            else:
-                dict1[key] = dict2[key]
-    return copy.deepcopy(dict1)
+            # OverrideArray shall always REPLACE
+            dict1[key] = _copy(value)
+    return dict1
+
+
+def deep_merge(dict1, dict2):
+    """
+    Return a new dict: ``dict1`` deep merged with ``dict2``
+    (see :func:`merge_into`). Neither argument is modified.
+
+    https://sqlpey.com/python/solved-top-5-methods-to-deep-merge-dictionaries-in-python/
+    """
+    return merge_into(_copy(dict1), dict2)
 
 
 def deep_sorted(d):
@@ -55,3 +110,56 @@ def deep_sorted(d):
     if isinstance(d, dict):
         return { k: deep_sorted(d[k]) for k in sorted(d)}
     return d
+
+
+def _canonical_default(value):
+    # dates and other scalars YAML may produce
+    return repr(value)
+
+
+def _canonical_key(key) -> str:
+    if isinstance(key, str):
+        # "!" starts the tags of the other types
+        return f"!str:{key}" if key.startswith("!") else key
+    return f"!{type(key).__name__}:{key!r}"
+
+
+def _canonical(value):
+    """
+    Mapping keys as strings tagged with their type: YAML 1.1
+    loads keys like ``ON``, ``no`` or ``8080`` as bool and
+    int, which can't be sorted together with strings (and
+    would collide with ``"True"`` and ``"8080"`` in JSON).
+    """
+    if isinstance(value, dict):
+        return {_canonical_key(k): _canonical(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_canonical(v) for v in value]
+    if isinstance(value, OverrideArray):
+        return {"!override": _canonical(value.array)}
+    return value
+
+
+def canonical_dumps(value) -> str:
+    """
+    Canonical JSON of a (merged) compose structure: mapping
+    keys sorted, no whitespace. Unlike :func:`deep_sorted`,
+    lists keep their order, it is significant for commands,
+    ports, ... and shows in the rendered graph.
+    """
+    return json.dumps(
+        _canonical(value),
+        sort_keys=True,
+        separators=(",", ":"),
+        ensure_ascii=False,
+        default=_canonical_default,
+    )
+
+
+def content_hash(*values) -> str:
+    """SHA-256 of the canonical serialization of ``values``"""
+    digest = hashlib.sha256()
+    for value in values:
+        digest.update(canonical_dumps(value).encode())
+        digest.update(b"\0")
+    return digest.hexdigest()
@@ -0,0 +1,128 @@
+"""
+Watch mode: rebuild whenever one of the watched files changes.
+
+Files are polled with ``stat()`` (mtime and size), which works
+the same on every platform and on network file systems where
+inotify does not see remote changes. A burst of changes (an
+editor writing several files, a ``git checkout``) is debounced
+into a single rebuild.
+"""
+import logging
+import pathlib
+import time
+from typing import Callable, Iterable, Union
+
+
+__all__ = [
+    "Watcher",
+]
+
+
+_logger = logging.getLogger(__name__)
+
+
+Signature = Union[tuple[int, int], None]
+
+
+class Watcher:
+    """
+    ``build(changed)`` is called once initially (with an
+    empty set) and then with the set of changed files after
+    every change. It returns the files to watch from then on,
+    so newly included files are picked up. ``files`` are
+    watched until a build succeeds.
+    """
+
+    def __init__(
+            self,
+            build: Callable[[set[pathlib.Path]], Iterable[pathlib.Path]],
+            interval: float = 0.5,
+            debounce: float = 0.3,
+            files: Iterable[pathlib.Path] = (),
+    ):
+        self.build = build
+        self.interval = interval
+        self.debounce = debounce
+
+        self.files: list[pathlib.Path] = []
+        self._snapshot: dict[pathlib.Path, Signature] = {}
+
+        self.watch(files)
+
+    @staticmethod
+    def signature(path: pathlib.Path) -> Signature:
+        try:
+            stat = path.stat()
+        except OSError:
+            # Deleted (or temporarily missing while
+            # an editor replaces the file)
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def snapshot(self) -> dict[pathlib.Path, Signature]:
+        return {path: self.signature(path) for path in self.files}
+
+    def watch(self, files: Iterable[pathlib.Path]) -> None:
+        self.files = list(dict.fromkeys(files))
+        self._snapshot = self.snapshot()
+
+    def changes(self) -> set[pathlib.Path]:
+        """
+        Poll once. If anything changed, wait until the
+        files are quiet for ``debounce`` seconds and
+        return all files that changed in the meantime.
+        """
+
+        current = self.snapshot()
+        if current == self._snapshot:
+            return set()
+
+        while True:
+            time.sleep(self.debounce)
+            settled = self.snapshot()
+            if settled == current:
+                break
+            current = settled
+
+        changed = {
+            path for path in self.files
+            if current[path] != self._snapshot.get(path)
+        }
+
+        self._snapshot = current
+
+        return changed
+
+    def rebuild(self, changed: set[pathlib.Path]) -> bool:
+        """Build; ``False`` if the build failed"""
+
+        try:
+            files = self.build(changed)
+        except Exception:
+            # Most likely a half-edited file. Keep
+            # watching the same files and try again
+            # on the next change.
+            _logger.exception("Build failed")
+            return False
+
+        self.watch(files)
+
+        return True
+
+    def run(self) -> None:
+        """Build, then rebuild on every change until interrupted"""
+
+        self.rebuild(set())
+
+        while True:
+            time.sleep(self.interval)
+
+            changed = self.changes()
+            if not changed:
+                continue
+
+            _logger.info(
+                "Changed: %s", ", ".join(sorted(p.as_posix() for p in changed))
+            )
+
+            self.rebuild(changed)
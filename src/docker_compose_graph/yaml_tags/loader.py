@@ -0,0 +1,91 @@
+"""
+YAML loading for Docker Compose files.
+
+Compose files only need the safe subset of YAML plus our custom
+tags (``!override``, ...), so we load them with a ``SafeLoader``
+instead of ``pyyaml.full_load``. If PyYAML was built against
+libyaml, the C implementation (``CSafeLoader``) is used, which
+is several times faster than the pure Python loader.
+
+- https://pyyaml.org/wiki/PyYAMLDocumentation (LibYAML bindings)
+"""
+from typing import IO, Union
+
+import yaml
+from yaml import YAMLObject
+
+from docker_compose_graph.yaml_tags import overrides
+
+
+__all__ = [
+    "LIBYAML",
+    "LOADER_VERSION",
+    "ComposeLoader",
+    "PureComposeLoader",
+    "register_tag",
+    "load_yaml",
+]
+
+
+try:
+    from yaml import CSafeLoader as _SafeLoader
+    LIBYAML = True
+except ImportError:  # pragma: no cover
+    # PyYAML was built without libyaml
+    from yaml import SafeLoader as _SafeLoader
+    LIBYAML = False
+
+
+class ComposeLoader(_SafeLoader):
+    """
+    Safe loader for Compose files. Backed by
+    libyaml if available, pure Python otherwise.
+    """
+
+
+class PureComposeLoader(yaml.SafeLoader):
+    """
+    Pure Python safe loader for Compose files.
+    Always available; mostly useful as a fallback
+    and as a baseline for benchmarks.
+    """
+
+
+# Bump this whenever the loaders produce different
+# Python objects for the same YAML source (new tags,
+# changed constructors, ...).
+_LOADER_REVISION = "1"
+
+LOADER_VERSION = "-".join([
+    _LOADER_REVISION,
+    yaml.__version__,
+    "libyaml" if LIBYAML else "python",
+])
+
+
+def register_tag(cls: type[YAMLObject]) -> type[YAMLObject]:
+    """
+    Register a custom YAML tag class on all
+    Compose loaders. Can be used as a class decorator.
+    """
+    for loader in (ComposeLoader, PureComposeLoader):
+        loader.add_constructor(cls.yaml_tag, cls.from_yaml)
+    return cls
+
+
+# All tags declared in yaml_tags/overrides.py
+for _name in overrides.__all__:
+    _obj = getattr(overrides, _name)
+    if isinstance(_obj, type) and issubclass(_obj, YAMLObject):
+        register_tag(_obj)
+
+
+def load_yaml(
+        stream: Union[str, bytes, IO],
+        loader: type = ComposeLoader,
+):
+    """
+    Load a single YAML document using one of the
+    Compose loaders (libyaml backed by default).
+    """
+    return yaml.load(stream, Loader=loader)
@@ -6,5 +6,29 @@
     - https://docs.pytest.org/en/stable/fixture.html
     - https://docs.pytest.org/en/stable/writing_plugins.html
 """
+import os
 
-# import pytest
+import pytest
+
+from docker_compose_graph.cache import LabelCache
+
+
+@pytest.fixture(autouse=True)
+def label_cache(monkeypatch):
+    """A label cache of its own for every test (instead of the process-wide one)"""
+    cache = LabelCache()
+    monkeypatch.setattr("docker_compose_graph.docker_compose_graph.LABEL_CACHE", cache)
+    return cache
+
+
+@pytest.fixture(autouse=True)
+def environ(monkeypatch):
+    """
+    The environment of every test, restored afterwards
+    (including the variables .env files load into it).
+    Tests set variables with ``monkeypatch.setenv()``.
+    """
+    saved = dict(os.environ)
+    yield os.environ
+    os.environ.clear()
+    os.environ.update(saved)
@@ -1,8 +1,28 @@
+import io
+import json
+import os
 import pathlib
+import pickle
+import sys
+import time
 
-from docker_compose_graph.docker_compose_graph import main, DockerComposeGraph
+import pytest
+
+from docker_compose_graph.docker_compose_graph import main, parse_args, render, watch, DockerComposeGraph
+from docker_compose_graph.batch import *
+from docker_compose_graph.includes import *
+from docker_compose_graph.cache import *
+from docker_compose_graph.watch import *
+from docker_compose_graph.interpolation import *
+from docker_compose_graph.dependencies import *
+from docker_compose_graph.layout import *
+from docker_compose_graph.model import *
+from docker_compose_graph.partition import *
+from docker_compose_graph.selection import *
+from docker_compose_graph.templates import *
 from docker_compose_graph.utils import *
 from docker_compose_graph.yaml_tags.overrides import *
+from docker_compose_graph.yaml_tags.loader import *
 
 __author__ = "Michael Mussato"
 __copyright__ = "Michael Mussato"
@@ -267,6 +287,41 @@ def test_deep_merge_3():
     assert result == expected
 
 
+def test_deep_merge_copy_free():
+    d1 = {
+        "ports": [{"target": 80}, "443:443", "443:443"],
+        "volumes": OverrideArray(array=["./a:/a"]),
+        "nested": {"key1": ["value1"]},
+    }
+
+    d2 = {
+        "ports": [{"target": 80}, {"target": 81}, "443:443", "8080:80", "8080:80"],
+        "volumes": OverrideArray(array=["./b:/b"]),
+        "nested": {"key1": ["value2"], "key2": {"key3": "value3"}},
+    }
+
+    expected = {
+        # duplicates already in d1 are kept
+        "ports": [{"target": 80}, "443:443", "443:443", {"target": 81}, "8080:80"],
+        "volumes": OverrideArray(array=["./b:/b"]),
+        "nested": {"key1": ["value1", "value2"], "key2": {"key3": "value3"}},
+    }
+
+    result = deep_merge(dict1=d1, dict2=d2)
+
+    assert repr(result) == repr(expected)
+
+    # neither input is modified nor shared
+    assert d1["ports"] == [{"target": 80}, "443:443", "443:443"]
+    assert d1["nested"] == {"key1": ["value1"]}
+    assert result["volumes"] is not d2["volumes"]
+    assert result["nested"]["key2"] is not d2["nested"]["key2"]
+
+    merged = merge_into(dict(), d2)
+    merged["ports"].append("9090:90")
+    assert "9090:90" not in d2["ports"]
+
+
 # def test_deep_merge_4():
 #     d1 = {
 #         'service_name': 'server',
@@ -373,6 +428,1261 @@ def test_deep_merge_3():
 #     assert result == expected
 
 
+def test_merge_services():
+    dcg = DockerComposeGraph()
+
+    services = [
+        {"service_name": "a", "service_config": {"image": "a:1", "ports": ["80:80"]}},
+        {"service_name": "b", "service_config": {"image": "b"}},
+        {"service_name": "a", "service_config": {"image": "a:2", "ports": ["80:80", "443:443"]}},
+        {"service_name": "c", "service_config": {"image": "c"}},
+        {"service_name": "a", "service_config": {"ports": OverrideArray(array=["8080:80"])}},
+        {"service_name": "b", "service_config": {"networks": ["backend"]}},
+    ]
+
+    merged = dcg.merge_services(services)
+
+    assert repr(merged) == repr([
+        {"service_name": "a", "service_config": {"image": "a:2", "ports": OverrideArray(array=["8080:80"])}},
+        {"service_name": "b", "service_config": {"image": "b", "networks": ["backend"]}},
+        {"service_name": "c", "service_config": {"image": "c"}},
+    ])
+
+    # inputs are left untouched
+    assert services[0]["service_config"]["ports"] == ["80:80"]
+
+
+def test_load_yaml_override_tag():
+    source = """
+services:
+  server:
+    image: ynput/ayon:latest
+    ports: !override
+      - ${AYON_PORT_HOST}:${AYON_PORT_CONTAINER}
+"""
+
+    for loader in (ComposeLoader, PureComposeLoader):
+        tree = load_yaml(source, loader=loader)
+
+        ports = tree["services"]["server"]["ports"]
+
+        assert isinstance(ports, OverrideArray)
+        assert ports.array == ['${AYON_PORT_HOST}:${AYON_PORT_CONTAINER}']
+
+
+def test_parse_docker_compose_include_graph(tmp_path):
+    (tmp_path / "sites").mkdir()
+    (tmp_path / "docker-compose.base.yaml").write_text(
+        "services:\n  base:\n    image: base\n"
+    )
+    (tmp_path / "sites" / "docker-compose.a.yaml").write_text(
+        "include:\n  - path:\n      - ../docker-compose.base.yaml\n"
+        "services:\n  a:\n    image: a\n"
+    )
+    (tmp_path / "docker-compose.yaml").write_text(
+        "include:\n  - path:\n      - ./sites/docker-compose.a.yaml\n"
+        "      - ./docker-compose.base.yaml\n"
+        "services:\n  root:\n    image: root\n"
+    )
+
+    root = (tmp_path / "docker-compose.yaml").resolve()
+    a = (tmp_path / "sites" / "docker-compose.a.yaml").resolve()
+    base = (tmp_path / "docker-compose.base.yaml").resolve()
+
+    # the result does not depend on concurrent loading
+    for include_workers in (1, 4):
+        dcg = DockerComposeGraph(include_workers=include_workers)
+        trees = dcg.parse_docker_compose(tmp_path / "docker-compose.yaml")
+
+        # base is reached twice, parsed once and applied twice
+        assert [list(t["services"]) for t in trees] == [["root"], ["a"], ["base"], ["base"]]
+        assert dcg.stats.counters["files_parsed"] == 3
+        assert dcg.include_graph.order == [root, a, base]
+        assert dcg.include_graph.edges == {
+            root: [a, base],
+            a: [base],
+            base: [],
+        }
+
+
+def test_parse_docker_compose_include_precedence(tmp_path):
+    # diamond: base is included by the root and again by a later overlay
+    (tmp_path / "base.yaml").write_text(
+        "services:\n  web:\n    image: web:base\n"
+    )
+    (tmp_path / "overlay.yaml").write_text(
+        "services:\n  web:\n    image: web:overlay\n"
+    )
+    (tmp_path / "late.yaml").write_text(
+        "include:\n  - base.yaml\n"
+        "services:\n  late:\n    image: late\n"
+    )
+    (tmp_path / "docker-compose.yaml").write_text(
+        "include:\n  - base.yaml\n  - overlay.yaml\n  - late.yaml\n"
+    )
+
+    dcg = DockerComposeGraph()
+    dcg.build_model(dcg.iter_docker_compose(tmp_path / "docker-compose.yaml"))
+
+    # base, applied again after the overlay, wins
+    assert dcg.model["web"].image == "web:base"
+    assert dcg.stats.counters["files_parsed"] == 4
+
+
+def test_parse_docker_compose_include_cycle(tmp_path):
+    (tmp_path / "docker-compose.yaml").write_text(
+        "include:\n  - path:\n      - ./docker-compose.a.yaml\n"
+    )
+    (tmp_path / "docker-compose.a.yaml").write_text(
+        "include:\n  - path:\n      - ./docker-compose.yaml\n"
+    )
+
+    dcg = DockerComposeGraph()
+
+    with pytest.raises(IncludeCycleError) as exc_info:
+        dcg.parse_docker_compose(tmp_path / "docker-compose.yaml")
+
+    assert exc_info.value.cycle == [
+        (tmp_path / "docker-compose.yaml").resolve(),
+        (tmp_path / "docker-compose.a.yaml").resolve(),
+        (tmp_path / "docker-compose.yaml").resolve(),
+    ]
+
+
+def _write_server(compose, ports="!override\n      - 5000:5000"):
+    compose.write_text(f"services:\n  server:\n    ports: {ports}\n")
+
+
+def test_parse_cache(tmp_path):
+    compose = tmp_path / "docker-compose.yaml"
+    _write_server(compose)
+
+    cache = ParseCache(cache_dir=tmp_path / "cache")
+
+    cold = DockerComposeGraph(cache=cache).parse_docker_compose(compose)
+    warm = DockerComposeGraph(cache=cache).parse_docker_compose(compose)
+
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert repr(warm) == repr(cold)
+    assert isinstance(warm[0]["services"]["server"]["ports"], OverrideArray)
+
+
+def test_parse_cache_changed_content(tmp_path):
+    compose = tmp_path / "docker-compose.yaml"
+    _write_server(compose)
+
+    cache = ParseCache(cache_dir=tmp_path / "cache")
+    DockerComposeGraph(cache=cache).parse_docker_compose(compose)
+
+    # changed content is a different key
+    compose.write_text("services:\n  server:\n    image: server\n")
+    changed = DockerComposeGraph(cache=cache).parse_docker_compose(compose)
+
+    assert (cache.hits, cache.misses) == (0, 2)
+    assert changed == [{"services": {"server": {"image": "server"}}}]
+
+
+def test_parse_cache_prune(tmp_path):
+    compose = tmp_path / "docker-compose.yaml"
+    cache = ParseCache(cache_dir=tmp_path / "cache")
+
+    for ports in ("[5000:5000]", "[5001:5000]", "[5002:5000]"):
+        _write_server(compose, ports=ports)
+        DockerComposeGraph(cache=cache).parse_docker_compose(compose)
+
+    # least recently used entries are evicted first
+    entries = {p.stem: p for p in (tmp_path / "cache").glob("*/*.json")}
+    newest = entries[ParseCache.key(compose.read_bytes())]
+    for entry in entries.values():
+        if entry != newest:
+            os.utime(entry, (0, 0))
+
+    cache.max_size = newest.stat().st_size
+    cache._dirty = True
+    cache.prune()
+
+    assert list((tmp_path / "cache").glob("*/*.json")) == [newest]
+
+
+def test_parse_cache_format(tmp_path):
+    cache = ParseCache(cache_dir=tmp_path / "cache")
+
+    tree = load_yaml(
+        "x-keys: {1: one, true: yes, null: none, '!tag': bang}\n"
+        "x-date: 2024-01-02\n"
+        "x-time: 2024-01-02 03:04:05+01:00\n"
+        "x-binary: !!binary aGVsbG8=\n"
+        "x-set: !!set {a: null}\n"
+        "x-inf: .inf\n"
+        "services:\n  server:\n    ports: !override\n      - 5000:5000\n"
+    )
+    cache.put("key", tree)
+    assert repr(cache.get("key")) == repr(tree)
+
+
+def test_parse_cache_no_pickles(tmp_path):
+    cache = ParseCache(cache_dir=tmp_path / "cache")
+    cache.put("key", {"services": {}})
+
+    # entries are data, nothing is unpickled
+    path = next((tmp_path / "cache").glob("*/*.json"))
+    path.write_bytes(pickle.dumps({"services": {}}))
+    assert cache.get("key", "miss") == "miss"
+    assert not path.exists()
+
+
+def test_parse_cache_empty_file(tmp_path):
+    cache = ParseCache(cache_dir=tmp_path / "cache")
+
+    # an empty file is a hit, too
+    empty = tmp_path / "empty.yaml"
+    empty.write_text("")
+    assert cache.load(empty) is None
+    assert cache.load(empty) is None
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def _write_streaming_project(tmp_path):
+    (tmp_path / "docker-compose.override.yaml").write_text(
+        "services:\n"
+        "  server:\n"
+        "    restart: always\n"
+        "    networks: [backend]\n"
+        "    ports: !override\n"
+        "      - 5001:5000\n"
+    )
+    compose = tmp_path / "docker-compose.yaml"
+    compose.write_text(
+        "include:\n  - path:\n      - ./docker-compose.override.yaml\n"
+        "services:\n"
+        "  server:\n"
+        "    image: server\n"
+        "    restart: unless-stopped\n"
+        "    networks: [frontend]\n"
+        "    ports:\n"
+        "      - 5000:5000\n"
+        "  redis:\n"
+        "    image: redis\n"
+        "    depends_on: [server]\n"
+    )
+    return compose
+
+
+def test_iterate_trees_streaming(tmp_path):
+    compose = _write_streaming_project(tmp_path)
+
+    batch = DockerComposeGraph(label_cache=LabelCache())
+    batch.iterate_trees(batch.parse_docker_compose(compose))
+
+    streaming = DockerComposeGraph(label_cache=LabelCache())
+    streaming.iterate_trees(streaming.iter_docker_compose(compose))
+
+    for dcg in (batch, streaming):
+        assert repr(dcg.services) == repr([
+            {
+                "service_name": "server",
+                "service_config": {
+                    "image": "server",
+                    "restart": "always",
+                    "networks": ["frontend", "backend"],
+                    "ports": OverrideArray(array=["5001:5000"]),
+                },
+            },
+            {
+                "service_name": "redis",
+                "service_config": {
+                    "image": "redis",
+                    "depends_on": ["server"],
+                },
+            },
+        ])
+        assert dcg.depends_on["services"] == {"redis": {"server": {"condition": None}}}
+        assert dcg.port_mappings["services"] == {"server": ["5001:5000"], "redis": []}
+
+    assert batch.graph.to_string() == streaming.graph.to_string()
+
+
+def test_iterate_trees_streaming_model(tmp_path):
+    dcg = DockerComposeGraph(label_cache=LabelCache())
+    dcg.iterate_trees(dcg.iter_docker_compose(_write_streaming_project(tmp_path)))
+
+    assert dcg.model["server"].networks == (
+        NetworkAttachment(name="backend"),
+        NetworkAttachment(name="frontend"),
+    )
+    assert dcg.model["server"].ports == (PortBinding(host="5001", container="5000"),)
+    assert dcg.model["redis"].depends_on == (Dependency(service="server"),)
+
+
+def test_iterate_trees_streaming_stats(tmp_path):
+    compose = _write_streaming_project(tmp_path)
+    label_cache = LabelCache()
+
+    first = DockerComposeGraph(label_cache=label_cache)
+    first.iterate_trees(first.iter_docker_compose(compose))
+    assert "labels_cached" not in first.stats.counters
+
+    dcg = DockerComposeGraph(label_cache=label_cache)
+    dcg.iterate_trees(dcg.iter_docker_compose(compose))
+
+    # networks of both files are drawn, labels
+    # of identical services are rendered once
+    assert dcg.stats.counters == {
+        "files_parsed": 2,
+        "services": 2,
+        "labels_cached": 2,
+        "nodes": 5,
+        "edges": 4,
+    }
+    assert {
+        "yaml_load",
+        "extract",
+        "merge_services",
+        "service_labels",
+        "graph_assembly",
+    } <= set(dcg.stats.timings)
+
+
+def test_extractors(tmp_path):
+    (tmp_path / "docker-compose.override.yaml").write_text(
+        "services:\n"
+        "  server:\n"
+        "    labels: [tier=backend]\n"
+        "    env_file: [server.env, {path: /etc/common.env, required: false}]\n"
+    )
+    compose = tmp_path / "docker-compose.yaml"
+    compose.write_text(
+        "include:\n  - path:\n      - ./docker-compose.override.yaml\n"
+        "services:\n"
+        "  server:\n"
+        "    image: server\n"
+        "    healthcheck: {test: [CMD, 'true']}\n"
+        "  redis:\n"
+        "    image: redis\n"
+    )
+
+    calls = []
+
+    def _image(service_name, service_config, path):
+        calls.append((service_name, path.name))
+        return service_config.get("image", None)
+
+    dcg = DockerComposeGraph(extractors={"image": _image}, label_cache=LabelCache())
+    dcg.iterate_trees(dcg.iter_docker_compose(compose))
+
+    # one visit per declaration
+    assert calls == [
+        ("server", "docker-compose.yaml"),
+        ("redis", "docker-compose.yaml"),
+        ("server", "docker-compose.override.yaml"),
+    ]
+
+    assert dcg.extracted["image"] == {"server": "server", "redis": "redis"}
+    assert dcg.extracted["healthcheck"] == {"server": {"test": ["CMD", "true"]}}
+    assert dcg.extracted["labels"] == {"server": {"tier": "backend"}}
+    assert dcg.extracted["env_file"] == {
+        "server": [tmp_path.resolve() / "server.env", pathlib.Path("/etc/common.env")],
+    }
+    assert dcg.extracted["ports"] is dcg.port_mappings["services"]
+
+
+def test_parse_ports():
+    assert PortBinding.parse("3000") == PortBinding(host=None, container="3000")
+    assert PortBinding.parse(8080) == PortBinding(host=None, container="8080")
+    assert PortBinding.parse("8000-9000:80") == PortBinding(host="8000-9000", container="80")
+    assert PortBinding.parse("127.0.0.1:5000-5010:5000-5010") == PortBinding(
+        host="5000-5010", container="5000-5010", host_ip="127.0.0.1")
+    assert PortBinding.parse("::1:6000:6000") == PortBinding(host="6000", container="6000", host_ip="::1")
+    assert PortBinding.parse("[::1]:6001:6001") == PortBinding(host="6001", container="6001", host_ip="::1")
+    assert PortBinding.parse("6060:6060/udp") == PortBinding(host="6060", container="6060", protocol="udp")
+    assert PortBinding.parse(
+        {"target": 80, "published": "8080", "host_ip": "127.0.0.1", "protocol": "udp"}
+    ) == PortBinding(host="8080", container="80", host_ip="127.0.0.1", protocol="udp")
+
+    # memoized
+    assert PortBinding.parse("6060:6060/udp") is PortBinding.parse("6060:6060/udp")
+
+
+def test_compress_ports():
+    assert compress_ports(
+        PortBinding.parse(p) for p in [
+            "10000:10000/udp", "10001:10001/udp", "10002-10009:10002-10009/udp",
+            "10010:10010",  # tcp
+            "80:80", "81:8081",
+            # not 1:1
+            "8000-9000:80", "9001:81", "9002-9003:82",
+        ]
+    ) == (
+        PortBinding(host="10000-10009", container="10000-10009", protocol="udp"),
+        PortBinding(host="10010", container="10010"),
+        PortBinding(host="80", container="80"),
+        PortBinding(host="81", container="8081"),
+        PortBinding(host="8000-9000", container="80"),
+        PortBinding(host="9001", container="81"),
+        PortBinding(host="9002-9003", container="82"),
+    )
+
+
+def test_compressed_ports_nodes():
+    dcg = DockerComposeGraph(label_cache=LabelCache())
+    dcg.iterate_trees([{
+        "services": {
+            "media": {"ports": [f"{p}:{p}/udp" for p in range(20000, 20100)] + ["53:53/tcp", "53:53/udp"]},
+        },
+    }])
+
+    assert [str(p) for p in dcg.model["media"].ports] == ["20000-20099:20000-20099/udp", "53:53", "53:53/udp"]
+    assert dcg.stats.counters["nodes"] == 1 + 3
+
+
+def test_parse_volumes():
+    assert VolumeMount.parse("/data") == VolumeMount(source=None, target="/data", type="volume")
+    assert VolumeMount.parse("dbdata:/var/lib/db") == VolumeMount(source="dbdata", target="/var/lib/db", type="volume")
+    assert VolumeMount.parse("./conf:/etc/conf:ro,z") == VolumeMount(source="./conf", target="/etc/conf", mode="ro,z")
+    assert VolumeMount.parse(
+        {"type": "bind", "source": "./conf", "target": "/etc/conf", "read_only": True, "bind": {"selinux": "Z"}}
+    ) == VolumeMount(source="./conf", target="/etc/conf", mode="ro,Z")
+    assert VolumeMount.parse({"type": "tmpfs", "target": "/tmp"}) == VolumeMount(source=None, target="/tmp", type="tmpfs")
+    assert VolumeMount.parse({"type": "volume", "source": "x"}) is None
+
+
+def test_resolve_relative_volumes(tmp_path, monkeypatch):
+    (tmp_path / "sub").mkdir()
+    (tmp_path / "sub" / "docker-compose.yaml").write_text(
+        "services:\n"
+        "  db:\n"
+        "    volumes:\n"
+        "      - ./data:/data\n"
+        "      - ../shared:/shared:ro\n"
+        "      - dbdata:/var/lib/db\n"
+        "      - {type: bind, source: ./conf, target: /etc/conf}\n"
+    )
+    compose = tmp_path / "docker-compose.yaml"
+    compose.write_text(
+        "include:\n  - path:\n      - ./sub/docker-compose.yaml\n"
+        "services:\n"
+        "  web:\n"
+        "    volumes:\n"
+        "      - ./shared:/shared\n"
+        "      - /abs:/abs\n"
+        "      - ./${LOGS}:/logs/$$HOME\n"
+        "      - ${CACHE}:/cache\n"
+    )
+
+    root = tmp_path.resolve()
+
+    monkeypatch.setenv("LOGS", "logs")
+    monkeypatch.setenv("CACHE", "cache")
+
+    dcg = DockerComposeGraph(resolve_relative_volumes=True, label_cache=LabelCache())
+    dcg.iterate_trees(dcg.iter_docker_compose(compose))
+
+    # relative to the file declaring them
+    assert dcg.model["db"].volumes == (
+        VolumeMount(source=(root / "sub" / "data").as_posix(), target="/data"),
+        VolumeMount(source=(root / "shared").as_posix(), target="/shared", mode="ro"),
+        VolumeMount(source="dbdata", target="/var/lib/db", type="volume"),
+        VolumeMount(source=(root / "sub" / "conf").as_posix(), target="/etc/conf"),
+    )
+    assert dcg.model["web"].volumes == (
+        VolumeMount(source=(root / "shared").as_posix(), target="/shared"),
+        VolumeMount(source="/abs", target="/abs"),
+        # interpolated once, after resolving
+        VolumeMount(source=(root / "logs").as_posix(), target="/logs/$HOME"),
+        # a named volume once interpolated
+        VolumeMount(source="cache", target="/cache", type="volume"),
+    )
+    # the extractors see the resolved paths
+    assert dcg.volume_mappings["services"]["db"][0] == f"{(root / 'sub' / 'data').as_posix()}:/data"
+
+    # ../shared and ./shared are the same path
+    assert dcg.stats.counters["path_cache_hits"] == 2
+    assert dcg.stats.counters["path_cache_misses"] == 6
+
+
+@pytest.fixture
+def selected(tmp_path):
+    (tmp_path / "docker-compose.yaml").write_text(
+        "services:\n"
+        "  db:\n"
+        "    image: postgres\n"
+        "  api:\n"
+        "    image: api\n"
+        "    depends_on: [db]\n"
+        "  web:\n"
+        "    image: web\n"
+        "    depends_on: [api]\n"
+        "  debug:\n"
+        "    image: debug\n"
+        "    profiles: [debug]\n"
+        "    depends_on: [api]\n"
+    )
+
+    def _selected(**kwargs):
+        dcg = DockerComposeGraph(selection=Selection(**kwargs), label_cache=LabelCache())
+        dcg.iterate_trees(dcg.iter_docker_compose(tmp_path / "docker-compose.yaml"))
+        return dcg
+
+    return _selected
+
+
+def test_selection(selected):
+    assert list(selected().model) == ["db", "api", "web", "debug"]
+    assert list(selected(profiles=("other",)).model) == ["db", "api", "web"]
+    assert list(selected(profiles=("debug",)).model) == ["db", "api", "web", "debug"]
+    assert list(selected(services=("a*",)).model) == ["api"]
+
+
+def test_selection_closure(selected):
+    assert list(selected(services=("web",), closure="upstream").model) == ["db", "api", "web"]
+    assert list(selected(services=("api",), closure="downstream").model) == ["api", "web", "debug"]
+    assert list(selected(services=("api",), closure="both", exclude=("d*",)).model) == ["api", "web"]
+
+    with pytest.raises(ValueError):
+        Selection(closure="sideways")
+
+
+def test_selection_stubs(selected):
+    # Dependencies that are not selected are drawn as stubs
+    dcg = selected(services=("api",))
+    assert dcg.stats.counters["services_selected"] == 1
+    assert list(dcg.service_hashes) == ["api"]
+    assert dcg.stats.counters["edges"] == 1
+    assert dcg.stats.counters["nodes"] == 2
+    assert "not shown" in dcg.get_primary_graph().to_string()
+
+
+def test_selection_args():
+    args = parse_args(["-y", "docker-compose.yaml", "-o", "out.svg", "-f", "svg", "-s", "web", "--with-dependencies"])
+    assert args.services == ["web"]
+    assert args.closure == "upstream"
+
+
+def test_dependency_graph():
+    graph = DependencyGraph(
+        edges={
+            "web": ["api"],
+            "api": ["db", "cache"],
+            "db": [],
+            "worker": ["db", "worker"],
+            "a": ["b"],
+            "b": ["a"],
+        }
+    )
+
+    assert graph.missing == ("cache",)
+    assert graph.dependencies("api") == ("db", "cache")
+    assert graph.dependents("db") == ("api", "worker")
+    assert graph.upstream_closure(["web"]) == {"web", "api", "db", "cache"}
+    assert graph.downstream_closure(["db"]) == {"db", "api", "web", "worker"}
+    assert graph.levels() == [["db", "a", "b", "cache"], ["api", "worker"], ["web"]]
+    assert sorted(sorted(cycle) for cycle in graph.cycles()) == [["a", "b"], ["worker"]]
+    assert graph.connected_components() == [["web", "api", "db", "worker", "cache"], ["a", "b"]]
+
+    with pytest.raises(KeyError):
+        graph.upstream_closure(["nope"])
+
+
+def test_dependency_graph_long_chain():
+    # Long chains don't hit the recursion limit
+    chain = DependencyGraph(edges={f"s{i}": [f"s{i + 1}"] for i in range(5000)})
+    assert len(chain.levels()) == 5001
+    assert chain.cycles() == []
+
+
+def test_deps_command(tmp_path, capsys):
+    (tmp_path / "docker-compose.yaml").write_text(
+        "services:\n"
+        "  db:\n"
+        "    image: postgres\n"
+        "  web:\n"
+        "    image: web\n"
+        "    depends_on:\n"
+        "      db:\n"
+        "        condition: service_healthy\n"
+    )
+
+    main(["deps", "-y", (tmp_path / "docker-compose.yaml").as_posix(), "--downstream", "db", "--json"])
+    assert json.loads(capsys.readouterr().out) == {"downstream": ["web"]}
+
+    main(["deps", "-y", (tmp_path / "docker-compose.yaml").as_posix()])
+    assert capsys.readouterr().out == "levels:\n  0: db\n  1: web\ncycles: 0\n"
+
+
+def _write_web(tmp_path):
+    compose = tmp_path / "docker-compose.yaml"
+    compose.write_text(
+        "services:\n"
+        "  web:\n"
+        "    image: web\n"
+        "    ports: [8080:80]\n"
+        "    volumes: [/srv/web:/srv]\n"
+        "    networks: [frontend]\n"
+    )
+    return compose
+
+
+def test_service_nodes(tmp_path):
+    dcg = DockerComposeGraph(label_cache=LabelCache())
+    dcg.iterate_trees(dcg.iter_docker_compose(_write_web(tmp_path)))
+
+    assert dcg.get_service_node("web") == "NODE-SERVICE_web"
+    (cluster,) = [
+        subgraph for subgraph in dcg.cluster_root_services.get_subgraph_list()
+        if dcg.get_name(subgraph) == "cluster_cluster_service_web"
+    ]
+    assert cluster.get_node("NODE-SERVICE_web")
+    assert dcg.stats.counters["edges"] == 3
+
+    with pytest.raises(KeyError, match="'db'"):
+        dcg.get_service_node("db")
+
+
+def test_service_nodes_streaming(tmp_path):
+    # the same lookup when streaming
+    dcg = DockerComposeGraph(label_cache=LabelCache())
+    dcg.build_model(dcg.iter_docker_compose(_write_web(tmp_path)))
+    dcg.write_dot(io.StringIO())
+    assert dcg.get_service_node("web") == "NODE-SERVICE_web"
+
+
+def _build_missing_dependency(tmp_path):
+    (tmp_path / "docker-compose.yaml").write_text(
+        "services:\n"
+        "  web:\n"
+        "    image: web\n"
+        "    depends_on: [db, dbb]\n"
+        "  db:\n"
+        "    image: postgres\n"
+    )
+
+    dcg = DockerComposeGraph(label_cache=LabelCache())
+    dcg.build_model(dcg.iter_docker_compose(tmp_path / "docker-compose.yaml"))
+    return dcg
+
+
+def test_missing_dependencies_warning(tmp_path, caplog):
+    _build_missing_dependency(tmp_path)
+    assert "web depends on dbb, which is not declared" in caplog.text
+
+
+def test_missing_dependencies(tmp_path):
+    dcg = _build_missing_dependency(tmp_path)
+
+    stream = io.StringIO()
+    writer = dcg.write_dot(stream)
+
+    # drawn as a placeholder, with the edge to it
+    assert '"NODE-SERVICE_dbb" [' in stream.getvalue()
+    assert "missing" in stream.getvalue()
+    assert stream.getvalue().count('"PLUG_NODE-SERVICE_dbb":w') == 1
+    assert dcg.graph_size() == (writer.nodes, writer.edges) == (3, 2)
+
+
+def test_missing_dependencies_parts(tmp_path):
+    dcg = _build_missing_dependency(tmp_path)
+
+    # a dependency in another part is not missing
+    parts = make_parts(
+        {"web": ["web"], "db": ["db"]},
+        service_hashes=dcg.service_hashes,
+        model=dcg.model,
+        declared=dcg.declared_services,
+        outfile=tmp_path / "graph.dot",
+        formats=("dot",),
+    )
+    assert parts[0].declared == {"db"}
+
+
+def test_templates(tmp_path):
+    (tmp_path / "label.j2").write_text("{{ name }}")
+
+    registry = TemplateRegistry(search_path=tmp_path)
+    template = registry.get("label.j2")
+    assert registry.get("label.j2") is template
+    assert template.render(name="web") == "web"
+
+
+def test_templates_precompile(tmp_path):
+    (tmp_path / "label.j2").write_text("{{ name }}")
+
+    registry = TemplateRegistry(search_path=tmp_path)
+    compiled = registry.precompile(tmp_path / "compiled")
+    assert compiled == tmp_path / "compiled" / registry.source_hash()
+    assert [p.suffix for p in compiled.iterdir()] == [".py"]
+    assert registry.get("label.j2").render(name="web") == "web"
+
+    # Edited templates are compiled again
+    (tmp_path / "label.j2").write_text("<{{ name }}>")
+    recompiled = TemplateRegistry(search_path=tmp_path).precompile(tmp_path / "compiled")
+    assert recompiled != compiled
+    # ... next to the ones still used by others
+    assert sorted((tmp_path / "compiled").iterdir()) == sorted([compiled, recompiled])
+
+
+def test_templates_prune(tmp_path):
+    (tmp_path / "label.j2").write_text("{{ name }}")
+    compiled = TemplateRegistry(search_path=tmp_path).precompile(tmp_path / "compiled")
+
+    # Modules unused for a week are removed
+    os.utime(compiled, (0, 0))
+    (tmp_path / "label.j2").write_text("[{{ name }}]")
+    latest = TemplateRegistry(search_path=tmp_path).precompile(tmp_path / "compiled")
+    assert list((tmp_path / "compiled").iterdir()) == [latest]
+
+
+def test_templates_broken(tmp_path):
+    (tmp_path / "label.j2").write_text("[{{ name }}]")
+    latest = TemplateRegistry(search_path=tmp_path).precompile(tmp_path / "compiled")
+
+    # Broken templates are compiled in memory (and fail there)
+    (tmp_path / "broken.j2").write_text("{% if %}")
+    broken = TemplateRegistry(search_path=tmp_path)
+    assert broken.precompile(tmp_path / "compiled") is None
+    assert list((tmp_path / "compiled").iterdir()) == [latest]
+    assert broken.get("label.j2").render(name="web") == "[web]"
+
+
+def test_label_cache():
+    cache = LabelCache(max_size=2)
+    cache.put("a", "A")
+    cache.put("b", "B")
+    assert cache.get("a") == "A"
+    cache.put("c", "C")
+    assert (cache.get("b"), cache.get("a"), cache.get("c")) == (None, "A", "C")
+    assert (cache.hits, cache.misses) == (3, 1)
+
+
+def _write_write_dot_project(tmp_path):
+    compose = tmp_path / "docker-compose.yaml"
+    compose.write_text(
+        "services:\n"
+        "  web-1:\n"
+        "    image: nginx\n"
+        "    depends_on: [db]\n"
+        "    ports: [8080:80, 53:53/udp]\n"
+        "    volumes: [/srv/web:/srv:ro, data:/data]\n"
+        "    networks: [frontend, backend]\n"
+        "  db:\n"
+        "    image: postgres\n"
+        "    network_mode: host\n"
+    )
+    return compose
+
+
+def test_write_dot(tmp_path):
+    compose = _write_write_dot_project(tmp_path)
+
+    streamed = DockerComposeGraph(label_cache=LabelCache())
+    streamed.build_model(streamed.iter_docker_compose(compose))
+    stream = io.StringIO()
+    writer = streamed.write_dot(stream)
+
+    # never assembled
+    assert streamed.graph.get_subgraph_list() == []
+
+    dcg = DockerComposeGraph(label_cache=LabelCache())
+    dcg.iterate_trees(dcg.iter_docker_compose(compose))
+
+    assert stream.getvalue() == dcg.graph.to_string()
+    assert (writer.nodes, writer.edges) == dcg.count_graph(dcg.graph)
+
+
+def test_render_dot(tmp_path):
+    compose = _write_write_dot_project(tmp_path)
+
+    dcg = DockerComposeGraph(label_cache=LabelCache())
+    dcg.build_model(dcg.iter_docker_compose(compose))
+    stream = io.StringIO()
+    dcg.write_dot(stream)
+
+    outfile = tmp_path / "graph.dot"
+    render(parse_args(["-y", compose.as_posix(), "-o", outfile.as_posix(), "-f", "dot", "--no-cache"]))
+    assert outfile.read_text() == stream.getvalue()
+
+
+@pytest.fixture
+def watched(tmp_path):
+    (tmp_path / "docker-compose.override.yaml").write_text(
+        "services:\n  redis:\n    image: redis\n"
+    )
+    compose = tmp_path / "docker-compose.yaml"
+
+    stat_cache = StatCache()
+    label_cache = LabelCache()
+    model_cache = ModelCache()
+    builds = []
+
+    def build(changed):
+        model_cache.invalidate(changed)
+        dcg = DockerComposeGraph(cache=stat_cache, label_cache=label_cache, model_cache=model_cache)
+        dcg.iterate_trees(dcg.iter_docker_compose(compose))
+        builds.append(dcg)
+        return dcg.include_graph.order
+
+    def write(image="server"):
+        compose.write_text(
+            "include:\n  - path:\n      - ./docker-compose.override.yaml\n"
+            f"services:\n  server:\n    image: {image}\n"
+        )
+
+    return compose, write, build, builds, stat_cache, label_cache
+
+
+def test_watch_survives_broken_start(watched):
+    compose, write, build, builds, _, _ = watched
+
+    # a half-edited file at startup is survived
+    compose.write_text("services:\n  server: [\n")
+    watcher = Watcher(build=build, interval=0, debounce=0, files=[compose.resolve()])
+    assert not watcher.rebuild(set())
+    assert watcher.files == [compose.resolve()]
+
+    write()
+    assert watcher.changes() == {compose.resolve()}
+    assert watcher.rebuild(set())
+    assert watcher.changes() == set()
+
+
+def test_watch_incremental_rebuild(watched):
+    compose, write, build, builds, stat_cache, label_cache = watched
+
+    write()
+    watcher = Watcher(build=build, interval=0, debounce=0, files=[compose.resolve()])
+    assert watcher.rebuild(set())
+    stat_cache.hits = stat_cache.misses = 0
+
+    write("server:2")
+    changed = watcher.changes()
+    assert changed == {compose.resolve()}
+
+    watcher.rebuild(changed)
+
+    # only the changed file is parsed and visited, only
+    # the changed service is modelled and rendered again
+    assert (stat_cache.hits, stat_cache.misses) == (1, 1)
+    assert builds[-1].stats.counters["files_reused"] == 1
+    assert builds[-1].stats.counters["services_reused"] == 1
+    assert builds[-1].model["redis"] is builds[-2].model["redis"]
+    assert builds[-1].model["server"].image == "server:2"
+    assert builds[-1].stats.counters["labels_cached"] == 1
+    assert "server:2" in label_cache.get(builds[-1].label_hash(builds[-1].model["server"]))
+
+
+def test_watch_reloads_dotenv(tmp_path, monkeypatch):
+    compose = tmp_path / "docker-compose.yaml"
+    compose.write_text("services:\n  web:\n    image: nginx:${TAG:-latest}\n")
+    dot_env = tmp_path / ".env"
+    dot_env.write_text("TAG=1.0\n")
+    monkeypatch.delenv("TAG", raising=False)
+
+    builds = []
+
+    class FakeWatcher:
+        def __init__(self, build, **kwargs):
+            builds.append(build)
+
+        def run(self):
+            pass
+
+    monkeypatch.setattr("docker_compose_graph.docker_compose_graph.Watcher", FakeWatcher)
+
+    outfile = tmp_path / "graph.dot"
+    watch(parse_args([
+        "-y", compose.as_posix(), "-d", dot_env.as_posix(), "-o", outfile.as_posix(), "-f", "dot",
+        "--no-cache", "--watch",
+    ]))
+    build, = builds
+
+    build(set())
+    assert "nginx:1.0" in outfile.read_text()
+
+    # a variable removed from .env is unset again
+    dot_env.write_text("\n")
+    build({dot_env.resolve()})
+    assert "nginx:latest" in outfile.read_text()
+    assert "TAG" not in os.environ
+
+
+@pytest.fixture
+def interpolator():
+    return Interpolator(
+        environ={
+            "HOST": "example.com",
+            "EMPTY": "",
+            "PORT": "8080",
+        }
+    )
+
+
+def test_interpolation(interpolator):
+    assert interpolator.expand("$HOST:${PORT}") == "example.com:8080"
+    assert interpolator.expand("${UNSET}") == ""
+    assert interpolator.expand("$$HOST") == "$HOST"
+    assert interpolator.expand("${EMPTY:-default}") == "default"
+    assert interpolator.expand("${EMPTY-default}") == ""
+    assert interpolator.expand("${UNSET-${HOST}}") == "example.com"
+    assert interpolator.expand("${UNSET:-${ALSO_UNSET:-nested}}") == "nested"
+    assert interpolator.expand("${PORT:+set}") == "set"
+    assert interpolator.expand("${EMPTY+set}") == "set"
+    assert interpolator.expand("${EMPTY:+set}") == ""
+    assert interpolator.expand("${EMPTY?message}") == ""
+
+
+def test_interpolation_errors(interpolator):
+    with pytest.raises(InterpolationError, match="PORT_HOST is missing a value: port"):
+        interpolator.expand("${PORT_HOST:?port}:80")
+
+    with pytest.raises(InterpolationError):
+        interpolator.expand("${HOST")
+
+
+def test_interpolation_templates_bounded():
+    # long running processes see ever new templates
+    assert compile_template.cache_info().maxsize is not None
+
+
+def test_interpolate(interpolator):
+    assert repr(interpolator.interpolate(
+        {
+            "image": "nginx:${TAG:-latest}",
+            "ports": OverrideArray(array=["${PORT}:80"]),
+            "environment": {"A": "${HOST}"},
+        },
+        skip=("environment",),
+    )) == repr(
+        {
+            "image": "nginx:latest",
+            "ports": OverrideArray(array=["8080:80"]),
+            "environment": {"A": "${HOST}"},
+        }
+    )
+
+
+def test_batch_manifest(tmp_path):
+    manifest = tmp_path / "manifest.yaml"
+    manifest.write_text(
+        "- yaml: site-a/docker-compose.yaml\n"
+        "  outfile: out/site-a.dot\n"
+        "- yaml: missing/docker-compose.yaml\n"
+        "  outfile: out/missing.svg\n"
+        "  format: svg\n"
+    )
+
+    args = parse_args(["--manifest", manifest.as_posix(), "--format", "dot", "--no-cache"])
+    jobs = load_manifest(args.manifest, default_formats=args.formats)
+
+    assert args.batch
+    assert jobs == [
+        Job(
+            yaml=tmp_path / "site-a" / "docker-compose.yaml",
+            outfile=tmp_path / "out" / "site-a.dot",
+            formats=("dot",),
+        ),
+        Job(
+            yaml=tmp_path / "missing" / "docker-compose.yaml",
+            outfile=tmp_path / "out" / "missing.svg",
+            formats=("svg",),
+        ),
+    ]
+
+
+def test_batch_manifest_errors(tmp_path):
+    manifest = tmp_path / "manifest.yaml"
+
+    manifest.write_text("- yaml: site-a/docker-compose.yaml\n  outfile: out/site-a.pdf\n  format: pdf\n")
+    with pytest.raises(ValueError, match="unknown format"):
+        load_manifest(manifest)
+
+    manifest.write_text(
+        "- yaml: site-a/docker-compose.yaml\n  outfile: out/site.svg\n  format: svg\n"
+        "- yaml: site-b/docker-compose.yaml\n  outfile: out/site.svg\n  format: svg\n"
+    )
+    with pytest.raises(ValueError, match="both written to"):
+        load_manifest(manifest)
+
+
+def test_run_batch(tmp_path):
+    (tmp_path / "site-a").mkdir()
+    (tmp_path / "site-a" / "docker-compose.yaml").write_text(
+        "services:\n  server:\n    image: server\n"
+    )
+    manifest = tmp_path / "manifest.yaml"
+    manifest.write_text(
+        "- yaml: site-a/docker-compose.yaml\n"
+        "  outfile: out/site-a.dot\n"
+        "- yaml: missing/docker-compose.yaml\n"
+        "  outfile: out/missing.svg\n"
+        "  format: svg\n"
+    )
+
+    args = parse_args(["--manifest", manifest.as_posix(), "--format", "dot", "--no-cache"])
+    jobs = load_manifest(args.manifest, default_formats=args.formats)
+    results = run_batch(jobs=jobs, args=args, workers=2)
+
+    # failures are isolated per project
+    assert [r.job for r in results] == jobs
+    assert not results[1].ok
+    assert results[1].error.startswith("FileNotFoundError")
+    assert results[0].ok
+    assert (tmp_path / "out" / "site-a.dot").read_text().startswith("digraph")
+
+
+def test_jobs_from_args(tmp_path):
+    # projects in directories of the same name
+    yamls = [tmp_path / d / "docker-compose.yaml" for d in ("x/app", "y/app", "z/other")]
+    args = parse_args([arg for yaml in yamls for arg in ("-y", yaml.as_posix())] + ["-o", "out", "-f", "svg"])
+    assert [job.outfile.name for job in jobs_from_args(args)] == [
+        "x.app.docker-compose.svg",
+        "y.app.docker-compose.svg",
+        "other.docker-compose.svg",
+    ]
+    with pytest.raises(ValueError, match="same output"):
+        jobs_from_args(parse_args(["-y", yamls[0].as_posix(), "-y", yamls[0].as_posix(), "-o", "out", "-f", "svg"]))
+
+
+@pytest.fixture
+def graphviz_calls(monkeypatch):
+    calls = []
+
+    def fake_run_graphviz(outputs, source, prog="dot", engine=None, timeout=None):
+        calls.append((outputs, source))
+        for path in outputs.values():
+            path.write_text(source.read_text() if isinstance(source, pathlib.Path) else "")
+
+    monkeypatch.setattr("docker_compose_graph.docker_compose_graph.run_graphviz", fake_run_graphviz)
+    return calls
+
+
+def test_render_formats(tmp_path, graphviz_calls):
+    compose = tmp_path / "docker-compose.yaml"
+    compose.write_text("services:\n  server:\n    image: server\n")
+
+    args = parse_args(["-y", compose.as_posix(), "-o", (tmp_path / "graph.svg").as_posix(), "-f", "svg", "png", "dot"])
+    dcg = render(args)
+
+    # one layout for all formats, from the DOT just written
+    assert graphviz_calls == [
+        ({"svg": tmp_path / "graph.svg", "png": tmp_path / "graph.png"}, tmp_path / "graph.dot"),
+    ]
+    assert (tmp_path / "graph.png").read_text() == (tmp_path / "graph.dot").read_text()
+    assert dcg.stats.counters["nodes"] == 1
+    for suffix in ("svg", "png", "dot"):
+        assert (tmp_path / f"graph.{suffix}.sha256").read_text().strip() == dcg.project_hash(suffix, "auto")
+
+
+def test_render_pipes_source(tmp_path, graphviz_calls):
+    compose = tmp_path / "docker-compose.yaml"
+    compose.write_text("services:\n  server:\n    image: server\n")
+
+    # without dot, the source is piped to Graphviz
+    (tmp_path / "single.svg").write_text("stale")
+    render(parse_args(["-y", compose.as_posix(), "-o", (tmp_path / "single.svg").as_posix(), "-f", "svg"]))
+    assert len(graphviz_calls) == 1 and callable(graphviz_calls[0][1])
+
+
+def test_output_paths(tmp_path):
+    assert output_paths(tmp_path / "graph", ["svg"]) == {"svg": tmp_path / "graph"}
+    assert output_paths(tmp_path / "graph", ["svg", "png"]) == {
+        "svg": tmp_path / "graph.svg",
+        "png": tmp_path / "graph.png",
+    }
+
+
+def test_run_graphviz(tmp_path):
+    (tmp_path / "graph.dot").write_text("digraph G {}\n")
+
+    # one Graphviz process, every -T/-o pair on its command line
+    fake_dot = tmp_path / "dot"
+    fake_dot.write_text(
+        f"#!{sys.executable}\n"
+        "import sys\n"
+        "args = sys.argv[1:]\n"
+        "source = open(args[-1]).read() if not args[-1].startswith('-') else sys.stdin.read()\n"
+        "for arg in args:\n"
+        "    if arg.startswith('-o'):\n"
+        "        open(arg[2:], 'w').write(source)\n"
+    )
+    fake_dot.chmod(0o755)
+    out = {"svg": tmp_path / "real.svg", "png": tmp_path / "real.png"}
+    run_graphviz(out, source=tmp_path / "graph.dot", prog=fake_dot.as_posix())
+    assert all(path.read_text() == "digraph G {}\n" for path in out.values())
+    run_graphviz(out, source=lambda stream: stream.write("digraph {}\n"), prog=fake_dot.as_posix())
+    assert all(path.read_text() == "digraph {}\n" for path in out.values())
+
+
+def test_run_graphviz_timeout(tmp_path):
+    (tmp_path / "graph.dot").write_text("digraph G {}\n")
+
+    # a hanging Graphviz is killed
+    slow = tmp_path / "slow"
+    slow.write_text("#!/bin/sh\nsleep 10\n")
+    slow.chmod(0o755)
+    started = time.monotonic()
+    with pytest.raises(GraphvizTimeout):
+        run_graphviz({"svg": tmp_path / "slow.svg"}, source=tmp_path / "graph.dot", prog=slow.as_posix(), timeout=0.2)
+    assert time.monotonic() - started < 5
+
+
+@pytest.fixture
+def render_writes(tmp_path, monkeypatch):
+    compose = tmp_path / "docker-compose.yaml"
+    compose.write_text("services:\n  server:\n    image: server\n  redis:\n    image: redis\n")
+    outfile = tmp_path / "graph.svg"
+
+    writes = []
+
+    def fake_run_graphviz(outputs, source, prog="dot", engine=None, timeout=None):
+        for format_, path in outputs.items():
+            writes.append(format_)
+            path.write_text(format_)
+
+    monkeypatch.setattr("docker_compose_graph.docker_compose_graph.run_graphviz", fake_run_graphviz)
+
+    def render_(*extra):
+        args = parse_args(["-y", compose.as_posix(), "-o", outfile.as_posix(), "-f", "svg", "--no-cache", *extra])
+        return render(args)
+
+    return compose, render_, writes
+
+
+def test_render_skips_unchanged(tmp_path, render_writes):
+    _, render_, writes = render_writes
+
+    first = render_()
+    assert writes == ["svg"]
+    assert (tmp_path / "graph.svg.sha256").read_text().strip() == first.project_hash("svg", "auto")
+
+    second = render_()
+    assert writes == ["svg"]
+    assert second.stats.counters["writes_skipped"] == 1
+
+    render_("--force")
+    assert writes == ["svg", "svg"]
+
+
+def test_render_edited_templates(render_writes, monkeypatch):
+    _, render_, writes = render_writes
+    render_()
+
+    # edited label templates are written again
+    with monkeypatch.context() as m:
+        m.setattr(TEMPLATES, "source_hash", lambda: "edited")
+        render_()
+    assert writes == ["svg", "svg"]
+    render_()
+    assert writes == ["svg", "svg", "svg"]
+
+
+def test_render_changed_service(render_writes):
+    compose, render_, writes = render_writes
+    first = render_()
+
+    # key order does not matter, values do
+    compose.write_text("services:\n  redis:\n    image: redis:7\n  server:\n    image: server\n")
+    changed = render_()
+    assert writes == ["svg", "svg"]
+    assert changed.service_hashes["server"] == first.service_hashes["server"]
+    assert changed.service_hashes["redis"] != first.service_hashes["redis"]
+
+
+def test_render_yaml_keys(render_writes):
+    compose, render_, _ = render_writes
+
+    # YAML 1.1 bool keys next to strings
+    compose.write_text("services:\n  server:\n    image: server\n    environment:\n      ON: '1'\n      FOO: bar\n")
+    assert render_().model["server"].environment == {True: "1", "FOO": "bar"}
+
+
+def test_content_hash():
+    assert content_hash({"a": 1, "b": [1, 2]}) == content_hash({"b": [1, 2], "a": 1})
+    assert content_hash({"b": [1, 2]}) != content_hash({"b": [2, 1]})
+
+    # YAML 1.1 bool and int keys next to strings
+    assert content_hash({True: "1", "FOO": "bar", 8080: 1}) == content_hash({8080: 1, "FOO": "bar", True: "1"})
+    assert content_hash({True: "1"}) != content_hash({"true": "1"})
+    assert content_hash({8080: 1}) != content_hash({"8080": 1})
+
+
+def test_plan_layouts():
+    assert [p.name for p in plan_layouts(10, 10)] == ["dot", "dot-fast", "sfdp"]
+    assert [p.name for p in plan_layouts(FAST_LAYOUT_SIZE, 1)] == ["dot-fast", "sfdp"]
+    assert [p.name for p in plan_layouts(SFDP_LAYOUT_SIZE, 1)] == ["sfdp"]
+    assert [p.name for p in plan_layouts(SFDP_LAYOUT_SIZE, 1, engine="dot")] == ["dot", "dot-fast", "sfdp"]
+    assert [p.name for p in plan_layouts(10, 10, engine="neato")] == ["neato", "sfdp"]
+    with pytest.raises(ValueError):
+        plan_layouts(10, 10, engine="circo")
+
+
+@pytest.fixture
+def layout_calls(tmp_path, monkeypatch):
+    compose = tmp_path / "docker-compose.yaml"
+    compose.write_text(
+        "services:\n"
+        "  server:\n"
+        "    image: server\n"
+        "    environment:\n"
+        "      SECRET_KEY: abc\n"
+        "    ports:\n"
+        "      - 8080:80\n"
+        "    volumes:\n"
+        "      - ./data:/data\n"
+        "      - /tmp/scratch\n"
+        "    depends_on:\n"
+        "      - redis\n"
+        "  redis:\n"
+        "    image: redis\n"
+    )
+
+    calls = []
+
+    def fake_run_graphviz(outputs, source, prog="dot", engine=None, timeout=None):
+        dot = io.StringIO()
+        source(dot)
+        calls.append((engine, timeout, dot.getvalue()))
+        if len(calls) == 1:
+            raise GraphvizTimeout("killed")
+        for path in outputs.values():
+            path.write_text(dot.getvalue())
+
+    monkeypatch.setattr("docker_compose_graph.docker_compose_graph.run_graphviz", fake_run_graphviz)
+
+    args = parse_args([
+        "-y", compose.as_posix(), "-o", (tmp_path / "graph.svg").as_posix(), "-f", "svg",
+        "--no-cache", "--render-timeout", "0.5",
+    ])
+    return args, calls
+
+
+def test_layout_fallback(tmp_path, layout_calls):
+    args, calls = layout_calls
+    dcg = render(args)
+
+    # the model counts match what is written
+    assert dcg.graph_size() == (dcg.stats.counters["nodes"], dcg.stats.counters["edges"]) == (4, 3)
+
+    # timed out with the full labels, retried with compact ones
+    assert [(engine, timeout) for engine, timeout, _ in calls] == [("dot", 0.5), ("dot", 0.5)]
+    assert "SECRET_KEY" in calls[0][2] and "SECRET_KEY" not in calls[1][2]
+    assert "mclimit=0.1" in calls[1][2]
+    assert dcg.stats.counters["layout_timeouts"] == 1
+    assert dcg.stats.counters["layout_dot-fast"] == 1
+    # the fallback layout is not kept ...
+    assert not (tmp_path / "graph.svg.sha256").exists()
+
+
+def test_layout_fallback_retried(tmp_path, layout_calls):
+    args, calls = layout_calls
+    render(args)
+
+    # ... the next run retries the full one
+    dcg = render(args)
+    assert [engine for engine, _, _ in calls] == ["dot", "dot", "dot"]
+    assert "SECRET_KEY" in calls[2][2]
+    assert dcg.stats.counters["layout_dot"] == 1
+    assert (tmp_path / "graph.svg.sha256").exists()
+
+
 def test_iterate_trees():
     dcg = DockerComposeGraph(
         expandvars=True,
@@ -407,3 +1717,111 @@ def test_iterate_trees():
 #     main(["7"])
 #     captured = capsys.readouterr()
 #     assert "The 7-th Fibonacci number is 13" in captured.out
+
+
+
+def _write_partitioned_project(tmp_path):
+    (tmp_path / "sub").mkdir()
+    (tmp_path / "sub" / "compose.yaml").write_text(
+        "services:\n"
+        "  worker:\n"
+        "    image: worker\n"
+        "    depends_on: [queue]\n"
+        "  queue:\n"
+        "    image: queue\n"
+    )
+    compose = tmp_path / "docker-compose.yaml"
+    compose.write_text(
+        "include:\n"
+        "  - sub/compose.yaml\n"
+        "services:\n"
+        "  web:\n"
+        "    image: web\n"
+        "    networks: [front, back]\n"
+        "    depends_on: [api]\n"
+        "  api:\n"
+        "    image: api\n"
+        "    networks: [back]\n"
+        "  cron:\n"
+        "    image: cron\n"
+    )
+    return compose
+
+
+def test_partition_model(tmp_path):
+    compose = _write_partitioned_project(tmp_path)
+    dcg = DockerComposeGraph(label_cache=LabelCache())
+    dcg.build_model(dcg.iter_docker_compose(yaml=compose))
+
+    assert partition_model(dcg.model, by="network") == {
+        "front": ["web"],
+        "back": ["web", "api"],
+        "default": ["cron", "worker", "queue"],
+    }
+    assert partition_model(dcg.model, by="component") == {
+        "component-web": ["web", "api"],
+        "component-worker": ["worker", "queue"],
+        STANDALONE: ["cron"],
+    }
+    assert dcg.extracted["source"]["queue"] == (tmp_path / "sub" / "compose.yaml").resolve()
+    with pytest.raises(ValueError):
+        partition_model(dcg.model, by="file")
+
+
+def test_partition_standalone_name():
+    # a service named like the part of the standalone services
+    model = build_services([
+        {"service_name": "standalone", "service_config": {"depends_on": ["db"]}},
+        {"service_name": "db", "service_config": {}},
+        {"service_name": "cron", "service_config": {}},
+    ])
+    assert partition_model(model, by="component") == {
+        "component-standalone": ["standalone", "db"],
+        STANDALONE: ["cron"],
+    }
+
+
+def _partition_args(tmp_path):
+    compose = _write_partitioned_project(tmp_path)
+    # the output directory is created
+    outfile = tmp_path / "out" / "graph.dot"
+    return ["-y", compose.as_posix(), "-o", outfile.as_posix(), "-f", "dot", "--partition", "file", "--no-cache", "-j", "2"]
+
+
+def test_partition(tmp_path, capsys):
+    main(_partition_args(tmp_path))
+
+    # one graph per declaring file, with its services only
+    main_part = (tmp_path / "out" / "graph.docker-compose.yaml.dot").read_text()
+    sub_part = (tmp_path / "out" / "graph.sub_compose.yaml.dot").read_text()
+    assert "NODE-SERVICE_web" in main_part and "NODE-SERVICE_worker" not in main_part
+    assert "NODE-SERVICE_worker" in sub_part and "NODE-SERVICE_web" not in sub_part
+
+    index = (tmp_path / "out" / "graph.index.md").read_text()
+    assert "| sub/compose.yaml | 2 | [dot](graph.sub_compose.yaml.dot) |" in index
+    assert "2 parts succeeded, 0 failed" in capsys.readouterr().out
+
+
+def test_partition_skips_unchanged(tmp_path, capsys):
+    args = _partition_args(tmp_path)
+    main(args)
+    capsys.readouterr()
+
+    # unchanged parts are not written again
+    main(args)
+    assert capsys.readouterr().out.count("skipped") == 2
+
+
+def test_partition_index(tmp_path):
+    write_index(tmp_path / "index.html", [
+        PartResult(name="a<b", services=1, outputs={"svg": tmp_path / "a b.svg"}, ok=True, seconds=0.1),
+        PartResult(name="c", services=2, outputs={}, ok=False, seconds=0.0, error="GraphvizTimeout: killed"),
+    ], title="graph")
+    index = (tmp_path / "index.html").read_text()
+    assert '<td>a&lt;b</td><td>1</td><td><a href="a%20b.svg">svg</a></td>' in index
+    assert "FAILED: GraphvizTimeout: killed" in index
+
+
+def test_partition_watch_rejected():
+    with pytest.raises(SystemExit):
+        parse_args(["-y", "docker-compose.yaml", "-o", "graph.dot", "-f", "dot", "--partition", "network", "--watch"])